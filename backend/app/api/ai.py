@@ -7,7 +7,9 @@ from sqlalchemy.orm import Session
 
 from core.deps import get_db, get_current_user
 from db import models
+from core.config import settings
 from services.insights import build_portfolio_snapshot, generate_insight_text
+from services.result_cache import portfolio_version, result_cache
 from uuid import UUID
 
 router = APIRouter()
@@ -30,12 +32,18 @@ def portfolio_insights(
 
     start = datetime.fromisoformat(from_) if from_ else None
     end = datetime.fromisoformat(to) if to else None
-    snap = build_portfolio_snapshot(db, portfolio_id, start, end, benchmark)
-    text = generate_insight_text(snap)
-    return {
-        "portfolio_id": portfolio_id,
-        "benchmark": snap["benchmark"]["symbol"],
-        "generated_at": snap["generated_at"],
-        "snapshot": snap,         # echo the numbers used (frontend can show details)
-        "insight": text,          # the plain-English summary
-    }
+
+    def compute() -> dict:
+        snap = build_portfolio_snapshot(db, portfolio_id, start, end, benchmark)
+        text = generate_insight_text(snap)
+        return {
+            "portfolio_id": portfolio_id,
+            "benchmark": snap["benchmark"]["symbol"],
+            "generated_at": snap["generated_at"],
+            "snapshot": snap,         # echo the numbers used (frontend can show details)
+            "insight": text,          # the plain-English summary
+        }
+    # same data, same insight: repeated views don't rebuild the snapshot or call the LLM again
+    sym = (benchmark or settings.default_benchmark or "").strip().upper()
+    version = portfolio_version(db, portfolio_id, sym or None)
+    return result_cache.get_or_compute("insights", (portfolio_id, from_, to, sym, settings.ai_model, version), compute)
@@ -1,18 +1,32 @@
 # app/api/analytics.py
 from __future__ import annotations
+import time
 from typing import List, Optional
 from datetime import datetime
 
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 
 from core.deps import get_db, get_current_user
 from db import models
 from services import indicators as ind
+from services import indicator_state as ind_state
 from services.analytics import (
-    equity_curve_from_holdings, pct_returns, max_drawdown,
-    annualized_stats, cagr, sharpe_sortino, benchmark_series
+    benchmark_arrays, benchmark_data, equity_curves_batch, holding_quantities, relative_to_benchmark,
 )
+from services.daily_values import daily_values
+from services.downsample import keep_indices
+from services.metrics import TRADING_DAYS, Metrics, compute_metrics
+from services.price_store import price_store, timestamps
+from services.result_cache import portfolio_version, result_cache
+from services.risk import covariance_model, ledoit_wolf, position_values, returns_matrix, risk_contributions, sample_covariance
+from services import attribution
+from services import optimize as opt
+from services import screener as screen_svc
+from services import var as var_engine
+from services.rolling import align_to, rolling_metrics
+from services.valuation import money_weighted, twr_index
 from core.config import settings
 from uuid import UUID
 
@@ -32,45 +46,129 @@ def _parse_csv_ints(s: Optional[str]) -> List[int]:
             pass
     return out
 
+def _parse_csv_floats(s: str) -> List[float]:
+    try:
+        return [float(tok) for tok in s.split(",") if tok.strip()]
+    except ValueError:
+        return []
+
+_LAYOUTS = ("points", "columns")
+
 @router.get("/indicators/{instrument_id}")
 def get_indicators(
     instrument_id: int,
     sma: Optional[str] = Query(None, description="comma-separated windows, e.g. 20,50"),
     ema: Optional[str] = Query(None, description="comma-separated windows, e.g. 200"),
-    rsi: Optional[int] = Query(None, description="period, e.g. 14"),
+    rsi: Optional[str] = Query(None, description="comma-separated periods, e.g. 14"),
+    macd: Optional[str] = Query(None, description="fast,slow,signal, e.g. 12,26,9"),
+    bb: Optional[str] = Query(None, description="Bollinger window[,k], e.g. 20,2"),
+    atr: Optional[int] = Query(None, ge=1, description="period, e.g. 14"),
+    obv: bool = False,
+    layout: str = Query("points", description="points: [{ts, v}] per indicator | columns: one ts array plus value arrays"),
     from_: Optional[str] = Query(None, alias="from"),
     to: Optional[str] = None,
+    max_points: Optional[int] = Query(None, ge=2, description="LTTB-downsample each series to this many points"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
     inst = db.get(models.Instrument, instrument_id)
     if not inst:
         raise HTTPException(404, "Instrument not found")
+    if layout not in _LAYOUTS:
+        raise HTTPException(400, f"layout must be one of {', '.join(_LAYOUTS)}")
+
+    spec = ind.IndicatorSpec(
+        sma=[w for w in _parse_csv_ints(sma) if w > 0],
+        ema=[w for w in _parse_csv_ints(ema) if w > 0],
+        rsi=[p for p in _parse_csv_ints(rsi) if p > 0],
+        atr=atr,
+        obv=obv,
+    )
+    if macd:
+        m = _parse_csv_ints(macd)
+        if len(m) != 3 or min(m) < 1:
+            raise HTTPException(400, "macd must be fast,slow,signal, e.g. 12,26,9")
+        spec.macd = (m[0], m[1], m[2])
+    if bb:
+        b = _parse_csv_floats(bb)
+        if not 1 <= len(b) <= 2 or b[0] < 1 or b[0] != int(b[0]):
+            raise HTTPException(400, "bb must be window[,k], e.g. 20,2")
+        spec.bollinger = (int(b[0]), b[1] if len(b) == 2 else 2.0)
+
+    full = price_store.get(db, instrument_id)
+    prices = full.slice(
+        datetime.fromisoformat(from_) if from_ else None,
+        datetime.fromisoformat(to) if to else None,
+    )
+    ts = prices.timestamps()
+    # everything is measured from the first bar, so values don't move with `from`:
+    # sma/ema/rsi come from their stored series, the rest is computed and cut to the range
+    names = [f"sma_{w}" for w in spec.sma] + [f"ema_{w}" for w in spec.ema] + [f"rsi_{p}" for p in spec.rsi]
+    stored = ind_state.read(db, instrument_id, names, prices.days)
+    spec.sma = [w for w in spec.sma if f"sma_{w}" not in stored]
+    spec.ema = [w for w in spec.ema if f"ema_{w}" not in stored]
+    spec.rsi = [p for p in spec.rsi if f"rsi_{p}" not in stored]
+    k0 = int(np.searchsorted(full.days, prices.days[0])) if len(prices) else 0
+    computed = {name: v[k0:k0 + len(prices)] for name, v in ind.compute(full, spec).items()}
+    cols = {n: stored[n] if n in stored else computed.pop(n) for n in dict.fromkeys(names)}
+    cols.update(computed)
+    resp = {"instrument_id": instrument_id, "count": len(ts), "indicators": {}}
 
-    q = db.query(models.Price).filter(models.Price.instrument_id == instrument_id)
-    if from_:
-        q = q.filter(models.Price.ts >= datetime.fromisoformat(from_))
-    if to:
-        q = q.filter(models.Price.ts <= datetime.fromisoformat(to))
-    rows = q.order_by(models.Price.ts.asc()).all()
-    closes = [(r.ts, float(r.close)) for r in rows]
-
-    resp = {"instrument_id": instrument_id, "count": len(closes), "indicators": {}}
-
-    for w in _parse_csv_ints(sma):
-        resp["indicators"][f"sma_{w}"] = [{"ts": ts, "v": val} for ts, val in ind.sma(closes, w)]
-    for w in _parse_csv_ints(ema):
-        resp["indicators"][f"ema_{w}"] = [{"ts": ts, "v": val} for ts, val in ind.ema(closes, w)]
-    if rsi and rsi > 0:
-        resp["indicators"][f"rsi_{rsi}"] = [{"ts": ts, "v": val} for ts, val in ind.rsi(closes, rsi)]
+    if layout == "columns":
+        # one shared set of rows, picked on the close
+        keep = keep_indices(ts, prices.close.tolist(), max_points)
+        idx = np.arange(len(ts)) if keep is None else np.asarray(keep, dtype=np.int64)
+        resp["ts"] = [ts[i] for i in idx.tolist()]
+        for name, v in cols.items():
+            resp["indicators"][name] = [None if x != x else x for x in v[idx].tolist()]
+        return resp
+
+    for name, v in cols.items():
+        vals = [None if x != x else x for x in v.tolist()]
+        keep = keep_indices(ts, vals, max_points)
+        idx = keep if keep is not None else range(len(ts))
+        resp["indicators"][name] = [{"ts": ts[i], "v": vals[i]} for i in idx]
     return resp
 
+_MODES = ("holdings", "transactions")
+
+def _portfolio_curve(db: Session, portfolio_id: UUID, mode: str, start, end):
+    """
+    (days, values, growth, extra metrics) for a performance mode, read from
+    the stored daily values.
+    `growth` is what returns, drawdown and CAGR are measured on: the curve
+    itself for holdings, the time-weighted growth of 1 for transactions.
+    """
+    if mode not in _MODES:
+        raise HTTPException(400, f"mode must be one of {', '.join(_MODES)}")
+    days, value, flow, _ = daily_values(db, portfolio_id, mode, start, end)
+    if mode == "holdings":
+        return days, value, value, {}
+    growth = twr_index(value, flow)
+    extra = {
+        "twr": float(growth[-1] / growth[0] - 1.0) if len(growth) else 0.0,
+        "mwr": money_weighted(days, value, flow),
+    }
+    return days, value, growth, extra
+
+def _metrics_payload(ts: list, m: Metrics, risk_free: float, extra: dict, i: Optional[int] = None) -> dict:
+    return {
+        "start": ts[0] if ts else None,
+        "end": ts[-1] if ts else None,
+        "days": (ts[-1] - ts[0]).days if len(ts) >= 2 else 0,
+        **m.summary(i),
+        "risk_free_rate_annual": risk_free,
+        **extra,
+    }
+
 @router.get("/portfolios/{portfolio_id}/performance")
 def portfolio_performance(
     portfolio_id: UUID,
     benchmark: Optional[str] = Query(None, description="e.g. SPY"),
     from_: Optional[str] = Query(None, alias="from"),
     to: Optional[str] = None,
+    mode: str = Query("holdings", description="holdings (current quantities) | transactions (replay the transaction log)"),
+    max_points: Optional[int] = Query(None, ge=2, description="LTTB-downsample the returned series; metrics use every point"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -83,44 +181,97 @@ def portfolio_performance(
 
     start = datetime.fromisoformat(from_) if from_ else None
     end = datetime.fromisoformat(to) if to else None
+    sym = (benchmark or settings.default_benchmark or "").strip().upper()
+    version = portfolio_version(db, portfolio_id, sym or None)
+    return result_cache.get_or_compute(
+        "performance",
+        (portfolio_id, from_, to, mode, max_points, sym, settings.risk_free_rate_annual, version),
+        lambda: _performance(db, portfolio_id, start, end, mode, max_points, sym),
+    )
 
-    curve = equity_curve_from_holdings(db, portfolio_id, start, end)
-    rets = pct_returns(curve)
-    stats = annualized_stats(rets)
-    mdd = max_drawdown(curve)
+def _performance(db: Session, portfolio_id: UUID, start, end, mode: str, max_points: Optional[int], sym: str) -> dict:
+    days, values, growth, extra = _portfolio_curve(db, portfolio_id, mode, start, end)
     risk_free = settings.risk_free_rate_annual
-    sharpe, sortino = sharpe_sortino(rets, risk_free)
-    cg = cagr(curve)
+    m = compute_metrics(growth, days, risk_free)
+    ts = timestamps(days)
+
+    shown = range(len(days))
+    rets, dd = np.nan_to_num(m.returns), m.drawdown
+    keep = keep_indices(days, values, max_points)
+    if keep is not None:
+        # returns are recompounded between the kept points
+        shown = keep
+        rets = np.nan_to_num(compute_metrics(growth[keep], days[keep]).returns)
+        dd = dd[keep]
+    vals = values.tolist()
 
     payload = {
         "portfolio_id": portfolio_id,
-        "series": [{"ts": p.ts, "value": p.value} for p in curve],
-        "returns": [{"ts": ts, "ret": r} for ts, r in rets],
-        "metrics": {
-            "start": curve[0].ts if curve else None,
-            "end": curve[-1].ts if curve else None,
-            "days": (curve[-1].ts - curve[0].ts).days if len(curve) >= 2 else 0,
-            "cagr": cg,
-            "ann_return": stats["mu"],
-            "ann_vol": stats["sigma"],
-            "sharpe": sharpe,
-            "sortino": sortino,
-            "max_drawdown": mdd,
-            "risk_free_rate_annual": risk_free,
-        },
+        "series": [{"ts": ts[i], "value": vals[i]} for i in shown],
+        "returns": [{"ts": ts[i], "ret": r} for i, r in zip(shown, rets.tolist())],
+        "drawdown": [{"ts": ts[i], "dd": d} for i, d in zip(shown, dd.tolist())],
+        "metrics": _metrics_payload(ts, m, risk_free, extra),
     }
 
-    sym = (benchmark or settings.default_benchmark or "").strip().upper()
     if sym:
-        b_series = benchmark_series(db, sym, start, end)
-        payload["benchmark"] = {"symbol": sym, "series": [{"ts": p.ts, "value": p.value} for p in b_series]}
+        bench = benchmark_data(db, sym)
+        b_days, b_close = bench.window(start, end)
+        b_ts = timestamps(b_days)
+        shown = keep_indices(b_ts, b_close.tolist(), max_points) or range(len(b_days))
+        payload["benchmark"] = {
+            "symbol": sym,
+            "series": [{"ts": b_ts[i], "value": float(b_close[i])} for i in shown],
+            "metrics": relative_to_benchmark(days, growth, bench, risk_free),
+        }
     return payload
 
+@router.get("/portfolios/stats")
+def portfolios_stats(
+    ids: Optional[str] = Query(None, description="comma-separated portfolio ids; all of the caller's when omitted"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """Holdings-mode stats of many portfolios, valued together from one price load."""
+    mine = (
+        db.query(models.Portfolio.id, models.Portfolio.name)
+        .join(models.Account)
+        .filter(models.Account.user_id == current_user.id)
+        .order_by(models.Portfolio.created_at.desc())
+        .all()
+    )
+    names = dict(mine)
+    if ids:
+        try:
+            wanted = list(dict.fromkeys(UUID(tok.strip()) for tok in ids.split(",") if tok.strip()))
+        except ValueError:
+            raise HTTPException(400, "ids must be comma-separated portfolio ids")
+        if any(pid not in names for pid in wanted):
+            raise HTTPException(404, "Portfolio not found")
+    else:
+        wanted = [pid for pid, _ in mine]
+
+    start = datetime.fromisoformat(from_) if from_ else None
+    end = datetime.fromisoformat(to) if to else None
+    risk_free = settings.risk_free_rate_annual
+    metrics = {}
+    for g in equity_curves_batch(db, wanted, start, end):
+        m = compute_metrics(g.values, g.days, risk_free)
+        ts = timestamps(g.days)
+        starts = np.isfinite(g.values).argmax(axis=0) if len(g.days) else np.zeros(len(g.portfolio_ids), dtype=int)
+        for k, pid in enumerate(g.portfolio_ids):
+            metrics[pid] = _metrics_payload(ts[int(starts[k]):], m, risk_free, {}, k)
+    return {
+        "portfolios": [{"portfolio_id": pid, "name": names[pid], "metrics": metrics[pid]} for pid in wanted],
+    }
+
 @router.get("/portfolios/{portfolio_id}/stats")
 def portfolio_stats(
     portfolio_id: UUID,
     from_: Optional[str] = Query(None, alias="from"),
     to: Optional[str] = None,
+    mode: str = Query("holdings", description="holdings | transactions"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
@@ -133,24 +284,435 @@ def portfolio_stats(
 
     start = datetime.fromisoformat(from_) if from_ else None
     end = datetime.fromisoformat(to) if to else None
-    curve = equity_curve_from_holdings(db, portfolio_id, start, end)
-    rets = pct_returns(curve)
-    stats = annualized_stats(rets)
-    mdd = max_drawdown(curve)
-    risk_free = settings.risk_free_rate_annual
-    sharpe, sortino = sharpe_sortino(rets, risk_free)
+    def compute() -> dict:
+        days, _, growth, extra = _portfolio_curve(db, portfolio_id, mode, start, end)
+        risk_free = settings.risk_free_rate_annual
+        m = compute_metrics(growth, days, risk_free)
+        return {
+            "portfolio_id": portfolio_id,
+            "metrics": _metrics_payload(timestamps(days), m, risk_free, extra),
+        }
+    version = portfolio_version(db, portfolio_id)
+    return result_cache.get_or_compute(
+        "stats", (portfolio_id, from_, to, mode, settings.risk_free_rate_annual, version), compute,
+    )
+
+_MAX_WINDOWS = 8
+
+def _parse_windows(windows: str) -> List[int]:
+    ws = sorted(set(_parse_csv_ints(windows)))
+    if not ws or ws[0] < 2 or len(ws) > _MAX_WINDOWS:
+        raise HTTPException(400, f"windows must be 1 to {_MAX_WINDOWS} comma-separated integers >= 2")
+    return ws
+
+def _rolling_payload(db: Session, days, values, windows: List[int], sym: str, start, end, max_points: Optional[int]) -> dict:
+    """Rolling statistics of a value curve, one entry per window; rows before a full window are left out."""
+    bench = None
+    if sym:
+        b_days, b_close = benchmark_arrays(db, sym, start, end)
+        bench = align_to(days, b_days, b_close)
+    ts = timestamps(days)
+    out = {}
+    for w, stats in rolling_metrics(values, windows, settings.risk_free_rate_annual, bench).items():
+        out[str(w)] = {}
+        for name, arr in stats.items():
+            pts = [(ts[i], None if np.isnan(v) else v) for i, v in enumerate(arr.tolist()) if i >= w]
+            keep = keep_indices([t for t, _ in pts], [v for _, v in pts], max_points)
+            if keep is not None:
+                pts = [pts[i] for i in keep]
+            out[str(w)][name] = [{"ts": t, "v": v} for t, v in pts]
+    return {
+        "benchmark": sym or None,
+        "risk_free_rate_annual": settings.risk_free_rate_annual,
+        "windows": out,
+    }
+
+@router.get("/portfolios/{portfolio_id}/rolling")
+def portfolio_rolling(
+    portfolio_id: UUID,
+    windows: str = Query("21,63,252", description="comma-separated window lengths in trading days"),
+    benchmark: Optional[str] = Query(None, description="for rolling beta, e.g. SPY"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    mode: str = Query("holdings", description="holdings | transactions"),
+    max_points: Optional[int] = Query(None, ge=2, description="LTTB-downsample each returned series"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    portfolio = db.get(models.Portfolio, portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    account = db.get(models.Account, portfolio.account_id)
+    if account.user_id != current_user.id:
+        raise HTTPException(403, "Forbidden")
+
+    ws = _parse_windows(windows)
+    start = datetime.fromisoformat(from_) if from_ else None
+    end = datetime.fromisoformat(to) if to else None
+    sym = (benchmark or settings.default_benchmark or "").strip().upper()
+
+    def compute() -> dict:
+        days, _, growth, _ = _portfolio_curve(db, portfolio_id, mode, start, end)
+        return {"portfolio_id": portfolio_id, **_rolling_payload(db, days, growth, ws, sym, start, end, max_points)}
+    version = portfolio_version(db, portfolio_id, sym or None)
+    return result_cache.get_or_compute(
+        "rolling", (portfolio_id, from_, to, mode, tuple(ws), sym, max_points, settings.risk_free_rate_annual, version), compute,
+    )
+
+@router.get("/instruments/{instrument_id}/rolling")
+def instrument_rolling(
+    instrument_id: int,
+    windows: str = Query("21,63,252", description="comma-separated window lengths in trading days"),
+    benchmark: Optional[str] = Query(None, description="for rolling beta, e.g. SPY"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    max_points: Optional[int] = Query(None, ge=2, description="LTTB-downsample each returned series"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    inst = db.get(models.Instrument, instrument_id)
+    if not inst:
+        raise HTTPException(404, "Instrument not found")
+
+    ws = _parse_windows(windows)
+    start = datetime.fromisoformat(from_) if from_ else None
+    end = datetime.fromisoformat(to) if to else None
+    sym = (benchmark or settings.default_benchmark or "").strip().upper()
+    prices = price_store.get(db, instrument_id).slice(start, end)
+    return {"instrument_id": instrument_id, **_rolling_payload(db, prices.days, prices.close, ws, sym, start, end, max_points)}
+
+_ESTIMATORS = ("ledoit_wolf", "sample")
+
+@router.get("/portfolios/{portfolio_id}/covariance")
+def portfolio_covariance(
+    portfolio_id: UUID,
+    estimator: str = Query("ledoit_wolf", description="ledoit_wolf | sample"),
+    window: int = Query(252, ge=2, description="most recent daily returns used"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    portfolio = db.get(models.Portfolio, portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    account = db.get(models.Account, portfolio.account_id)
+    if account.user_id != current_user.id:
+        raise HTTPException(403, "Forbidden")
+    if estimator not in _ESTIMATORS:
+        raise HTTPException(400, f"estimator must be one of {', '.join(_ESTIMATORS)}")
+
+    start = datetime.fromisoformat(from_) if from_ else None
+    end = datetime.fromisoformat(to) if to else None
+    qty = holding_quantities(db, portfolio_id)
+    model = covariance_model(db, list(qty), start, end, window)
+    ids = model.instrument_ids
+    cov = model.covariance(estimator)
+
+    # weights: market value at the last close of the range, over gross exposure
+    mv = position_values(db, qty, ids, end)
+    gross = np.abs(mv).sum()
+    w = mv / gross if gross > 0 else np.zeros(len(ids))
+    rc = risk_contributions(cov, w)
+    symbols = dict(db.query(models.Instrument.id, models.Instrument.symbol).filter(models.Instrument.id.in_(ids)).all()) if ids else {}
+    vols = np.sqrt(np.diag(cov))
+
+    ts = timestamps(model.days)
+    return {
+        "portfolio_id": portfolio_id,
+        "estimator": estimator,
+        "shrinkage": model.shrinkage,
+        "start": ts[0] if ts else None,
+        "end": ts[-1] if ts else None,
+        "observations": len(ts),
+        "portfolio_vol": rc["vol"],
+        "instruments": [
+            {
+                "instrument_id": iid,
+                "symbol": symbols.get(iid),
+                "weight": float(w[j]),
+                "vol": float(vols[j]),
+                "marginal_risk": float(rc["marginal"][j]),
+                "component_risk": float(rc["component"][j]),
+                "pct_risk": float(rc["pct"][j]),
+            }
+            for j, iid in enumerate(ids)
+        ],
+        "covariance": cov.tolist(),
+        "correlation": model.correlation(estimator).tolist(),
+    }
+
+_RISK_METHODS = ("historical", "parametric", "monte_carlo")
+
+def _parse_levels(confidence: str) -> List[float]:
+    try:
+        levels = sorted({float(tok) for tok in confidence.split(",") if tok.strip()})
+    except ValueError:
+        levels = []
+    if not levels or not all(0.5 <= a < 1.0 for a in levels):
+        raise HTTPException(400, "confidence must be comma-separated levels in [0.5, 1), e.g. 0.95,0.99")
+    return levels
+
+@router.get("/portfolios/{portfolio_id}/risk")
+def portfolio_risk(
+    portfolio_id: UUID,
+    confidence: str = Query("0.95,0.99", description="comma-separated confidence levels"),
+    horizons: str = Query("1,10", description="comma-separated horizons in trading days"),
+    methods: str = Query("historical,parametric,monte_carlo"),
+    window: int = Query(500, ge=20, description="most recent daily returns used"),
+    paths: Optional[int] = Query(None, ge=1000, le=2_000_000, description="Monte Carlo paths"),
+    estimator: str = Query("ledoit_wolf", description="covariance for parametric and Monte Carlo: ledoit_wolf | sample"),
+    to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """VaR and CVaR (positive fractions of the portfolio value, and amounts) of the current holdings."""
+    portfolio = db.get(models.Portfolio, portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    account = db.get(models.Account, portfolio.account_id)
+    if account.user_id != current_user.id:
+        raise HTTPException(403, "Forbidden")
+    levels = _parse_levels(confidence)
+    hs = sorted(set(_parse_csv_ints(horizons)))
+    if not hs or hs[0] < 1 or hs[-1] > 250:
+        raise HTTPException(400, "horizons must be comma-separated trading days between 1 and 250")
+    wanted = [m.strip() for m in methods.split(",") if m.strip()]
+    if not wanted or any(m not in _RISK_METHODS for m in wanted):
+        raise HTTPException(400, f"methods must be among {', '.join(_RISK_METHODS)}")
+    if estimator not in _ESTIMATORS:
+        raise HTTPException(400, f"estimator must be one of {', '.join(_ESTIMATORS)}")
+
+    t0 = time.perf_counter()
+    end = datetime.fromisoformat(to) if to else None
+    qty = holding_quantities(db, portfolio_id)
+    days, ids, r = returns_matrix(db, list(qty), None, end)
+    days, r = days[-window:], r[-window:]
+    mv = position_values(db, qty, ids, end)
+    value = float(mv.sum())
+    if value <= 0 or len(r) < 2:
+        raise HTTPException(400, "Not enough priced holdings to measure risk")
+    w = mv / value
+
+    rp = r @ w
+    cov = ledoit_wolf(r)[0] * (len(r) / (len(r) - 1)) if estimator == "ledoit_wolf" else sample_covariance(r)
+    results = {}
+    if "historical" in wanted:
+        results["historical"] = var_engine.historical(rp, levels, hs)
+    if "parametric" in wanted:
+        results["parametric"] = var_engine.parametric(float(rp.mean()), float(np.sqrt(w @ cov @ w)), levels, hs)
+    mc_paths = mc_requested = None
+    if "monte_carlo" in wanted:
+        mc_requested = paths or settings.risk_mc_paths
+        results["monte_carlo"], mc_paths = var_engine.monte_carlo(
+            r.mean(axis=0), cov, w, levels, hs,
+            paths=mc_requested,
+            seed=settings.risk_mc_seed,
+            workers=settings.risk_mc_workers,
+            budget_sec=settings.risk_budget_ms / 1000.0,
+        )
+
+    ts = timestamps(days)
     return {
         "portfolio_id": portfolio_id,
-        "metrics": {
-            "start": curve[0].ts if curve else None,
-            "end": curve[-1].ts if curve else None,
-            "days": (curve[-1].ts - curve[0].ts).days if len(curve) >= 2 else 0,
-            "cagr": cagr(curve),
-            "ann_return": stats["mu"],
-            "ann_vol": stats["sigma"],
-            "sharpe": sharpe,
-            "sortino": sortino,
-            "max_drawdown": mdd,
-            "risk_free_rate_annual": risk_free,
+        "portfolio_value": value,
+        "start": ts[0],
+        "end": ts[-1],
+        "observations": len(ts),
+        "monte_carlo_paths": mc_paths,
+        # chunks not finished within risk_budget_ms were dropped: fewer paths than asked for
+        "monte_carlo_truncated": mc_paths < mc_requested if mc_paths else None,
+        "monte_carlo_seed": settings.risk_mc_seed if mc_paths else None,
+        "results": {
+            method: {
+                str(h): {
+                    str(a): {**v, "var_amount": v["var"] * value, "cvar_amount": v["cvar"] * value}
+                    for a, v in by_level.items()
+                }
+                for h, by_level in table.items()
+            }
+            for method, table in results.items()
         },
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000.0, 1),
+    }
+
+@router.get("/portfolios/{portfolio_id}/optimize")
+def portfolio_optimize(
+    portfolio_id: UUID,
+    points: int = Query(25, ge=2, le=200, description="efficient frontier points"),
+    min_weight: float = Query(0.0, ge=-1.0, le=1.0),
+    max_weight: float = Query(1.0, gt=0.0, le=2.0),
+    target_return: Optional[float] = Query(None, description="annual expected return to reach at least, e.g. 0.1"),
+    window: int = Query(756, ge=20, description="most recent daily returns used"),
+    to: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Minimum-variance, maximum-Sharpe and target-return portfolios of the
+    current holdings' instruments, plus the efficient frontier between them.
+    Inputs are the annualised mean returns and Ledoit-Wolf covariance of the window.
+    """
+    portfolio = db.get(models.Portfolio, portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    account = db.get(models.Account, portfolio.account_id)
+    if account.user_id != current_user.id:
+        raise HTTPException(403, "Forbidden")
+
+    end = datetime.fromisoformat(to) if to else None
+    qty = holding_quantities(db, portfolio_id)
+    days, ids, r = returns_matrix(db, list(qty), None, end)
+    days, r = days[-window:], r[-window:]
+    if len(ids) < 2 or len(r) < 2:
+        raise HTTPException(400, "Need at least two priced holdings to optimise")
+    n = len(ids)
+    lo, hi = np.full(n, min_weight), np.full(n, max_weight)
+    if lo.sum() > 1.0 or hi.sum() < 1.0:
+        raise HTTPException(400, f"min_weight/max_weight admit no fully invested portfolio of {n} instruments")
+
+    rf = settings.risk_free_rate_annual
+    mu = r.mean(axis=0) * TRADING_DAYS
+    cov = ledoit_wolf(r)[0] * (len(r) / (len(r) - 1)) * TRADING_DAYS
+    mv = position_values(db, qty, ids, end)
+    current = mv / mv.sum() if mv.sum() > 0 else np.full(n, 1.0 / n)
+
+    frontier = opt.efficient_frontier(mu, cov, points, lo, hi, w0=current)
+    symbols = dict(db.query(models.Instrument.id, models.Instrument.symbol).filter(models.Instrument.id.in_(ids)).all())
+
+    def point(w: np.ndarray) -> dict:
+        ret, vol = float(w @ mu), float(np.sqrt(max(w @ cov @ w, 0.0)))
+        return {
+            "expected_return": ret,
+            "vol": vol,
+            "sharpe": (ret - rf) / vol if vol > 0 else 0.0,
+            "weights": [float(x) for x in w],
+        }
+
+    best, i = opt.max_sharpe(mu, cov, frontier, rf, lo, hi)
+    target = None
+    if target_return is not None:
+        hit = opt.target_return(mu, cov, frontier, target_return, lo, hi)
+        target = point(hit[0].weights[hit[1]]) if hit else None
+
+    ts = timestamps(days)
+    return {
+        "portfolio_id": portfolio_id,
+        "start": ts[0],
+        "end": ts[-1],
+        "observations": len(ts),
+        "risk_free_rate_annual": rf,
+        "instruments": [{"instrument_id": iid, "symbol": symbols.get(iid)} for iid in ids],
+        "current": point(current),
+        "min_variance": point(frontier.weights[0]),
+        "max_sharpe": point(best.weights[i]),
+        "target": target,
+        "frontier": [point(w) for w in frontier.weights],
+    }
+
+@router.get("/portfolios/{portfolio_id}/attribution")
+def portfolio_attribution(
+    portfolio_id: UUID,
+    level: str = Query("sector", description="sector | industry"),
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    max_points: Optional[int] = Query(None, ge=2, description="LTTB-downsample each exposure series"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Exposure per sector (or industry) over time, and Brinson-Fachler
+    allocation / selection / interaction of the current holdings against the
+    equal-weighted universe of classified instruments, linked over the range.
+    """
+    portfolio = db.get(models.Portfolio, portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    account = db.get(models.Account, portfolio.account_id)
+    if account.user_id != current_user.id:
+        raise HTTPException(403, "Forbidden")
+    if level not in attribution.LEVELS:
+        raise HTTPException(400, f"level must be one of {', '.join(attribution.LEVELS)}")
+
+    start = datetime.fromisoformat(from_) if from_ else None
+    end = datetime.fromisoformat(to) if to else None
+    a = attribution.attribute(db, holding_quantities(db, portfolio_id), level, start, end)
+    ts = timestamps(a.days)
+
+    def series(col: np.ndarray) -> list:
+        vals = col.tolist()
+        keep = keep_indices(ts, vals, max_points)
+        idx = keep if keep is not None else range(len(ts))
+        return [{"ts": ts[i], "v": vals[i]} for i in idx]
+
+    groups = []
+    for g, name in enumerate(a.groups):
+        alloc, sel, inter = float(a.allocation[g]), float(a.selection[g]), float(a.interaction[g])
+        groups.append({
+            level: name,
+            "weight": float(a.exposure[-1, g]) if len(ts) else 0.0,
+            "benchmark_weight": float(a.benchmark_exposure[-1, g]) if len(ts) else 0.0,
+            "allocation": alloc,
+            "selection": sel,
+            "interaction": inter,
+            "total": alloc + sel + inter,
+            "exposure": series(a.exposure[:, g]),
+        })
+    return {
+        "portfolio_id": portfolio_id,
+        "level": level,
+        "benchmark": "equal-weight classified universe",
+        "start": ts[0] if ts else None,
+        "end": ts[-1] if ts else None,
+        "portfolio_return": a.portfolio_return,
+        "benchmark_return": a.benchmark_return,
+        "active_return": a.portfolio_return - a.benchmark_return,
+        "allocation": float(a.allocation.sum()),
+        "selection": float(a.selection.sum()),
+        "interaction": float(a.interaction.sum()),
+        "groups": groups,
+    }
+
+@router.get("/screener")
+def screener(
+    q: Optional[str] = Query(None, description="condition, e.g. rsi(14) < 30 and close > sma(200) and avg_volume(20) > 2 * avg_volume(50)"),
+    sort: Optional[str] = Query(None, description="expression to order by, '-' prefix for descending, e.g. -ret(21)"),
+    fields: Optional[str] = Query(None, description="comma-separated extra columns to return"),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: models.User = Depends(get_current_user),
+):
+    """
+    Every instrument's latest indicators, filtered and ordered by expressions
+    over the nightly feature table (503 until the first one is built). Rows carry the columns the query and sort
+    read, plus `fields`.
+    """
+    table = screen_svc.current_features()
+    if table is None:
+        raise HTTPException(503, "Screener features are not built yet; they are exported by the nightly job")
+    try:
+        res = screen_svc.screen(table, q, sort, limit, offset)
+        extra = [f.strip().lower() for f in (fields or "").split(",") if f.strip()]
+        for f in extra:
+            table.column(f)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    cols = [c for c in dict.fromkeys(["close", "ret_1", *res.fields, *extra]) if c not in screen_svc.TEXT_COLUMNS]
+    ts = timestamps(table.days[res.rows])
+    rows = []
+    for k, r in enumerate(res.rows.tolist()):
+        row = {"instrument_id": int(table.instrument_ids[r]), "ts": ts[k]}
+        for c in ("symbol", "exchange", "sector", "industry", *cols):
+            v = table.column(c)[r].item()
+            row[c] = None if v == "" or v != v else v
+        rows.append(row)
+    return {
+        "as_of": table.built_at,
+        "universe": len(table),
+        "total": res.total,
+        "limit": limit,
+        "offset": offset,
+        "fields": cols,
+        "results": rows,
     }
@@ -1,8 +1,10 @@
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from uuid import UUID
 from core.deps import get_db, get_current_user
 from db import models
+from services.daily_values import refresh_portfolio
 
 router = APIRouter()
 
@@ -62,10 +64,13 @@ def bulk_upsert_holdings(portfolio_id: UUID, items: list[dict], db: Session = De
         if holding:
             holding.qty = qty
             holding.cost_basis = cost_basis
+            holding.last_updated = datetime.now(timezone.utc)  # change stamp for cached analytics
             updated += 1
         else:
             db.add(models.Holding(portfolio_id=portfolio_id, instrument_id=instrument.id, qty=qty, cost_basis=cost_basis))
             inserted += 1
 
+    db.flush()
+    refresh_portfolio(db, portfolio_id, "holdings", full=True)  # every day's value depends on current quantities
     db.commit()
     return {"updated": updated, "inserted": inserted, "failed": failed}
\ No newline at end of file
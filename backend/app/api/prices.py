@@ -1,11 +1,19 @@
 from datetime import datetime, timedelta, timezone
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Iterator
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select
+from sqlalchemy import Float, cast, func, select
 from sqlalchemy.orm import Session
 from core.deps import get_db
 from db import models
-from services.market_data import get_provider
+from db.database import SessionLocal
+from services.price_encoding import CHUNK_ROWS, MEDIA_TYPES, OHLCV, encode, negotiate
+from services.downsample import ohlcv_buckets
+from services.resample import Interval, aggregated_cache, parse_interval, resample_ohlcv
+from services.ingest import SyncTarget, build_sync_targets, sync_daily_prices
+import asyncio
+import hashlib
 import logging
 
 router = APIRouter()
@@ -15,87 +23,124 @@ class SyncRequest(BaseModel):
     symbols: list[str]
     backfill_days: int | None = 1825  # ~5y
 
-@router.post("/sync")
-def sync_prices(payload: SyncRequest, db: Session = Depends(get_db)):
-    provider = get_provider()
-    inserted = 0
-    errors: list[dict] = []
+def _resolve_targets(db: Session, symbols: list[str], start) -> list[SyncTarget]:
+    # ensure instruments exist (one lookup for the whole batch)
+    existing = {
+        i.symbol: i
+        for i in db.query(models.Instrument).filter(models.Instrument.symbol.in_(symbols)).all()
+    }
+    for symbol in symbols:
+        if symbol not in existing:
+            inst = models.Instrument(symbol=symbol)
+            db.add(inst)
+            existing[symbol] = inst
+    db.flush()
+    targets = build_sync_targets(db, [(existing[s].id, s) for s in symbols], start)
+    db.commit()
+    return targets
 
+@router.post("/sync")
+async def sync_prices(payload: SyncRequest, db: Session = Depends(get_db)):
     start = None
     if payload.backfill_days and payload.backfill_days > 0:
         start = (datetime.now(timezone.utc) - timedelta(days=payload.backfill_days)).date()
 
-    for sym in payload.symbols:
-        symbol = sym.strip().upper()
-        if not symbol:
-            continue
+    symbols = list(dict.fromkeys(s.strip().upper() for s in payload.symbols if s.strip()))
+    if not symbols:
+        return {"inserted": 0, "updated": 0, "errors": []}
 
-        # ensure instrument exists
-        inst = (
-            db.query(models.Instrument)
-            .filter(models.Instrument.symbol == symbol)
-            .first()
-        )
-        if not inst:
-            inst = models.Instrument(symbol=symbol)
-            db.add(inst)
-            db.flush()
+    targets = await asyncio.to_thread(_resolve_targets, db, symbols, start)
+    report = await sync_daily_prices(db, targets)
+    return {"inserted": report.inserted, "updated": report.updated, "errors": report.errors}
 
-        # fetch bars with error guard
-        try:
-            bars = provider.daily_prices(symbol, start=start)
-        except Exception as e:
-            logger.warning("provider_daily_failed", exc_info=True, extra={"symbol": symbol})
-            errors.append({"symbol": symbol, "error": str(e)})
-            bars = []
+def _price_blocks(instrument_id: int, dt_from: datetime | None, dt_to: datetime | None) -> Iterator[OHLCV]:
+    # runs while the response streams, after the request's session is gone; use our own
+    P = models.Price
+    stmt = select(
+        P.ts, cast(P.open, Float), cast(P.high, Float), cast(P.low, Float), cast(P.close, Float), P.volume,
+    ).where(P.instrument_id == instrument_id)
+    if dt_from:
+        stmt = stmt.where(P.ts >= dt_from)
+    if dt_to:
+        stmt = stmt.where(P.ts <= dt_to)
+    stmt = stmt.order_by(P.ts.asc()).execution_options(yield_per=CHUNK_ROWS)
+    db = SessionLocal()
+    try:
+        for part in db.execute(stmt).partitions():
+            yield OHLCV.from_rows(part)
+    finally:
+        db.close()
 
-        # upsert new bars
-        for b in bars:
-            exists = (
-                db.query(models.Price)
-                .filter(models.Price.instrument_id == inst.id, models.Price.ts == b["ts"])
-                .first()
-            )
-            if exists:
-                continue
-            p = models.Price(
-                instrument_id=inst.id,
-                ts=b["ts"],
-                open=b["open"], high=b["high"], low=b["low"], close=b["close"],
-                volume=b.get("volume"),
-                source="alpha_vantage",
-            )
-            db.add(p)
-            inserted += 1
+def _downsampled(blocks: Iterator[OHLCV], max_points: int) -> Iterator[OHLCV]:
+    yield ohlcv_buckets(OHLCV.concat(blocks), max_points)
 
-    db.commit()
-    return {"inserted": inserted, "errors": errors}
+def _resampled(blocks: Iterator[OHLCV], iv: Interval, cache_key) -> Iterator[OHLCV]:
+    agg = aggregated_cache.get(cache_key)
+    if agg is None:
+        agg = resample_ohlcv(OHLCV.concat(blocks), iv)
+        aggregated_cache.put(cache_key, agg)
+    yield agg
+
+def _range_version(db: Session, instrument_id: int, dt_from: datetime | None, dt_to: datetime | None) -> tuple:
+    """
+    Bar count, latest ts and exact (Numeric) sums of the range's OHLCV: adding
+    bars moves the first two, rewriting one in place (today's bar during the
+    day, a provider revision) moves the sums.
+    """
+    P = models.Price
+    q = db.query(
+        func.count(P.id), func.max(P.ts),
+        func.sum(P.close), func.sum(P.open + P.high + P.low), func.sum(P.volume),
+    ).filter(P.instrument_id == instrument_id)
+    if dt_from:
+        q = q.filter(P.ts >= dt_from)
+    if dt_to:
+        q = q.filter(P.ts <= dt_to)
+    n, last, close, ohl, volume = q.one()
+    return (n, last.isoformat() if last else None, str(close), str(ohl), volume)
 
 @router.get("/{instrument_id}")
-def get_prices(instrument_id: int, interval: str = "1d", from_: str | None = None, to: str | None = None, db: Session = Depends(get_db)):
-    if interval != "1d":
-        raise HTTPException(status_code=400, detail="Only 1d supported for now")
-    q = db.query(models.Price).filter(models.Price.instrument_id == instrument_id)
+def get_prices(
+    instrument_id: int,
+    request: Request,
+    interval: str = Query("1d", description="1d | Nd (N-day buckets) | 1w | 1mo | 1q"),
+    from_: str | None = None,
+    to: str | None = None,
+    format: str | None = Query(None, description="json (default) | columnar | msgpack | arrow; or use the Accept header"),
+    max_points: int | None = Query(None, ge=2, description="merge candles into at most this many OHLC buckets"),
+    db: Session = Depends(get_db),
+):
+    try:
+        iv = parse_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    dt_from = dt_to = None
     if from_:
         try:
             dt_from = datetime.fromisoformat(from_)
-            q = q.filter(models.Price.ts >= dt_from)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid 'from' date")
     if to:
         try:
             dt_to = datetime.fromisoformat(to)
-            q = q.filter(models.Price.ts <= dt_to)
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid 'to' date")
-    q = q.order_by(models.Price.ts.asc())
-    rows = q.all()
-    return {
-        "instrument_id": instrument_id,
-        "interval": interval,
-        "candles": [
-            {"ts": r.ts, "o": float(r.open), "h": float(r.high), "l": float(r.low), "c": float(r.close), "v": r.volume}
-            for r in rows
-        ],
-        "count": len(rows),
-    }
\ No newline at end of file
+    try:
+        fmt = negotiate(format, request.headers.get("accept"))
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    version = _range_version(db, instrument_id, dt_from, dt_to)
+    etag = '"%s"' % hashlib.sha1(repr((instrument_id, interval, from_, to, fmt, max_points, version)).encode()).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    meta = {"instrument_id": instrument_id, "interval": interval}
+    blocks = _price_blocks(instrument_id, dt_from, dt_to)
+    if not iv.is_daily:
+        blocks = _resampled(blocks, iv, (instrument_id, iv, dt_from, dt_to, version))
+    if max_points:
+        blocks = _downsampled(blocks, max_points)
+    body = encode(fmt, meta, blocks)
+    return StreamingResponse(body, media_type=MEDIA_TYPES[fmt], headers=headers)
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from uuid import UUID
 from core.deps import get_db, get_current_user
 from db import models
+from services.daily_values import refresh_portfolio
 
 router = APIRouter()
 
@@ -37,6 +38,9 @@ def create_transaction(portfolio_id: UUID, symbol: str, type: str, qty: float, p
         note=note,
     )
     db.add(tx)
+    db.flush()
+    db.refresh(tx, ["executed_at"])  # parsed by Postgres
+    refresh_portfolio(db, portfolio_id, "transactions", since=tx.executed_at)
     db.commit()
     db.refresh(tx)
     return {
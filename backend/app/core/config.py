@@ -31,6 +31,8 @@ class Settings(BaseSettings):
     rate_limit_per_min: int = 60
     rate_limit_burst: int = 120
     redis_url: Optional[str] = None  # Railway Redis usually exposes REDIS_URL
+    analytics_cache_size: int = 512      # in-process entries of the analytics result cache
+    analytics_cache_ttl_sec: int = 300   # also the Redis expiry when REDIS_URL is set
 
     risk_free_rate_annual: float = 0.03
     default_benchmark: str = "SPY"
@@ -48,7 +50,25 @@ class Settings(BaseSettings):
     intraday_hours_local: str = "14-21"  # local 24h window
     active_symbols_limit: int = 10
     provider_rpm: int = 5
+    provider_burst: int | None = None  # defaults to provider_rpm
+    provider_concurrency: int = 4      # symbols fetched in parallel by the ingest engine
+    market_data_cache_dir: str | None = ".cache/market_data"  # raw provider responses; unset to disable
+    market_data_cache_mb: int = 256
+    market_data_cache_ttl_sec: int = 3600  # for functions without a specific TTL
+    price_cache_mb: int = 128        # in-process daily bar arrays (services.price_store)
+    price_cache_ttl_sec: int = 300   # picks up bars written by other processes
+    price_snapshot_dir: str | None = ".cache/price_snapshot"  # mmap'd nightly export; unset to disable
+    screener_dir: str | None = ".cache/screener"  # nightly screener feature table; unset to keep it in memory only
     
+    # Risk (VaR / CVaR)
+    risk_mc_paths: int = 100_000     # default Monte Carlo paths
+    risk_mc_seed: int = 20240601     # fixed so repeated requests agree
+    risk_mc_workers: int = 2         # process pool size; 0 simulates in the request thread
+    risk_budget_ms: int = 1500       # Monte Carlo chunks not done by then are dropped
+
+    # Stored indicator series (sma/ema/rsi); requests past the cap are computed on the fly
+    indicator_states_per_instrument: int = 32
+
     # News
     newsapi_key: str | None = None
     enable_news_jobs: bool = True
@@ -1,3 +1,5 @@
+import asyncio
+import threading
 import time
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -20,6 +22,38 @@ class TokenBucket:
             return True
         return False
 
+class RequestBudget(TokenBucket):
+    """
+    Token bucket that waits for a token instead of rejecting. Tokens are
+    reserved under a lock (the balance may go negative), so one budget can be
+    shared by worker threads and the event loop alike.
+    """
+    def __init__(self, rate: int, burst: int):
+        super().__init__(rate, burst)
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token; return how many seconds the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.timestamp
+            self.timestamp = now
+            self.tokens = min(self.capacity, self.tokens + elapsed * (self.rate/60))
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / (self.rate/60)
+
+    def wait(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
 class RateLimitMiddleware(BaseHTTPMiddleware):
     buckets: dict[str, TokenBucket] = {}
 
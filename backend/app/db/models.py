@@ -1,5 +1,5 @@
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy import String, DateTime, ForeignKey, Numeric, Text, BigInteger, UniqueConstraint, Index, text
+from sqlalchemy import String, DateTime, Double, ForeignKey, Numeric, Text, BigInteger, UniqueConstraint, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.types import Integer
 from datetime import datetime, timezone
@@ -89,6 +89,56 @@ class Price(Base):
     Index("ix_prices_inst_ts_desc", "instrument_id", "ts"),
     )
     
+class PriceRevision(Base):
+    """Bumped whenever an instrument's bars before its latest one are written (services.price_snapshot)."""
+    __tablename__ = "price_revisions"
+    instrument_id: Mapped[int] = mapped_column(ForeignKey("instruments.id", ondelete="CASCADE"), primary_key=True)
+    revision: Mapped[int] = mapped_column(BigInteger, default=0)
+    revised_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+class PortfolioDailyValue(Base):
+    """Materialised daily valuation of a portfolio (services.daily_values)."""
+    __tablename__ = "portfolio_daily_values"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    portfolio_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("portfolios.id", ondelete="CASCADE"), index=True)
+    basis: Mapped[str] = mapped_column(String(16))  # holdings|transactions
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    # derived values: stored as double so reads reproduce the computed curve exactly
+    market_value: Mapped[float] = mapped_column(Double)
+    net_flow: Mapped[float] = mapped_column(Double, default=0)
+    ret: Mapped[float] = mapped_column(Double, default=0)  # daily (time-weighted) return
+
+    __table_args__ = (
+        UniqueConstraint("portfolio_id", "basis", "ts", name="uq_pdv_portfolio_basis_ts"),
+        Index("ix_pdv_portfolio_basis_ts", "portfolio_id", "basis", "ts"),
+    )
+
+class IndicatorState(Base):
+    """Running state of one indicator series of an instrument (services.indicator_state)."""
+    __tablename__ = "indicator_states"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    instrument_id: Mapped[int] = mapped_column(ForeignKey("instruments.id", ondelete="CASCADE"), index=True)
+    name: Mapped[str] = mapped_column(String(32))  # sma_20, ema_12, rsi_14, ...
+    last_ts: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))  # last bar folded in
+    state: Mapped[dict] = mapped_column(JSONB)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (UniqueConstraint("instrument_id", "name", name="uq_indicator_state_instrument_name"),)
+
+class IndicatorValue(Base):
+    """One value of a stored indicator series; NULL before the indicator is defined."""
+    __tablename__ = "indicator_values"
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    instrument_id: Mapped[int] = mapped_column(ForeignKey("instruments.id", ondelete="CASCADE"))
+    name: Mapped[str] = mapped_column(String(32))
+    ts: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    value: Mapped[float | None] = mapped_column(Double)
+
+    __table_args__ = (
+        UniqueConstraint("instrument_id", "name", "ts", name="uq_indicator_value_instrument_name_ts"),
+        Index("ix_indicator_values_instrument_name_ts", "instrument_id", "name", "ts"),
+    )
+
 class Benchmark(Base):
     __tablename__ = "benchmarks"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
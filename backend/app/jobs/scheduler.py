@@ -1,10 +1,15 @@
 # app/jobs/scheduler.py
 
+from datetime import datetime
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from core.config import settings
-from jobs.tasks import nightly_backfill_prices, intraday_refresh_prices, poll_news_for_tracked_instruments, nightly_forecasts_for_tracked
+from jobs.tasks import (
+    nightly_backfill_prices, intraday_refresh_prices, poll_news_for_tracked_instruments, nightly_forecasts_for_tracked,
+    export_screener_features,
+)
 
 # REPLACE the global construction with a lazy singleton:
 _scheduler: AsyncIOScheduler | None = None
@@ -31,7 +36,15 @@ def start_scheduler() -> None:
         coalesce=True,
         misfire_grace_time=600,
     )
-    
+
+    # the screener answers 503 until a feature table exists; don't leave a fresh deploy waiting for the night
+    _scheduler.add_job(
+        export_screener_features,
+        id="export_screener_features",
+        next_run_time=datetime.now(_scheduler.timezone),
+        misfire_grace_time=600,
+    )
+
     if settings.ml_enable:
         _scheduler.add_job(
             nightly_forecasts_for_tracked,
@@ -1,14 +1,17 @@
-from datetime import datetime, timedelta
+import asyncio
+from datetime import datetime, timedelta, timezone
 from typing import Iterable
 
-from sqlalchemy import func
 from sqlalchemy.orm import Session
 from core.config import settings
 from db.database import SessionLocal
-from db.models import Instrument, Price, Holding
+from db.models import Instrument, Holding
 from services.news import fetch_news_for_symbol, upsert_news_and_score
-from services.market_data import get_provider
+from services.market_data import get_provider, get_response_cache
 from services.forecasts import train_and_forecast_for_instrument
+from services.ingest import SyncTarget, build_sync_targets, sync_daily_prices, upsert_benchmark_bars
+from services.price_snapshot import export_snapshot
+from services.screener import current_features, export_features
 
 from db import models
 import logging
@@ -64,69 +67,68 @@ def _backfill_benchmark(db: Session):
         .order_by(models.BenchmarkPrice.ts.desc())
         .first()
     )
-    start = None
-    if latest:
-        start = latest[0].date()
+    last_ts = latest[0] if latest else None
 
-    bars = provider.daily_prices(sym, start=start)
-    inserted = 0
-    for b in bars:
-        exists = (
-            db.query(models.BenchmarkPrice)
-            .filter(models.BenchmarkPrice.benchmark_id == bench.id, models.BenchmarkPrice.ts == b["ts"])
-            .first()
-        )
-        if exists:
-            continue
-        db.add(models.BenchmarkPrice(
-            benchmark_id=bench.id,
-            ts=b["ts"], open=b["open"], high=b["high"], low=b["low"], close=b["close"],
-            volume=b.get("volume"), source=str(type(provider).__name__),
-        ))
-        inserted += 1
-    if inserted:
+    bars = provider.stream_daily_prices(sym, last_ts=last_ts)
+    counts = upsert_benchmark_bars(db, bench.id, bars, source=str(type(provider).__name__))
+    if counts.inserted or counts.updated:
         db.commit()
+    log.info("benchmark_backfill", extra={"symbol": sym, "inserted": counts.inserted, "updated": counts.updated})
+
+def _sync_targets(db: Session, instrument_ids: Iterable[int]) -> list[SyncTarget]:
+    """
+    Known instruments resume from their latest stored bar; new ones backfill
+    BACKFILL_DEFAULT_LOOKBACK_DAYS.
+    """
+    ids = list(dict.fromkeys(instrument_ids))
+    if not ids:
+        return []
+    pairs = db.query(Instrument.id, Instrument.symbol).filter(Instrument.id.in_(ids)).all()
+    default_start = (datetime.now(timezone.utc) - timedelta(days=settings.backfill_default_lookback_days)).date()
+    return build_sync_targets(db, [(i, sym) for i, sym in pairs], default_start, ensure_history=False)
 
 async def nightly_backfill_prices() -> None:
     """
-    Backfill daily OHLCV data for all instruments with holdings.
+    Backfill daily OHLCV data for all instruments with holdings, then the benchmark,
+    then refresh the memory-mapped price snapshot and the screener's feature table.
     Runs at the time specified by `settings.backfill_at` (e.g. "02:30" for 2:30 AM).
     """
     db: Session = SessionLocal()
-    provider = get_provider()
     try:
-        # Identify instruments that have holdings (distinct instrument IDs)
         instrument_ids = [row[0] for row in db.query(Holding.instrument_id).distinct().all()]
-        for inst_id in instrument_ids:
-            instrument = db.query(Instrument).get(inst_id)
-            if instrument is None:
-                continue
-
-            # Find the latest stored price timestamp for this instrument
-            last_ts: datetime | None = db.query(func.max(Price.ts)).filter(Price.instrument_id == inst_id).scalar()
-            if last_ts:
-                # Start from the day after the latest stored price
-                start_date = last_ts + timedelta(days=1)
-            else:
-                # Backfill up to the configured lookback (default 5 years)
-                start_date = datetime.timezone.utc() - timedelta(days=settings.backfill_default_lookback_days)
-
-            # Fetch new bars from the provider
-            async for bar in provider.daily_prices(instrument.symbol, start=start_date):
-                price = Price(
-                    instrument_id=inst_id,
-                    ts=bar.ts,
-                    open=bar.open,
-                    high=bar.high,
-                    low=bar.low,
-                    close=bar.close,
-                    volume=bar.volume,
-                    source=bar.source,
-                )
-                # Use merge() to avoid duplicate (instrument_id, ts) rows
-                db.merge(price)
+        targets = await asyncio.to_thread(_sync_targets, db, instrument_ids)
+        report = await sync_daily_prices(db, targets)
+        log.info("nightly_backfill", extra={"symbols": len(targets), "inserted": report.inserted, "updated": report.updated, "errors": len(report.errors)})
+        cache = get_response_cache()
+        if cache is not None:
+            log.info("market_data_cache", extra=cache.stats())
+        try:
+            await asyncio.to_thread(_backfill_benchmark, db)
+        except Exception:
+            db.rollback()
+            log.exception("benchmark_backfill_failed")
+        if settings.price_snapshot_dir:
+            try:
+                await asyncio.to_thread(export_snapshot, db)
+            except Exception:
+                log.exception("price_snapshot_export_failed")
+        try:
+            await asyncio.to_thread(export_features, db)
+        except Exception:
+            db.rollback()
+            log.exception("screener_features_export_failed")
+    finally:
+        db.close()
 
-            db.commit()
+def export_screener_features() -> None:
+    """Build the screener's feature table if none exists yet; runs once when the scheduler starts."""
+    if current_features() is not None:
+        return
+    db: Session = SessionLocal()
+    try:
+        export_features(db)
+    except Exception:
+        log.exception("screener_features_export_failed")
     finally:
         db.close()
 
@@ -136,7 +138,6 @@ async def intraday_refresh_prices() -> None:
     Runs at intervals defined by `settings.intraday_interval_sec` when `settings.intraday_enable` is True.
     """
     db: Session = SessionLocal()
-    provider = get_provider()
     try:
         # Pick up to ACTIVE_SYMBOLS_LIMIT instruments by most recently updated holding
         instrument_ids = [
@@ -148,28 +149,8 @@ async def intraday_refresh_prices() -> None:
                 .all()
             )
         ]
-        for inst_id in instrument_ids:
-            instrument = db.query(Instrument).get(inst_id)
-            if instrument is None:
-                continue
-
-            # Fetch the latest bar; provider returns an iterable of Price-like objects
-            async for bar in provider.daily_prices(instrument.symbol, start=None, end=None):
-                # Upsert the latest price
-                price = Price(
-                    instrument_id=inst_id,
-                    ts=bar.ts,
-                    open=bar.open,
-                    high=bar.high,
-                    low=bar.low,
-                    close=bar.close,
-                    volume=bar.volume,
-                    source=bar.source,
-                )
-                db.merge(price)
-                db.commit()
-                # Only one bar is needed for the latest refresh
-                break
+        targets = await asyncio.to_thread(_sync_targets, db, instrument_ids)
+        await sync_daily_prices(db, targets)
     finally:
         db.close()
 
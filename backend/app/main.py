@@ -8,6 +8,7 @@ from contextlib import asynccontextmanager
 import uvicorn
 import os
 from jobs.scheduler import start_scheduler, shutdown_scheduler
+from services.var import shutdown_pool, warm_pool
 
 setup_logging()
 
@@ -16,9 +17,11 @@ async def lifespan(app: FastAPI):
     init_db()
     if settings.run_jobs:
         start_scheduler()
+    warm_pool(settings.risk_mc_workers)
     yield
     if settings.run_jobs:
         shutdown_scheduler()
+    shutdown_pool()
 
 app = FastAPI(lifespan=lifespan, title="AI Finance Dashboard API", version="0.1.0")
 
@@ -3,57 +3,112 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Dict, List, Tuple, Optional
 from math import sqrt
-from datetime import datetime, timezone
+from collections import OrderedDict
+import threading
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 from db import models
 from core.config import settings
+from services.metrics import relative_metrics
+from services.panel import close_panel, portfolio_values
+from services.price_store import price_store
+from services.rolling import simple_returns
 
 @dataclass
 class SeriesPoint:
     ts: datetime
     value: float
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 def _to_float(x) -> float:
     # SQLAlchemy Numeric -> float
     return float(x) if x is not None else 0.0
 
+def holding_quantities(db: Session, portfolio_id) -> Dict[int, float]:
+    """Current non-zero quantity per instrument."""
+    qty: Dict[int, float] = {}
+    for iid, q in db.query(models.Holding.instrument_id, models.Holding.qty).filter(models.Holding.portfolio_id == portfolio_id):
+        qty[iid] = qty.get(iid, 0.0) + _to_float(q)
+    return {iid: q for iid, q in qty.items() if q != 0}
+
+def equity_curve_arrays(db: Session, portfolio_id, start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (epoch days, value) of the holdings at their current quantities.
+    Closes are aligned on one calendar with forward fill, and the curve starts on the first
+    date every held instrument has a price, so no date is a partial total.
+    """
+    qty = holding_quantities(db, portfolio_id)
+    if not qty:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    panel = close_panel(db, list(qty), start, end).complete()
+    return panel.days, portfolio_values(panel, qty)
+
+@dataclass
+class CurveGroup:
+    """Holdings curves of portfolios that share a calendar, one column each (NaN before a curve starts)."""
+    days: np.ndarray
+    portfolio_ids: List[object]
+    values: np.ndarray          # (len(days), len(portfolio_ids))
+
+def equity_curves_batch(db: Session, portfolio_ids: List[object], start: Optional[datetime], end: Optional[datetime]) -> List[CurveGroup]:
+    """
+    equity_curve_arrays for many portfolios from one price load: one holdings
+    query, one panel over the union of their instruments and one matrix
+    product for all values. Each portfolio keeps only the dates its own
+    instruments trade, as it would alone; portfolios whose dates agree are
+    grouped so their metrics can be computed in one 2-D call. Portfolios
+    without holdings come back as an empty group.
+    """
+    H = models.Holding
+    qty: Dict[object, Dict[int, float]] = {pid: {} for pid in portfolio_ids}
+    for pid, iid, q in db.query(H.portfolio_id, H.instrument_id, H.qty).filter(H.portfolio_id.in_(portfolio_ids)):
+        qty[pid][iid] = qty[pid].get(iid, 0.0) + _to_float(q)
+    qty = {pid: {i: q for i, q in held.items() if q != 0} for pid, held in qty.items()}
+
+    union = list(dict.fromkeys(i for held in qty.values() for i in held))
+    panel = close_panel(db, union, start, end)
+    col = {iid: j for j, iid in enumerate(panel.instrument_ids)}
+    Q = np.zeros((len(col), len(portfolio_ids)))
+    for k, pid in enumerate(portfolio_ids):
+        for iid, q in qty[pid].items():
+            if iid in col:
+                Q[col[iid], k] = q
+    held = Q != 0
+
+    # rows where each instrument has a bar of its own (not a forward fill)
+    series = price_store.get_many(db, panel.instrument_ids)
+    traded = np.empty((len(panel), len(col)), dtype=bool)
+    for iid, j in col.items():
+        traded[:, j] = np.isin(panel.days, series[iid].days, assume_unique=True)
+    rows = (traded.astype(np.float64) @ held) > 0                   # the portfolio's own calendar
+    missing = (~np.isfinite(panel.close)).astype(np.float64) @ held  # held instruments without a price yet
+    values = np.nan_to_num(panel.close) @ Q
+    values[missing > 0] = np.nan
+
+    groups: Dict[bytes, List[int]] = {}
+    for k in range(len(portfolio_ids)):
+        groups.setdefault(rows[:, k].tobytes(), []).append(k)
+    out = []
+    for ks in groups.values():
+        mask = rows[:, ks[0]]
+        v = values[mask][:, ks]
+        has = np.isfinite(v).any(axis=1)                             # from the first complete row of any of them
+        first = int(has.argmax()) if has.any() else len(v)
+        out.append(CurveGroup(panel.days[mask][first:], [portfolio_ids[k] for k in ks], v[first:]))
+    return out
+
 def equity_curve_from_holdings(db: Session, portfolio_id, start: Optional[datetime], end: Optional[datetime]) -> List[SeriesPoint]:
     """
-    Build portfolio equity curve by summing qty * close across holdings per date.
+    Build portfolio equity curve as closes @ qty across holdings per date.
     """
-    # Get holdings snapshot (assumes current qty; extend later with transaction-aware PnL if needed)
-    holdings = (
-        db.query(models.Holding)
-        .filter(models.Holding.portfolio_id == portfolio_id)
-        .all()
-    )
-    if not holdings:
-        return []
-
-    # For each instrument, load prices in range and accumulate
-    by_date: Dict[datetime, float] = {}
-    for h in holdings:
-        qty = _to_float(h.qty)
-        if qty == 0:
-            continue
-        q = db.query(models.Price).filter(models.Price.instrument_id == h.instrument_id)
-        if start:
-            q = q.filter(models.Price.ts >= start)
-        if end:
-            q = q.filter(models.Price.ts <= end)
-        q = q.order_by(models.Price.ts.asc())
-        for row in q.all():
-            ts = row.ts
-            val = qty * _to_float(row.close)
-            by_date[ts] = by_date.get(ts, 0.0) + val
-
-    # sort into series
-    series = [SeriesPoint(ts=k, value=v) for k, v in by_date.items()]
-    series.sort(key=lambda p: p.ts)
-    return series
+    # assumes current qty; see equity_curve_arrays
+    days, values = equity_curve_arrays(db, portfolio_id, start, end)
+    return [SeriesPoint(ts=_EPOCH + timedelta(days=d), value=v) for d, v in zip(days.tolist(), values.tolist())]
 
 def pct_returns(series: List[SeriesPoint]) -> List[Tuple[datetime, float]]:
     out: List[Tuple[datetime, float]] = []
@@ -138,13 +193,86 @@ def ensure_benchmark(db: Session, symbol: str) -> models.Benchmark:
     db.refresh(b)
     return b
 
-def benchmark_series(db: Session, symbol: str, start: Optional[datetime], end: Optional[datetime]) -> List[SeriesPoint]:
+@dataclass
+class BenchmarkData:
+    """A benchmark's whole close history with its daily returns, shared by every request."""
+    symbol: str
+    days: np.ndarray        # int64 epoch days
+    close: np.ndarray
+    returns: np.ndarray     # simple returns, NaN on the first day
+    stamp: tuple            # (bars, latest ts, sum of closes) when loaded
+
+    def window(self, start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+        """(epoch days, close) within [start, end]."""
+        lo = 0 if start is None else int(np.searchsorted(self.days, -(-_as_utc(start).timestamp() // 86400), side="left"))
+        hi = len(self.days) if end is None else int(np.searchsorted(self.days, _as_utc(end).timestamp() // 86400, side="right"))
+        return self.days[lo:hi], self.close[lo:hi]
+
+_MAX_BENCHMARKS = 16
+_bench_lock = threading.Lock()
+_benchmarks: "OrderedDict[str, BenchmarkData]" = OrderedDict()
+
+def benchmark_data(db: Session, symbol: str) -> BenchmarkData:
+    """
+    Cached per symbol. A single aggregate query checks the stored bars still
+    match what was loaded (appends change the count or latest ts, revisions
+    the sum), so many portfolios compared with one benchmark share one array.
+    """
     b = ensure_benchmark(db, symbol)
-    q = db.query(models.BenchmarkPrice).filter(models.BenchmarkPrice.benchmark_id == b.id)
-    if start:
-        q = q.filter(models.BenchmarkPrice.ts >= start)
-    if end:
-        q = q.filter(models.BenchmarkPrice.ts <= end)
-    q = q.order_by(models.BenchmarkPrice.ts.asc())
-    rows = q.all()
-    return [SeriesPoint(ts=r.ts, value=float(r.close)) for r in rows]
+    BP = models.BenchmarkPrice
+    stamp = tuple(
+        db.query(func.count(BP.ts), func.max(BP.ts), func.sum(BP.close))
+          .filter(BP.benchmark_id == b.id)
+          .one()
+    )
+    with _bench_lock:
+        hit = _benchmarks.get(b.symbol)
+        if hit is not None and hit.stamp == stamp:
+            _benchmarks.move_to_end(b.symbol)
+            return hit
+    rows = (
+        db.query(BP.ts, BP.close)
+          .filter(BP.benchmark_id == b.id)
+          .order_by(BP.ts.asc())
+          .all()
+    )
+    days = np.array([int(ts.timestamp() // 86400) for ts, _ in rows], dtype=np.int64)
+    close = np.array([_to_float(c) for _, c in rows], dtype=np.float64)
+    data = BenchmarkData(b.symbol, days, close, simple_returns(close), stamp)
+    with _bench_lock:
+        _benchmarks[b.symbol] = data
+        _benchmarks.move_to_end(b.symbol)
+        while len(_benchmarks) > _MAX_BENCHMARKS:
+            _benchmarks.popitem(last=False)
+    return data
+
+def benchmark_arrays(db: Session, symbol: str, start: Optional[datetime], end: Optional[datetime]) -> Tuple[np.ndarray, np.ndarray]:
+    """(epoch days, close) of a benchmark within [start, end], for aligning against array curves."""
+    return benchmark_data(db, symbol).window(start, end)
+
+def benchmark_series(db: Session, symbol: str, start: Optional[datetime], end: Optional[datetime]) -> List[SeriesPoint]:
+    days, close = benchmark_arrays(db, symbol, start, end)
+    return [SeriesPoint(ts=_EPOCH + timedelta(days=d), value=v) for d, v in zip(days.tolist(), close.tolist())]
+
+def _as_utc(t: datetime) -> datetime:
+    return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t
+
+def relative_to_benchmark(
+    days: np.ndarray,
+    values: np.ndarray,
+    bench: BenchmarkData,
+    rf_annual: float,
+) -> Dict[str, Optional[float]]:
+    """
+    Benchmark-relative statistics of a value curve, on the dates both have.
+    The join is an intersect1d of the two calendars; when the shared dates are
+    consecutive benchmark bars the cached benchmark returns are used as they are.
+    """
+    common, ip, ib = np.intersect1d(days, bench.days, assume_unique=True, return_indices=True)
+    rp = simple_returns(values[ip])[1:]
+    if len(ib) > 1 and (np.diff(ib) == 1).all():
+        rb = bench.returns[ib[1:]]
+    else:
+        rb = simple_returns(bench.close[ib])[1:]
+    ok = np.isfinite(rp) & np.isfinite(rb)
+    return {"common_days": int(len(common)), **relative_metrics(rp[ok], rb[ok], rf_annual)}
@@ -0,0 +1,140 @@
+# app/services/attribution.py
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db import models
+from services.panel import close_panel
+
+# Exposure and Brinson-Fachler attribution by sector or industry.
+# Instruments are mapped to integer group codes once; every per-group sum is
+# then one np.add.reduceat over the columns sorted by code, for all dates at once.
+#
+# The stored benchmarks (SPY, ...) are price series only, with no constituents
+# or sector weights, so the reference portfolio here is the classified
+# universe: every instrument with a sector (or industry), equally weighted and
+# rebalanced daily. Daily effects are linked over the period with Carino
+# factors so allocation + selection + interaction add up to the compounded
+# excess return.
+
+LEVELS = ("sector", "industry")
+UNCLASSIFIED = "Unclassified"
+
+@dataclass
+class Grouping:
+    labels: List[str]       # group names, sorted
+    order: np.ndarray       # column order that makes each group contiguous
+    starts: np.ndarray      # first sorted column of each group
+
+    @classmethod
+    def of(cls, labels: Sequence[Optional[str]]) -> "Grouping":
+        names, codes = np.unique(np.array([l or UNCLASSIFIED for l in labels], dtype=object), return_inverse=True)
+        order = np.argsort(codes, kind="stable")
+        starts = np.searchsorted(codes[order], np.arange(len(names)))
+        return cls([str(n) for n in names], order, starts)
+
+    def sum(self, x: np.ndarray) -> np.ndarray:
+        """Column sums per group: (..., N) -> (..., groups)."""
+        if not len(self.labels):
+            return np.zeros(x.shape[:-1] + (0,))
+        return np.add.reduceat(x[..., self.order], self.starts, axis=-1)
+
+@dataclass
+class Attribution:
+    days: np.ndarray                # (T,) close dates; effects are for the returns into days[1:]
+    groups: List[str]
+    exposure: np.ndarray            # (T, G) portfolio weight per group at each close
+    benchmark_exposure: np.ndarray  # (T, G)
+    portfolio_return: float         # compounded over the period
+    benchmark_return: float
+    allocation: np.ndarray          # (G,) linked totals
+    selection: np.ndarray
+    interaction: np.ndarray
+
+def _carino(rp: np.ndarray, rb: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """Per-day linking factors and the period returns."""
+    tp, tb = float(np.prod(1.0 + rp) - 1.0), float(np.prod(1.0 + rb) - 1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = np.where(rp != rb, (np.log1p(rp) - np.log1p(rb)) / (rp - rb), 1.0 / (1.0 + rp))
+    big_k = (np.log1p(tp) - np.log1p(tb)) / (tp - tb) if tp != tb else 1.0 / (1.0 + tp)
+    return k / big_k, tp, tb
+
+def brinson(
+    close: np.ndarray,
+    qty: np.ndarray,
+    in_benchmark: np.ndarray,
+    grouping: Grouping,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, float, float]:
+    """
+    Brinson-Fachler on a (T x N) close matrix: the portfolio holds `qty`, the
+    benchmark weighs the `in_benchmark` columns that have a return equally.
+    Returns (exposure, benchmark exposure, allocation, selection, interaction,
+    portfolio return, benchmark return).
+    """
+    value = np.nan_to_num(close) * qty
+    total = value.sum(axis=1, keepdims=True)
+    w = np.divide(value, total, out=np.zeros_like(value), where=total != 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = close[1:] / close[:-1] - 1.0
+    valid = np.isfinite(r)
+    rz = np.where(valid, r, 0.0)
+    members = valid & in_benchmark
+    wb = members / np.maximum(members.sum(axis=1, keepdims=True), 1)
+    wp = w[:-1]
+
+    Wp, Wb = grouping.sum(wp), grouping.sum(wb)
+    rp, rb = (wp * rz).sum(axis=1), (wb * rz).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        Rb = np.where(Wb > 0, grouping.sum(wb * rz) / Wb, rb[:, None])
+        Rp = np.where(Wp > 0, grouping.sum(wp * rz) / Wp, Rb)
+    allocation = (Wp - Wb) * (Rb - rb[:, None])
+    selection = Wb * (Rp - Rb)
+    interaction = (Wp - Wb) * (Rp - Rb)
+
+    link, tp, tb = _carino(rp, rb)
+    listed = np.isfinite(close) & in_benchmark
+    return (
+        grouping.sum(w), grouping.sum(listed / np.maximum(listed.sum(axis=1, keepdims=True), 1)),
+        link @ allocation, link @ selection, link @ interaction,
+        tp, tb,
+    )
+
+def universe_ids(db: Session, level: str) -> List[int]:
+    col = getattr(models.Instrument, level)
+    return [i for (i,) in db.query(models.Instrument.id).filter(col.isnot(None))]
+
+def attribute(
+    db: Session,
+    qty: Dict[int, float],
+    level: str = "sector",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Attribution:
+    """Exposure over time and linked attribution of holdings `qty` against the classified universe."""
+    if level not in LEVELS:
+        raise ValueError(f"level must be one of {', '.join(LEVELS)}")
+    universe = universe_ids(db, level)
+    panel = close_panel(db, list(qty) + universe, start, end)
+    ids = panel.instrument_ids
+    held = np.array([qty.get(i, 0.0) for i in ids])
+    close = panel.close
+    # from the first close every held instrument has
+    ok = np.isfinite(close[:, held != 0]).all(axis=1)
+    first = int(ok.argmax()) if ok.any() else len(close)
+    close, days = close[first:], panel.days[first:]
+
+    col = getattr(models.Instrument, level)
+    labels = dict(db.query(models.Instrument.id, col).filter(models.Instrument.id.in_(ids)).all()) if ids else {}
+    grouping = Grouping.of([labels.get(i) for i in ids])
+    in_bench = np.isin(np.array(ids, dtype=np.int64), np.array(universe, dtype=np.int64))
+    if len(close) < 2:
+        g = len(grouping.labels)
+        z = np.zeros(g)
+        return Attribution(days, grouping.labels, np.zeros((len(days), g)), np.zeros((len(days), g)), 0.0, 0.0, z, z, z)
+    exp, bexp, alloc, sel, inter, tp, tb = brinson(close, held, in_bench, grouping)
+    return Attribution(days, grouping.labels, exp, bexp, tp, tb, alloc, sel, inter)
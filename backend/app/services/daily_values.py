@@ -0,0 +1,172 @@
+# app/services/daily_values.py
+from __future__ import annotations
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+
+from db import models
+from services.analytics import equity_curve_arrays, holding_quantities
+from services.panel import close_panel, portfolio_values
+from services.rolling import simple_returns
+from services.valuation import daily_twr, forget, replay_portfolio, replay_since
+
+log = logging.getLogger("daily_values")
+
+# portfolio_daily_values holds each portfolio's curve per basis:
+#   holdings      current quantities at every close (rewritten whenever holdings change)
+#   transactions  the transaction replay: value, external flow and time-weighted return
+# Writers only recompute and touch the rows from the first day that can have
+# changed, seeded by the stored row before it; the analytics endpoints read
+# one indexed range.
+
+BASES = ("holdings", "transactions")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def _day(t: datetime) -> int:
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() // 86400)
+
+def _compute(db: Session, portfolio_id, basis: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(days, value, flow, ret) of the whole history, from the price store."""
+    if basis == "transactions":
+        rp = replay_portfolio(db, portfolio_id)
+        return rp.days, rp.value, rp.flow, daily_twr(rp.value, rp.flow)
+    days, value = equity_curve_arrays(db, portfolio_id, None, None)
+    return days, value, np.zeros(len(days)), np.nan_to_num(simple_returns(value))
+
+def _compute_tail(db: Session, portfolio_id, basis: str, prev_day: int, prev_value: float) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    (days, value, flow, ret) after the stored row on `prev_day`, its value
+    seeding the returns; None when the curve can't be extended from there.
+    """
+    if basis == "transactions":
+        rp = replay_since(db, portfolio_id, prev_day + 1)
+        if rp is None:
+            return None
+        ret = daily_twr(np.concatenate(([prev_value], rp.value)), np.concatenate(([0.0], rp.flow)))[1:]
+        return rp.days, rp.value, rp.flow, ret
+    qty = holding_quantities(db, portfolio_id)
+    if not qty:
+        return None
+    # from prev_day, where every held instrument must already have a close
+    panel = close_panel(db, list(qty), _EPOCH + timedelta(days=prev_day), None).complete()
+    if not len(panel.days) or panel.days[0] != prev_day:
+        return None
+    value = portfolio_values(panel, qty)[1:]
+    ret = np.nan_to_num(simple_returns(np.concatenate(([prev_value], value))))[1:]
+    return panel.days[1:], value, np.zeros(len(value)), ret
+
+def refresh_portfolio(db: Session, portfolio_id, basis: str, since: Optional[datetime] = None, full: bool = False) -> int:
+    """
+    Bring one basis of a portfolio's stored curve up to date and return the
+    rows written. Rows from the last stored day (its bar may have been
+    revised) or from `since` if earlier (a backdated transaction or bar) are
+    replaced; with `full`, nothing stored yet or `since` before the first
+    stored day (the curve may now start earlier), the whole curve is. Only
+    the replaced days are computed, continuing from the stored row before
+    them, unless that row can't seed them (see _compute_tail).
+    Caller owns the commit.
+    """
+    PDV = models.PortfolioDailyValue
+    mine = (PDV.portfolio_id == portfolio_id) & (PDV.basis == basis)
+    first, last = (None, None) if full else db.query(func.min(PDV.ts), func.max(PDV.ts)).filter(mine).one()
+    from_day = None if last is None else _day(last)
+    backdated = since is not None and (full or (from_day is not None and _day(since) < from_day))
+    if backdated and from_day is not None:
+        from_day = _day(since) if _day(since) > _day(first) else None
+    if backdated and basis == "transactions":
+        forget(portfolio_id)  # the remembered replay may hold revised bars
+
+    tail = None
+    if from_day is not None:
+        prev = (
+            db.query(PDV.ts, PDV.market_value).filter(mine, PDV.ts < _EPOCH + timedelta(days=from_day))
+              .order_by(PDV.ts.desc()).first()
+        )
+        if prev is not None:
+            tail = _compute_tail(db, portfolio_id, basis, _day(prev[0]), prev[1])
+    if tail is not None:
+        days, value, flow, ret = tail
+        db.execute(delete(PDV).where(mine, PDV.ts >= _EPOCH + timedelta(days=from_day)))
+        k = 0
+    else:
+        days, value, flow, ret = _compute(db, portfolio_id, basis)
+        if from_day is None:
+            db.execute(delete(PDV).where(mine))
+            k = 0
+        else:
+            db.execute(delete(PDV).where(mine, PDV.ts >= _EPOCH + timedelta(days=from_day)))
+            k = int(np.searchsorted(days, from_day, side="left"))
+    rows = [
+        {"portfolio_id": portfolio_id, "basis": basis, "ts": _EPOCH + timedelta(days=d), "market_value": v, "net_flow": f, "ret": r}
+        for d, v, f, r in zip(days[k:].tolist(), value[k:].tolist(), flow[k:].tolist(), ret[k:].tolist())
+    ]
+    if rows:
+        db.execute(insert(PDV), rows)
+    return len(rows)
+
+def refresh_for_instruments(db: Session, changed: Dict[int, datetime]) -> int:
+    """
+    After bars were written: refresh the stored curves that read them, from
+    the earliest changed bar, or in full where an instrument's first bar was
+    among those written (it had no history, or gained some further back).
+    Curves never materialised are left for the first read. Commits; returns
+    the number of portfolio curves refreshed.
+    """
+    if not changed:
+        return 0
+    PDV, P = models.PortfolioDailyValue, models.Price
+    firsts = dict(
+        db.query(P.instrument_id, func.min(P.ts)).filter(P.instrument_id.in_(list(changed))).group_by(P.instrument_id).all()
+    )
+    new_start = {iid for iid, ts in changed.items() if iid in firsts and ts <= firsts[iid]}
+    n = 0
+    for basis, owner in (("holdings", models.Holding), ("transactions", models.Transaction)):
+        since: Dict[object, datetime] = {}
+        full = set()
+        pairs = (
+            db.query(owner.portfolio_id, owner.instrument_id)
+              .filter(owner.instrument_id.in_(list(changed)))
+              .filter(owner.portfolio_id.in_(db.query(PDV.portfolio_id).filter(PDV.basis == basis)))
+              .distinct()
+        )
+        for pid, iid in pairs:
+            since[pid] = min(since.get(pid, changed[iid]), changed[iid])
+            if iid in new_start:
+                full.add(pid)
+        for pid, ts in since.items():
+            refresh_portfolio(db, pid, basis, since=ts, full=pid in full)
+            n += 1
+    db.commit()
+    return n
+
+def daily_values(db: Session, portfolio_id, basis: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (days, value, flow, ret) of a stored curve within [start, end], in one
+    range query; a curve that was never stored is computed and stored first.
+    """
+    PDV = models.PortfolioDailyValue
+
+    def read():
+        q = db.query(PDV.ts, PDV.market_value, PDV.net_flow, PDV.ret).filter(PDV.portfolio_id == portfolio_id, PDV.basis == basis)
+        if start:
+            q = q.filter(PDV.ts >= start)
+        if end:
+            q = q.filter(PDV.ts <= end)
+        return q.order_by(PDV.ts.asc()).all()
+
+    rows = read()
+    if not rows and not db.query(PDV.id).filter(PDV.portfolio_id == portfolio_id, PDV.basis == basis).first():
+        if refresh_portfolio(db, portfolio_id, basis, full=True):
+            db.commit()
+            rows = read()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0)
+    days = np.array([_day(r[0]) for r in rows], dtype=np.int64)
+    value, flow, ret = (np.array(c, dtype=np.float64) for c in list(zip(*rows))[1:])
+    return days, value, flow, ret
@@ -0,0 +1,84 @@
+# app/services/downsample.py
+from __future__ import annotations
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from services.price_encoding import OHLCV
+
+# Chart payloads only need as many points as the chart has pixels. Line
+# series (equity curves, indicators) use Largest-Triangle-Three-Buckets, which
+# keeps peaks and troughs; candles are merged into OHLC buckets so every
+# high/low in the range survives.
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points LTTB keeps; always includes the first and last point."""
+    n = len(x)
+    if n_out >= n or n <= 2:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 buckets between the fixed endpoints; step >= 1 so none is empty
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    nxt_hi = np.append(edges[2:], n)
+    # mean of the *next* bucket for every bucket, in one cumsum pass
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    lo_n, hi_n = edges[1:], nxt_hi
+    cnt = (hi_n - lo_n).astype(np.float64)
+    avg_x = (cx[hi_n] - cx[lo_n]) / cnt
+    avg_y = (cy[hi_n] - cy[lo_n]) / cnt
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        xs, ys = x[lo:hi], y[lo:hi]
+        area = np.abs((x[a] - avg_x[i]) * (ys - y[a]) - (x[a] - xs) * (avg_y[i] - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+def lttb_sparse(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """LTTB over the finite points only (indicator warm-ups are NaN); returns indices into y."""
+    valid = np.flatnonzero(np.isfinite(y))
+    if len(valid) == len(y):
+        return lttb_indices(x, y, n_out)
+    return valid[lttb_indices(x[valid], y[valid], n_out)]
+
+def ohlcv_buckets(b: OHLCV, n_out: int) -> OHLCV:
+    """Merge candles into <= n_out buckets: first open, max high, min low, last close, summed volume."""
+    n = len(b)
+    if n_out >= n or n_out < 1:
+        return b
+    starts = np.linspace(0, n, n_out, endpoint=False).astype(np.int64)
+    return reduce_ohlcv(b, starts)
+
+def reduce_ohlcv(b: OHLCV, starts: np.ndarray) -> OHLCV:
+    """Aggregate consecutive runs of candles; `starts` are the sorted first indices of each run."""
+    ends = np.append(starts[1:], len(b)) - 1
+    v = np.add.reduceat(np.nan_to_num(b.v), starts)
+    all_nan = np.add.reduceat(np.isfinite(b.v).astype(np.int64), starts) == 0
+    v[all_nan] = np.nan
+    return OHLCV(
+        ts=b.ts[starts],
+        o=b.o[starts],
+        h=np.maximum.reduceat(b.h, starts),
+        l=np.minimum.reduceat(b.l, starts),
+        c=b.c[ends],
+        v=v,
+    )
+
+def keep_indices(ts: Sequence, values: Sequence[Optional[float]], max_points: Optional[int]) -> Optional[List[int]]:
+    """
+    Indices to keep from a (ts, value) series for `max_points`, or None when no
+    downsampling is needed. ts may be datetimes or epoch numbers.
+    """
+    if not max_points or len(values) <= max_points:
+        return None
+    x = np.array([t.timestamp() if hasattr(t, "timestamp") else t for t in ts], dtype=np.float64)
+    y = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    return lttb_sparse(x, y, max_points).tolist()
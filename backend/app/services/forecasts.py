@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 
 from core.config import settings
 from db import models
+from services.price_store import price_store
 
 log = logging.getLogger("forecasts")
 
@@ -81,18 +82,11 @@ def train_and_forecast_for_instrument(
         raise ValueError("Instrument not found")
 
     since = datetime.now(timezone.utc) - timedelta(days=lookback)
-    rows = (
-        db.query(models.Price)
-          .filter(models.Price.instrument_id == instrument_id)
-          .filter(models.Price.ts >= since)
-          .order_by(models.Price.ts.asc())
-          .all()
-    )
-    if len(rows) < 60:
+    prices = price_store.get(db, instrument_id).slice(since)
+    if len(prices) < 60:
         raise ValueError("Not enough history to train (need >= 60 days)")
 
-    ts = np.array([r.ts for r in rows])
-    y = np.array([float(r.close) for r in rows], dtype=float)
+    y = prices.close.copy()
 
     # features
     X, names, mask = _build_features(y)
@@ -131,7 +125,7 @@ def train_and_forecast_for_instrument(
         y_hist = np.append(y_hist, y_new)
 
     # dates to predict (business days after last known)
-    last_day = rows[-1].ts.date()
+    last_day = prices.timestamps()[-1].date()
     future_ts = _business_days(last_day, horizon)
 
     z = float(settings.forecast_band_z or 1.96)
@@ -0,0 +1,248 @@
+# app/services/indicator_state.py
+from __future__ import annotations
+import copy
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models
+from services import indicators as ind
+from services.price_store import price_store
+
+log = logging.getLogger("indicator_state")
+
+# sma_<w>, ema_<w> and rsi_<p> series are stored whole (indicator_values),
+# computed from an instrument's first bar so they don't depend on the range
+# a client asks for. Each series keeps its running state (indicator_states):
+#   sma  the last w closes as a ring buffer and their sum
+#   ema  the last value
+#   rsi  the previous close and Wilder's average gain / loss
+# so new bars are folded in at O(1) each. The state before the last bar is
+# kept as well, because the intraday refresh rewrites today's bar; a
+# revision further back rebuilds the series from the price store.
+
+KINDS = ("sma", "ema", "rsi")
+MAX_PERIOD = 1000
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def parse(name: str) -> Tuple[str, int]:
+    kind, _, p = name.partition("_")
+    if kind not in KINDS or not p.isdigit() or not 0 < int(p) <= MAX_PERIOD:
+        raise ValueError(f"not a stored indicator: {name}")
+    return kind, int(p)
+
+def _storable(name: str) -> bool:
+    try:
+        parse(name)
+        return True
+    except ValueError:
+        return False
+
+def _day(t: datetime) -> int:
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() // 86400)
+
+# ---------- state machines ----------
+
+def _build(kind: str, p: int, close: np.ndarray) -> Tuple[np.ndarray, dict]:
+    """Values over `close` and the state after its last bar, with the array engine."""
+    if kind == "sma":
+        tail = close[-p:]
+        return ind.sma_many(close, [p])[p], {"buf": tail.tolist(), "pos": 0, "sum": float(tail.sum())}
+    if kind == "ema":
+        values = ind.ema_many(close, [p])[p] if len(close) else np.empty(0)
+        return values, {"v": float(values[-1]) if len(values) else None}
+    d = np.diff(close)
+    up, down = np.maximum(d, 0.0), np.maximum(-d, 0.0)
+    if len(d) >= p:
+        gain, loss = float(ind.wilder(up, p)[-1]), float(ind.wilder(down, p)[-1])
+    else:  # still warming up: running sums
+        gain, loss = float(up.sum()), float(down.sum())
+    st = {"prev": float(close[-1]) if len(close) else None, "n": len(d), "gain": gain, "loss": loss}
+    return ind.rsi_array(close, p), st
+
+def _step(kind: str, p: int, st: dict, c: float) -> Optional[float]:
+    """Fold one close into `st` (in place) and return the indicator's new value."""
+    if kind == "sma":
+        buf = st["buf"]
+        if len(buf) < p:
+            buf.append(c)
+            st["sum"] += c
+            return st["sum"] / p if len(buf) == p else None
+        st["sum"] += c - buf[st["pos"]]
+        buf[st["pos"]] = c
+        st["pos"] = (st["pos"] + 1) % p
+        return st["sum"] / p
+    if kind == "ema":
+        a = 2.0 / (p + 1.0)
+        st["v"] = c if st["v"] is None else a * c + (1.0 - a) * st["v"]
+        return st["v"]
+    prev, st["prev"] = st["prev"], c
+    if prev is None:
+        return None
+    d = c - prev
+    g, l = max(d, 0.0), max(-d, 0.0)
+    st["n"] += 1
+    if st["n"] < p:
+        st["gain"] += g
+        st["loss"] += l
+        return None
+    if st["n"] == p:
+        st["gain"], st["loss"] = (st["gain"] + g) / p, (st["loss"] + l) / p
+    else:
+        st["gain"] = (st["gain"] * (p - 1) + g) / p
+        st["loss"] = (st["loss"] * (p - 1) + l) / p
+    return 100.0 if st["loss"] == 0 else 100.0 - 100.0 / (1.0 + st["gain"] / st["loss"])
+
+# ---------- persistence ----------
+
+# Reads store series on first use, so two requests can build the same one at
+# once: both writes are upserts and the later one wins with identical values.
+
+def _write_values(db: Session, instrument_id: int, name: str, days: Sequence[int], values: Sequence[Optional[float]]) -> None:
+    rows = [
+        {"instrument_id": instrument_id, "name": name, "ts": _EPOCH + timedelta(days=d), "value": None if v is None or v != v else v}
+        for d, v in zip(days, values)
+    ]
+    if rows:
+        stmt = pg_insert(models.IndicatorValue)
+        db.execute(stmt.on_conflict_do_update(index_elements=["instrument_id", "name", "ts"], set_={"value": stmt.excluded.value}), rows)
+
+def _save_state(db: Session, instrument_id: int, name: str, state: dict, last_ts: Optional[datetime]) -> None:
+    stmt = pg_insert(models.IndicatorState).values(instrument_id=instrument_id, name=name, state=state, last_ts=last_ts, updated_at=func.now())
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["instrument_id", "name"],
+        set_={"state": stmt.excluded.state, "last_ts": stmt.excluded.last_ts, "updated_at": func.now()},
+    ))
+
+def rebuild(db: Session, instrument_id: int, names: Sequence[str]) -> None:
+    """Recompute the named series of an instrument from its whole history. Caller owns the commit."""
+    IV = models.IndicatorValue
+    series = price_store.get(db, instrument_id)
+    days, close = series.days.tolist(), series.close
+    db.execute(delete(IV).where(IV.instrument_id == instrument_id, IV.name.in_(list(names))))
+    for name in sorted(names):  # one lock order for concurrent rebuilds
+        kind, p = parse(name)
+        values, st = _build(kind, p, close[:-1])
+        before = None
+        values = values.tolist()
+        if len(close):
+            before = copy.deepcopy(st)
+            values.append(_step(kind, p, st, float(close[-1])))
+        _write_values(db, instrument_id, name, days, values)
+        _save_state(db, instrument_id, name, {"last": st, "before": before}, _EPOCH + timedelta(days=days[-1]) if days else None)
+
+def advance(db: Session, instrument_id: int, since: Optional[datetime] = None) -> int:
+    """
+    Bring every stored series of an instrument up to its latest bar: bars
+    after the last one folded in are stepped through; a rewritten last bar
+    (`since` on that day) is re-stepped from the state before it; anything
+    earlier rebuilds. Returns the bars folded in. Caller owns the commit.
+    """
+    IV, IS = models.IndicatorValue, models.IndicatorState
+    states = db.query(IS).filter(IS.instrument_id == instrument_id).all()
+    if not states:
+        return 0
+    series = price_store.get(db, instrument_id)
+    stale: List[str] = []
+    folded = 0
+    for s in states:
+        if s.last_ts is None:
+            stale.append(s.name)
+            continue
+        last = _day(s.last_ts)
+        if since is not None and _day(since) < last:
+            stale.append(s.name)
+            continue
+        redo = since is not None and _day(since) == last
+        if redo and s.state.get("before") is None:
+            stale.append(s.name)
+            continue
+        k = int(np.searchsorted(series.days, last, side="left" if redo else "right"))
+        if k >= len(series):
+            continue
+        kind, p = parse(s.name)
+        st = copy.deepcopy(s.state["before"] if redo else s.state["last"])
+        closes = series.close[k:].tolist()
+        values = [_step(kind, p, st, c) for c in closes[:-1]]
+        before = copy.deepcopy(st)
+        values.append(_step(kind, p, st, closes[-1]))
+        days = series.days[k:].tolist()
+        db.execute(delete(IV).where(IV.instrument_id == instrument_id, IV.name == s.name, IV.ts >= _EPOCH + timedelta(days=days[0])))
+        _write_values(db, instrument_id, s.name, days, values)
+        s.state = {"last": st, "before": before}
+        s.last_ts = _EPOCH + timedelta(days=days[-1])
+        folded += len(values)
+    if stale:
+        rebuild(db, instrument_id, stale)
+    return folded
+
+def advance_for_instruments(db: Session, changed: Dict[int, datetime]) -> int:
+    """After bars were written: advance the stored series of those instruments. Commits."""
+    if not changed:
+        return 0
+    IS = models.IndicatorState
+    tracked = [i for (i,) in db.query(IS.instrument_id).filter(IS.instrument_id.in_(list(changed))).distinct()]
+    for iid in tracked:
+        advance(db, iid, changed[iid])
+    db.commit()
+    return len(tracked)
+
+def read(db: Session, instrument_id: int, names: Sequence[str], days: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Stored values of the named series on `days` (a range of the instrument's
+    bars), storing or advancing them first where needed. Names that aren't
+    storable (see parse) or beyond the per-instrument cap on stored series
+    are left out for the caller to compute.
+    """
+    IV, IS = models.IndicatorValue, models.IndicatorState
+    names = [n for n in dict.fromkeys(names) if _storable(n)]
+    if not names or not len(days):
+        return {}
+    states = {s.name: s for s in db.query(IS).filter(IS.instrument_id == instrument_id)}
+    room = max(settings.indicator_states_per_instrument - len(states), 0)
+    missing = [n for n in names if n not in states][:room]
+    wanted = [n for n in names if n in states] + missing
+
+    series = price_store.get(db, instrument_id)
+    latest = int(series.days[-1]) if len(series) else None
+    behind = any(s.last_ts is None or _day(s.last_ts) < latest for s in states.values()) if latest is not None else False
+    if missing or behind:
+        try:
+            if behind:
+                advance(db, instrument_id)
+            if missing:
+                rebuild(db, instrument_id, missing)
+            db.commit()
+        except DBAPIError:
+            # e.g. a deadlock with a concurrent writer: the caller computes them this time
+            db.rollback()
+            log.warning("indicator_state_write_failed", exc_info=True, extra={"instrument_id": instrument_id})
+            return {}
+    if not wanted:
+        return {}
+
+    out = {}
+    for name in wanted:
+        rows = (
+            db.query(IV.ts, IV.value)
+              .filter(IV.instrument_id == instrument_id, IV.name == name)
+              .filter(IV.ts >= _EPOCH + timedelta(days=int(days[0])), IV.ts <= _EPOCH + timedelta(days=int(days[-1])))
+              .all()
+        )
+        at = np.array([_day(ts) for ts, _ in rows], dtype=np.int64)
+        vals = np.array([np.nan if v is None else v for _, v in rows], dtype=np.float64)
+        col = np.full(len(days), np.nan)
+        i = np.searchsorted(days, at)
+        ok = (i < len(days)) & (days[np.minimum(i, len(days) - 1)] == at)
+        col[i[ok]] = vals[ok]
+        out[name] = col
+    return out
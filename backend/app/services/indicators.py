@@ -1,80 +1,187 @@
 # app/services/indicators.py
 from __future__ import annotations
-from collections import deque
-from typing import Iterable, List, Dict, Tuple, Optional
-from math import sqrt
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+from datetime import datetime
 
-# Helpers return lists of (ts, value) aligned to input order
-# Input closes: list[tuple[datetime, float]]
+import numpy as np
+from sqlalchemy.orm import Session
+
+from services.price_store import PriceSeries, price_store
+
+log = logging.getLogger("indicators")
+
+try:
+    from scipy.signal import lfilter
+except Exception as e:
+    lfilter = None
+    log.warning("scipy import failed; EMA recurrences fall back to a numpy loop: %s", e)
+
+# Array engine: every function takes float64 arrays (oldest first) and
+# returns arrays of the same length, NaN where the indicator isn't defined
+# yet. All windows of one kind are computed in one pass over the series.
+# The list helpers at the bottom keep the original (ts, value) interface.
+
+# ---------- moving averages ----------
+
+def sma_many(x: np.ndarray, windows: Sequence[int]) -> Dict[int, np.ndarray]:
+    """Simple moving averages for every window from one cumulative sum."""
+    base = x[0] if len(x) else 0.0
+    cs = np.concatenate(([0.0], np.cumsum(x - base)))  # offset keeps the running sum small
+    out: Dict[int, np.ndarray] = {}
+    for w in windows:
+        col = np.full(len(x), np.nan)
+        if 0 < w <= len(x):
+            col[w - 1:] = (cs[w:] - cs[:-w]) / w + base
+        out[w] = col
+    return out
+
+def _smooth(x: np.ndarray, alphas: np.ndarray, y0: np.ndarray) -> np.ndarray:
+    """
+    y[t] = a * x[t] + (1 - a) * y[t-1] for each alpha, from y[-1] = y0.
+    Shape (len(alphas), len(x)).
+    """
+    out = np.empty((len(alphas), len(x)))
+    if not len(x):
+        return out
+    if lfilter is not None:
+        for k, a in enumerate(alphas):
+            out[k] = lfilter([a], [1.0, a - 1.0], x, zi=[(1.0 - a) * y0[k]])[0]
+        return out
+    # one step over all alphas per row
+    y, keep = y0.astype(np.float64), 1.0 - alphas
+    for t, v in enumerate(x):
+        y = alphas * v + keep * y
+        out[:, t] = y
+    return out
+
+def ema_many(x: np.ndarray, windows: Sequence[int]) -> Dict[int, np.ndarray]:
+    """Exponential moving averages, alpha = 2 / (w + 1), seeded with the first value."""
+    ws = [w for w in windows if w > 0]
+    if not ws or not len(x):
+        return {w: np.full(len(x), np.nan) for w in ws}
+    alphas = np.array([2.0 / (w + 1.0) for w in ws])
+    rows = _smooth(x, alphas, np.full(len(ws), x[0]))
+    return dict(zip(ws, rows))
+
+def wilder(x: np.ndarray, period: int) -> np.ndarray:
+    """Wilder's smoothing: the mean of the first `period` values, then alpha = 1 / period."""
+    out = np.full(len(x), np.nan)
+    if period <= 0 or len(x) < period:
+        return out
+    seed = x[:period].mean()
+    out[period - 1] = seed
+    out[period:] = _smooth(x[period:], np.array([1.0 / period]), np.array([seed]))[0]
+    return out
+
+# ---------- oscillators and bands ----------
+
+def rsi_array(close: np.ndarray, period: int = 14) -> np.ndarray:
+    """Wilder RSI; the first value is at index `period`. 100 when there were no losses."""
+    out = np.full(len(close), np.nan)
+    if period <= 0 or len(close) <= period:
+        return out
+    d = np.diff(close)
+    gain = wilder(np.maximum(d, 0.0), period)[period - 1:]
+    loss = wilder(np.maximum(-d, 0.0), period)[period - 1:]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out[period:] = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+    return out
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> Dict[str, np.ndarray]:
+    """MACD line (fast EMA - slow EMA), its signal EMA and the histogram."""
+    e = ema_many(close, [fast, slow])
+    line = e[fast] - e[slow]
+    sig = ema_many(line, [signal])[signal]
+    return {"macd": line, "signal": sig, "hist": line - sig}
+
+def bollinger(close: np.ndarray, window: int = 20, k: float = 2.0) -> Dict[str, np.ndarray]:
+    """Middle band (SMA) and the bands k population standard deviations either side."""
+    mid = sma_many(close, [window])[window]
+    sd = np.full(len(close), np.nan)
+    if 0 < window <= len(close):
+        sd[window - 1:] = np.lib.stride_tricks.sliding_window_view(close, window).std(axis=1)
+    return {"mid": mid, "upper": mid + k * sd, "lower": mid - k * sd}
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """max(high - low, |high - prev close|, |low - prev close|); a bar without high/low uses its close."""
+    h = np.where(np.isnan(high), close, high)
+    l = np.where(np.isnan(low), close, low)
+    tr = h - l
+    if len(close) > 1:
+        prev = close[:-1]
+        tr[1:] = np.maximum(tr[1:], np.maximum(np.abs(h[1:] - prev), np.abs(l[1:] - prev)))
+    return tr
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14) -> np.ndarray:
+    return wilder(true_range(high, low, close), period)
+
+def obv(close: np.ndarray, volume: np.ndarray) -> np.ndarray:
+    """On-balance volume from 0; bars without volume add nothing."""
+    out = np.zeros(len(close))
+    if len(close) > 1:
+        out[1:] = np.cumsum(np.sign(np.diff(close)) * np.nan_to_num(volume[1:]))
+    return out
+
+# ---------- batch ----------
+
+@dataclass
+class IndicatorSpec:
+    sma: List[int] = field(default_factory=list)
+    ema: List[int] = field(default_factory=list)
+    rsi: List[int] = field(default_factory=list)
+    macd: Optional[Tuple[int, int, int]] = None
+    bollinger: Optional[Tuple[int, float]] = None
+    atr: Optional[int] = None
+    obv: bool = False
+
+def compute(series: PriceSeries, spec: IndicatorSpec) -> Dict[str, np.ndarray]:
+    """Every indicator in `spec` as columns aligned to the series' bars."""
+    c = series.close
+    cols: Dict[str, np.ndarray] = {}
+    for w, v in sma_many(c, spec.sma).items():
+        cols[f"sma_{w}"] = v
+    for w, v in ema_many(c, spec.ema).items():
+        cols[f"ema_{w}"] = v
+    for p in spec.rsi:
+        cols[f"rsi_{p}"] = rsi_array(c, p)
+    if spec.macd:
+        for name, v in macd(c, *spec.macd).items():
+            cols[f"macd_{name}"] = v
+    if spec.bollinger:
+        for name, v in bollinger(c, *spec.bollinger).items():
+            cols[f"bb_{name}"] = v
+    if spec.atr:
+        cols[f"atr_{spec.atr}"] = atr(series.high, series.low, c, spec.atr)
+    if spec.obv:
+        cols["obv"] = obv(c, series.volume)
+    return cols
+
+# ---------- (ts, value) helpers ----------
+# Input closes: list[tuple[datetime, float]]; outputs are aligned to input order
+
+def load_closes(db: Session, instrument_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Tuple]:
+    """(ts, close) for an instrument's bars in [start, end], read through the price store."""
+    return price_store.get(db, instrument_id).slice(start, end).closes()
+
+def _pairs(closes: List[Tuple], values: np.ndarray) -> List[Tuple]:
+    return [(ts, None if v != v else v) for (ts, _), v in zip(closes, values.tolist())]
+
+def _values(closes: List[Tuple]) -> np.ndarray:
+    return np.array([c for _, c in closes], dtype=np.float64)
 
 def sma(closes: List[Tuple], window: int) -> List[Tuple]:
     if window <= 0:
         return []
-    out: List[Tuple] = []
-    q: deque = deque()
-    s = 0.0
-    for ts, c in closes:
-        q.append(c)
-        s += c
-        if len(q) > window:
-            s -= q.popleft()
-        if len(q) == window:
-            out.append((ts, s / window))
-        else:
-            out.append((ts, None))
-    return out
+    return _pairs(closes, sma_many(_values(closes), [window])[window])
 
 def ema(closes: List[Tuple], window: int) -> List[Tuple]:
     if window <= 0:
         return []
-    out: List[Tuple] = []
-    k = 2.0 / (window + 1.0)
-    ema_val: Optional[float] = None
-    for ts, c in closes:
-        if ema_val is None:
-            ema_val = c  # seed with first value; or could use SMA of first window
-        else:
-            ema_val = c * k + ema_val * (1 - k)
-        out.append((ts, ema_val))
-    return out
+    return _pairs(closes, ema_many(_values(closes), [window])[window])
 
 def rsi(closes: List[Tuple], period: int = 14) -> List[Tuple]:
     if period <= 0:
         return []
-    out: List[Tuple] = []
-    gains: deque = deque(maxlen=period)
-    losses: deque = deque(maxlen=period)
-    prev: Optional[float] = None
-    avg_gain: Optional[float] = None
-    avg_loss: Optional[float] = None
-
-    for ts, c in closes:
-        if prev is None:
-            out.append((ts, None))
-            prev = c
-            continue
-
-        change = c - prev
-        prev = c
-        gain = max(change, 0.0)
-        loss = max(-change, 0.0)
-
-        if avg_gain is None:  # warm-up first 'period' samples
-            gains.append(gain)
-            losses.append(loss)
-            if len(gains) < period:
-                out.append((ts, None))
-                continue
-            avg_gain = sum(gains) / period
-            avg_loss = sum(losses) / period
-        else:
-            # Wilder's smoothing
-            avg_gain = (avg_gain * (period - 1) + gain) / period
-            avg_loss = (avg_loss * (period - 1) + loss) / period
-
-        if avg_loss == 0:
-            out.append((ts, 100.0))
-        else:
-            rs = avg_gain / avg_loss
-            out.append((ts, 100.0 - (100.0 / (1.0 + rs))))
-    return out
+    return _pairs(closes, rsi_array(_values(closes), period))
@@ -0,0 +1,249 @@
+# app/services/ingest.py
+from __future__ import annotations
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models
+from services.market_data import get_provider
+from services.market_data.base import MarketDataProvider, PriceBar
+from services.daily_values import refresh_for_instruments
+from services.indicator_state import advance_for_instruments
+from services.price_store import price_store
+
+log = logging.getLogger("ingest")
+
+# 8 bound params per row; stays well under Postgres' 65535 parameter cap
+BATCH_SIZE = 5000
+
+_OHLCV = ("open", "high", "low", "close", "volume")
+
+@dataclass
+class UpsertCounts:
+    inserted: int = 0
+    updated: int = 0
+    first_ts: Optional[datetime] = None  # earliest bar inserted or updated
+
+    def __iadd__(self, other: "UpsertCounts") -> "UpsertCounts":
+        self.inserted += other.inserted
+        self.updated += other.updated
+        if other.first_ts is not None and (self.first_ts is None or other.first_ts < self.first_ts):
+            self.first_ts = other.first_ts
+        return self
+
+def _batches(bars: Iterable[PriceBar], size: int) -> Iterator[List[PriceBar]]:
+    it = iter(bars)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _recording(bars: Iterable[PriceBar], into: List[PriceBar]) -> Iterator[PriceBar]:
+    for b in bars:
+        into.append(b)
+        yield b
+
+def _upsert(db: Session, model, owner_col: str, owner_id: int, bars: Iterable[PriceBar], source: str | None) -> UpsertCounts:
+    """
+    INSERT ... ON CONFLICT (owner, ts) DO UPDATE, one statement per batch.
+    Rows whose OHLCV is unchanged are skipped by the WHERE clause, so they are
+    neither rewritten nor counted. `xmax = 0` tells fresh inserts from updates.
+    """
+    table = model.__table__
+    counts = UpsertCounts()
+    for chunk in _batches(bars, BATCH_SIZE):
+        # de-dupe within the batch: ON CONFLICT cannot touch the same row twice
+        rows = {}
+        for b in chunk:
+            rows[b["ts"]] = {
+                owner_col: owner_id,
+                "ts": b["ts"],
+                "open": b["open"], "high": b["high"], "low": b["low"], "close": b["close"],
+                "volume": b.get("volume"),
+                "source": source,
+            }
+        stmt = pg_insert(table).values(list(rows.values()))
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[owner_col, "ts"],
+            set_={c: excluded[c] for c in (*_OHLCV, "source")},
+            where=or_(*(table.c[c].is_distinct_from(excluded[c]) for c in _OHLCV)),
+        ).returning(literal_column("(xmax = 0)").label("inserted"), table.c.ts)
+        for was_insert, ts in db.execute(stmt):
+            if was_insert:
+                counts.inserted += 1
+            else:
+                counts.updated += 1
+            if counts.first_ts is None or ts < counts.first_ts:
+                counts.first_ts = ts
+    return counts
+
+def _bump_revision(db: Session, instrument_id: int) -> None:
+    table = models.PriceRevision.__table__
+    stmt = pg_insert(table).values(instrument_id=instrument_id, revision=1, revised_at=func.now())
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["instrument_id"],
+        set_={"revision": table.c.revision + 1, "revised_at": func.now()},
+    ))
+
+def upsert_price_bars(db: Session, instrument_id: int, bars: Iterable[PriceBar], source: str | None = None) -> UpsertCounts:
+    """
+    Bulk upsert daily bars into `prices`. Writing anything before the latest
+    stored bar (a backfill or a revision) bumps the instrument's price
+    revision, which retires its bars in the price snapshot. Caller owns the commit.
+    """
+    P = models.Price
+    latest = db.query(func.max(P.ts)).filter(P.instrument_id == instrument_id).scalar()
+    counts = _upsert(db, P, "instrument_id", instrument_id, bars, source)
+    if latest is not None and counts.first_ts is not None and counts.first_ts < latest:
+        _bump_revision(db, instrument_id)
+    return counts
+
+def upsert_benchmark_bars(db: Session, benchmark_id: int, bars: Iterable[PriceBar], source: str | None = None) -> UpsertCounts:
+    """Bulk upsert daily bars into `benchmark_prices`. Caller owns the commit."""
+    return _upsert(db, models.BenchmarkPrice, "benchmark_id", benchmark_id, bars, source)
+
+# ---------- async multi-symbol engine ----------
+
+@dataclass
+class SyncTarget:
+    symbol: str
+    instrument_id: int
+    start: Optional[date] = None
+    last_ts: Optional[datetime] = None  # latest stored bar; lets the provider fetch only the tail
+
+def build_sync_targets(
+    db: Session,
+    instruments: Sequence[Tuple[int, str]],
+    start: Optional[date],
+    ensure_history: bool = True,
+) -> List[SyncTarget]:
+    """
+    Attach the stored bar range of each (instrument_id, symbol) in one grouped
+    query so only the missing tail is requested. With `ensure_history`, an
+    instrument whose stored bars don't reach back to `start` asks for the whole
+    window again instead.
+    """
+    ids = [iid for iid, _ in instruments]
+    if not ids:
+        return []
+    spans = {
+        iid: (lo, hi)
+        for iid, lo, hi in (
+            db.query(models.Price.instrument_id, func.min(models.Price.ts), func.max(models.Price.ts))
+              .filter(models.Price.instrument_id.in_(ids))
+              .group_by(models.Price.instrument_id)
+              .all()
+        )
+    }
+    out: List[SyncTarget] = []
+    for iid, symbol in instruments:
+        lo, hi = spans.get(iid, (None, None))
+        if ensure_history and lo is not None and start is not None and lo.date() > start + timedelta(days=4):
+            hi = None
+        out.append(SyncTarget(symbol=symbol, instrument_id=iid, start=start, last_ts=hi))
+    return out
+
+@dataclass
+class SyncReport:
+    inserted: int = 0
+    updated: int = 0
+    errors: List[Dict] = field(default_factory=list)
+    changed: Dict[int, datetime] = field(default_factory=dict)  # instrument_id -> earliest bar written
+
+async def sync_daily_prices(
+    db: Session,
+    targets: Sequence[SyncTarget],
+    provider: MarketDataProvider | None = None,
+    concurrency: int | None = None,
+) -> SyncReport:
+    """
+    Fetch many symbols concurrently and write them as they arrive.
+    Fetches are paced by the provider's request budget (PROVIDER_RPM) and capped
+    at `concurrency` in flight; a single writer drains a bounded queue so network
+    waits overlap with DB writes while the Session is only ever used serially.
+    Commits once per symbol so a late failure keeps earlier progress, then
+    updates the in-process price store, the stored daily portfolio values
+    and the stored indicator series.
+    """
+    provider = provider or get_provider()
+    n = max(1, concurrency or settings.provider_concurrency)
+    sem = asyncio.Semaphore(n)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=n)
+    report = SyncReport()
+
+    async def fetch(t: SyncTarget) -> None:
+        async with sem:
+            try:
+                bars = await provider.astream_daily_prices(t.symbol, start=t.start, last_ts=t.last_ts)
+            except Exception as e:
+                log.warning("provider_daily_failed", exc_info=True, extra={"symbol": t.symbol})
+                report.errors.append({"symbol": t.symbol, "error": str(e)})
+                return
+        # enqueue outside the semaphore so the next fetch can start immediately
+        await queue.put((t, bars))
+
+    def write(t: SyncTarget, bars: Iterable[PriceBar]) -> UpsertCounts:
+        # a cached series is extended with what we wrote instead of being reloaded
+        written: Optional[List[PriceBar]] = [] if t.instrument_id in price_store else None
+        if written is not None:
+            bars = _recording(bars, written)
+        try:
+            counts = upsert_price_bars(db, t.instrument_id, bars, source=provider.name)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        if counts.inserted or counts.updated:
+            if written is not None:
+                price_store.append(t.instrument_id, written)
+            else:
+                price_store.invalidate(t.instrument_id)
+        return counts
+
+    async def writer() -> None:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            t, bars = item
+            try:
+                counts = await asyncio.to_thread(write, t, bars)
+            except Exception as e:
+                log.exception("price_upsert_failed", extra={"symbol": t.symbol})
+                report.errors.append({"symbol": t.symbol, "error": str(e)})
+                continue
+            report.inserted += counts.inserted
+            report.updated += counts.updated
+            if counts.first_ts is not None:
+                report.changed[t.instrument_id] = counts.first_ts
+
+    writer_task = asyncio.create_task(writer())
+    try:
+        await asyncio.gather(*(fetch(t) for t in targets))
+    finally:
+        await queue.put(None)
+        await writer_task
+    if report.changed:
+        try:
+            n = await asyncio.to_thread(refresh_for_instruments, db, report.changed)
+            log.info("daily_values_refreshed", extra={"portfolios": n})
+        except Exception:
+            db.rollback()
+            log.exception("daily_values_refresh_failed")
+        try:
+            n = await asyncio.to_thread(advance_for_instruments, db, report.changed)
+            log.info("indicator_states_advanced", extra={"instruments": n})
+        except Exception:
+            db.rollback()
+            log.exception("indicator_states_advance_failed")
+    return report
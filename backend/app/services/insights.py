@@ -6,14 +6,15 @@ from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from decimal import Decimal
 
+import numpy as np
 from sqlalchemy.orm import Session
 
 from core.config import settings
 from db import models
-from services.analytics import (
-    equity_curve_from_holdings, pct_returns, max_drawdown, annualized_stats,
-    cagr, sharpe_sortino, benchmark_series
-)
+from services.price_store import price_store, timestamps
+from services.analytics import benchmark_series, equity_curve_arrays
+from services.attribution import Grouping
+from services.metrics import compute_metrics
 from uuid import UUID
 
 log = logging.getLogger("insights")
@@ -26,6 +27,7 @@ class HoldingSnapshot:
     last_close: float
     value: float
     weight: float
+    sector: Optional[str] = None
 
 def _to_f(x) -> float:
     if x is None:
@@ -35,13 +37,8 @@ def _to_f(x) -> float:
     return float(x)
 
 def _latest_close(db: Session, instrument_id: int) -> Optional[float]:
-    row = (
-        db.query(models.Price.close)
-          .filter(models.Price.instrument_id == instrument_id)
-          .order_by(models.Price.ts.desc())
-          .first()
-    )
-    return _to_f(row[0]) if row else None
+    s = price_store.get(db, instrument_id)
+    return float(s.close[-1]) if len(s) else None
 
 def _weights_and_concentration(holdings: List[HoldingSnapshot]) -> Dict[str, float]:
     # Herfindahl-Hirschman Index (HHI) and top-N concentration
@@ -51,6 +48,13 @@ def _weights_and_concentration(holdings: List[HoldingSnapshot]) -> Dict[str, flo
     top5 = sum(sorted(w, reverse=True)[:5])
     return {"hhi": hhi, "top3": top3, "top5": top5}
 
+def _sector_weights(holdings: List[HoldingSnapshot]) -> Dict[str, float]:
+    if not holdings:
+        return {}
+    g = Grouping.of([h.sector for h in holdings])
+    sums = g.sum(np.array([h.weight for h in holdings]))
+    return dict(sorted(zip(g.labels, sums.tolist()), key=lambda kv: -kv[1]))
+
 def build_portfolio_snapshot(
     db: Session,
     portfolio_id: UUID,
@@ -68,6 +72,7 @@ def build_portfolio_snapshot(
           .filter(models.Holding.portfolio_id == portfolio_id)
           .all()
     )
+    price_store.get_many(db, [h.instrument_id for h in holdings_raw])  # warm in one query
     hs: List[HoldingSnapshot] = []
     gross = 0.0
     for h in holdings_raw:
@@ -78,22 +83,20 @@ def build_portfolio_snapshot(
         if px is None:
             continue
         val = qty * px
+        inst = db.get(models.Instrument, h.instrument_id)
         hs.append(HoldingSnapshot(
-        symbol=db.get(models.Instrument, h.instrument_id).symbol,
-        instrument_id=h.instrument_id, qty=qty, last_close=px, value=val, weight=0.0
+        symbol=inst.symbol,
+        instrument_id=h.instrument_id, qty=qty, last_close=px, value=val, weight=0.0, sector=inst.sector
         ))
         gross += val
     for i in range(len(hs)):
         hs[i].weight = 0.0 if gross == 0 else hs[i].value / gross
 
     # 2) equity & returns
-    curve = equity_curve_from_holdings(db, portfolio_id, start, end)
-    rets = pct_returns(curve)
-    stats = annualized_stats(rets)
-    mdd = max_drawdown(curve)
+    days, values = equity_curve_arrays(db, portfolio_id, start, end)
     risk_free = float(getattr(settings, "risk_free_rate_annual", 0.03))
-    sharpe, sortino = sharpe_sortino(rets, risk_free)
-    cg = cagr(curve)
+    m = compute_metrics(values, days, risk_free).summary()
+    curve_ts = timestamps(days[[0, -1]]) if len(days) else []
 
     # 3) benchmark series (optional)
     bench_sym = (benchmark_symbol or getattr(settings, "default_benchmark", None) or "").strip().upper()
@@ -116,16 +119,17 @@ def build_portfolio_snapshot(
                 } for h in hs_sorted
             ],
             "concentration": conc,  # hhi, top3, top5 (fractions for top3/5)
+            "sectors": _sector_weights(hs),
         },
         "performance": {
-            "start": curve[0].ts.isoformat() if curve else None,
-            "end": curve[-1].ts.isoformat() if curve else None,
-            "cagr": cg,
-            "ann_return": stats["mu"],
-            "ann_vol": stats["sigma"],
-            "sharpe": sharpe,
-            "sortino": sortino,
-            "max_drawdown": mdd,
+            "start": curve_ts[0].isoformat() if curve_ts else None,
+            "end": curve_ts[-1].isoformat() if curve_ts else None,
+            "cagr": m["cagr"],
+            "ann_return": m["ann_return"],
+            "ann_vol": m["ann_vol"],
+            "sharpe": m["sharpe"],
+            "sortino": m["sortino"],
+            "max_drawdown": m["max_drawdown"],
         },
         "benchmark": {
             "symbol": bench_sym or None,
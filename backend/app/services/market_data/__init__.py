@@ -1,15 +1,51 @@
+from typing import Tuple
+
 from core.config import settings
+from core.rate_limit import RequestBudget
 from .alpha_vantage import AlphaVantageProvider
 from .base import MarketDataProvider
-from core.config import settings
+from .cache import ResponseCache
 
 _provider: MarketDataProvider | None = None
+_budget: RequestBudget | None = None
+_cache: ResponseCache | None = None
+
+def get_request_budget() -> RequestBudget:
+    """Provider-wide request budget built from PROVIDER_RPM, shared by every caller in the process."""
+    global _budget
+    if _budget is None:
+        rpm = max(1, settings.provider_rpm)
+        _budget = RequestBudget(rpm, max(1, settings.provider_burst or rpm))
+    return _budget
+
+def _live_hours() -> Tuple[int, int] | None:
+    """INTRADAY_HOURS_LOCAL ("14-21") as (14, 21); None if unset or malformed."""
+    start, _, end = (settings.intraday_hours_local or "").partition("-")
+    if not (start.strip().isdigit() and end.strip().isdigit()):
+        return None
+    return int(start), int(end)
+
+def get_response_cache() -> ResponseCache | None:
+    """
+    Shared raw-response cache; None when MARKET_DATA_CACHE_DIR is unset.
+    Daily series are kept out of it during the intraday window.
+    """
+    global _cache
+    if _cache is None and settings.market_data_cache_dir:
+        _cache = ResponseCache(
+            settings.market_data_cache_dir,
+            max_bytes=settings.market_data_cache_mb * 1024 * 1024,
+            default_ttl=settings.market_data_cache_ttl_sec,
+            tz=settings.jobs_timezone,
+            live_hours=_live_hours(),
+        )
+    return _cache
 
 def get_provider() -> MarketDataProvider:
     global _provider
     if _provider:
         return _provider
     if settings.use_provider == "alpha_vantage":
-        _provider = AlphaVantageProvider(settings.alpha_vantage_key)
+        _provider = AlphaVantageProvider(settings.alpha_vantage_key, budget=get_request_budget(), cache=get_response_cache())
         return _provider
-    raise ValueError(f"Unsupported provider: {settings.use_provider}")
\ No newline at end of file
+    raise ValueError(f"Unsupported provider: {settings.use_provider}")
@@ -1,28 +1,99 @@
 from __future__ import annotations
 import httpx
-from datetime import datetime, date
-from typing import List, Dict, Optional
+import json
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, date, timedelta, timezone
+from typing import AsyncIterator, Iterator, List, Dict, Optional
+from core.config import settings
+from core.rate_limit import RequestBudget
 from services.market_data.base import MarketDataProvider, PriceBar, InstrumentInfo
+from services.market_data.cache import ResponseCache
+from services.market_data.streaming import DailySeriesScanner
 
 BASE_URL = "https://www.alphavantage.co/query"
 
+# Try ADJUSTED first; if AV says 'premium' or similar, fall back to DAILY.
+DAILY_FUNCTIONS = ["TIME_SERIES_DAILY_ADJUSTED", "TIME_SERIES_DAILY"]
+
+# outputsize=compact returns the latest 100 bars; keep headroom for holidays
+COMPACT_BARS = 100
+COMPACT_MAX_GAP_BARS = 90
+
+def _effective_start(start: Optional[date], last_ts: Optional[datetime]) -> Optional[date]:
+    # re-request the last stored bar too, so a partial (intraday) bar gets revised
+    if last_ts is None:
+        return start
+    last = last_ts.date()
+    return last if start is None or last > start else start
+
+def _outputsize(start: Optional[date]) -> str:
+    """compact when the gap from `start` to today fits in the last ~100 bars."""
+    if start is None:
+        return "full"
+    days = (datetime.now(timezone.utc).date() - start).days
+    weekdays = days * 5 // 7 + 1
+    return "compact" if weekdays <= COMPACT_MAX_GAP_BARS else "full"
+
+def _covers(first: Optional[datetime], start: Optional[date]) -> bool:
+    """A compact payload is only usable if it reaches back to `start` (allowing a long weekend)."""
+    if start is None or first is None:
+        return True
+    return first.date() <= start + timedelta(days=4)
+
 class AlphaVantageProvider(MarketDataProvider):
-    def __init__(self, api_key: str):
+    name = "alpha_vantage"
+
+    def __init__(self, api_key: str, budget: RequestBudget | None = None, cache: ResponseCache | None = None):
         if not api_key:
             raise ValueError("ALPHA_VANTAGE_KEY is required for alpha_vantage provider")
         self.key = api_key
+        self.budget = budget
+        self.cache = cache
         self.client = httpx.Client(timeout=30)
+        self._aclient: httpx.AsyncClient | None = None
 
-    def _get(self, params: Dict[str, str]) -> Dict:
-        params = {**params, "apikey": self.key}
-        r = self.client.get(BASE_URL, params=params)
-        r.raise_for_status()
-        data = r.json()
+    @property
+    def aclient(self) -> httpx.AsyncClient:
+        # created lazily so it binds to the event loop that first uses it
+        if self._aclient is None or self._aclient.is_closed:
+            n = max(1, settings.provider_concurrency)
+            self._aclient = httpx.AsyncClient(
+                timeout=30,
+                limits=httpx.Limits(max_connections=n, max_keepalive_connections=n),
+            )
+        return self._aclient
+
+    @staticmethod
+    def _decode(body: bytes) -> Dict:
+        data = json.loads(body)
         if any(k in data for k in ["Error Message", "Information", "Note"]):
             # AV returns friendly throttling messages under these keys
             raise RuntimeError(data.get("Error Message") or data.get("Information") or data.get("Note"))
         return data
 
+    def _get(self, params: Dict[str, str]) -> Dict:
+        def fetch() -> bytes:
+            if self.budget:
+                self.budget.wait()
+            r = self.client.get(BASE_URL, params={**params, "apikey": self.key})
+            r.raise_for_status()
+            return r.content
+        return self.cached_fetch(params, fetch, self._decode)
+
+    async def _aget(self, params: Dict[str, str]) -> Dict:
+        async def fetch() -> bytes:
+            if self.budget:
+                await self.budget.acquire()
+            r = await self.aclient.get(BASE_URL, params={**params, "apikey": self.key})
+            r.raise_for_status()
+            return r.content
+        return await self.acached_fetch(params, fetch, self._decode)
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
     def search(self, query: str, limit: int = 5) -> List[InstrumentInfo]:
         data = self._get({"function": "SYMBOL_SEARCH", "keywords": query})
         matches = data.get("bestMatches", [])
@@ -39,41 +110,54 @@ class AlphaVantageProvider(MarketDataProvider):
             })
         return out
 
-    def daily_prices(self, symbol: str, start: Optional[date] = None, end: Optional[date] = None) -> List[PriceBar]:
+    @contextmanager
+    def _open_stream(self, params: Dict[str, str]) -> Iterator[Iterator[bytes]]:
+        if self.budget:
+            self.budget.wait()
+        with self.client.stream("GET", BASE_URL, params={**params, "apikey": self.key}) as r:
+            r.raise_for_status()
+            yield r.iter_bytes()
+
+    @asynccontextmanager
+    async def _aopen_stream(self, params: Dict[str, str]) -> AsyncIterator[AsyncIterator[bytes]]:
+        if self.budget:
+            await self.budget.acquire()
+        async with self.aclient.stream("GET", BASE_URL, params={**params, "apikey": self.key}) as r:
+            r.raise_for_status()
+            yield r.aiter_bytes()
+
+    def _scan(self, symbol: str, fn: str, size: str, start: Optional[date], end: Optional[date]) -> DailySeriesScanner:
+        params = {"function": fn, "symbol": symbol, "outputsize": size}
+        scanner = DailySeriesScanner(start, end, label=f"{symbol} ({fn})")
+        self.cached_stream(params, lambda: self._open_stream(params), scanner)
+        return scanner
+
+    async def _ascan(self, symbol: str, fn: str, size: str, start: Optional[date], end: Optional[date]) -> DailySeriesScanner:
+        params = {"function": fn, "symbol": symbol, "outputsize": size}
+        scanner = DailySeriesScanner(start, end, label=f"{symbol} ({fn})")
+        await self.acached_stream(params, lambda: self._aopen_stream(params), scanner)
+        return scanner
+
+    def stream_daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> Iterator[PriceBar]:
         """
         Fetch daily OHLCV. Try ADJUSTED first; if AV says 'premium' or similar, fall back to DAILY.
+        With `last_ts`, only bars from the last stored day on are requested, and a
+        small gap is served from the compact (last ~100 bars) payload. The payload
+        is parsed as it streams in and bars come back oldest-first.
         """
-        funcs = ["TIME_SERIES_DAILY_ADJUSTED", "TIME_SERIES_DAILY"]
+        start = _effective_start(start, last_ts)
+        size = _outputsize(start)
         last_err: Exception | None = None
 
-        for fn in funcs:
+        for fn in DAILY_FUNCTIONS:
             try:
-                data = self._get({
-                    "function": fn,
-                    "symbol": symbol,
-                    "outputsize": "full",
-                })
-                series = data.get("Time Series (Daily)", {})
-                if not isinstance(series, dict) or not series:
-                    raise RuntimeError(f"No daily data in response for {symbol} ({fn})")
-
-                rows: List[PriceBar] = []
-                for k, v in series.items():
-                    ts = datetime.strptime(k, "%Y-%m-%d")
-                    if start and ts.date() < start:
-                        continue
-                    if end and ts.date() > end:
-                        continue
-                    rows.append({
-                        "ts": ts,
-                        "open": float(v["1. open"]),
-                        "high": float(v["2. high"]),
-                        "low": float(v["3. low"]),
-                        "close": float(v["4. close"]),
-                        "volume": int(v.get("6. volume", 0)),
-                    })
-                rows.sort(key=lambda r: r["ts"])
-                return rows
+                scanner = self._scan(symbol, fn, size, start, end)
+                if size == "compact" and not _covers(scanner.first_ts(), start):
+                    scanner = self._scan(symbol, fn, "full", start, end)
+                return scanner.bars()
             except Exception as e:
                 # Keep the last error; try the next function as a fallback
                 last_err = e
@@ -81,4 +165,37 @@ class AlphaVantageProvider(MarketDataProvider):
 
         # If both calls failed, raise the last one
         assert last_err is not None
-        raise last_err
\ No newline at end of file
+        raise last_err
+
+    async def astream_daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> Iterator[PriceBar]:
+        start = _effective_start(start, last_ts)
+        size = _outputsize(start)
+        last_err: Exception | None = None
+
+        for fn in DAILY_FUNCTIONS:
+            try:
+                scanner = await self._ascan(symbol, fn, size, start, end)
+                if size == "compact" and not _covers(scanner.first_ts(), start):
+                    scanner = await self._ascan(symbol, fn, "full", start, end)
+                return scanner.bars()
+            except Exception as e:
+                last_err = e
+                continue
+
+        assert last_err is not None
+        raise last_err
+
+    def daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> List[PriceBar]:
+        return list(self.stream_daily_prices(symbol, start, end, last_ts))
+
+    async def daily_prices_async(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> List[PriceBar]:
+        return list(await self.astream_daily_prices(symbol, start, end, last_ts))
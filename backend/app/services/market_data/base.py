@@ -1,18 +1,164 @@
 from __future__ import annotations
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional
-from datetime import date
+from contextlib import AbstractAsyncContextManager, AbstractContextManager, closing
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Dict, Optional, Protocol, TypeVar
+from datetime import date, datetime
+
+from services.market_data.cache import ResponseCache
 
 PriceBar = Dict[str, object]  # {"ts": datetime, "open": float, "high": float, "low": float, "close": float, "volume": int|None}
 InstrumentInfo = Dict[str, object]  # {"symbol": str, "exchange": str|None, "name": str|None, ...}
 
+T = TypeVar("T")
+
+class StreamSink(Protocol):
+    def feed(self, chunk: bytes) -> bool:
+        """Consume raw bytes; True once later chunks are no longer needed."""
+        ...
+
+    def finish(self) -> None:
+        """Called at end of stream; raise to reject the payload (it is then not cached)."""
+        ...
+
 class MarketDataProvider(ABC):
+    name: str = "unknown"  # stored as Price.source
+    cache: ResponseCache | None = None
+
+    def cached_fetch(self, params: Dict[str, str], fetch: Callable[[], bytes], decode: Callable[[bytes], T]) -> T:
+        """
+        Serve a raw response from the cache or fetch it. `decode` runs before the
+        body is stored, so error/throttle payloads (which should raise) never get cached.
+        """
+        if self.cache is not None:
+            body = self.cache.get(params)
+            if body is not None:
+                return decode(body)
+        body = fetch()
+        out = decode(body)
+        if self.cache is not None:
+            self.cache.put(params, body)
+        return out
+
+    async def acached_fetch(self, params: Dict[str, str], fetch: Callable[[], Awaitable[bytes]], decode: Callable[[bytes], T]) -> T:
+        if self.cache is not None:
+            body = self.cache.get(params)
+            if body is not None:
+                return decode(body)
+        body = await fetch()
+        out = decode(body)
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, params, body)
+        return out
+
+    def cached_stream(
+        self, params: Dict[str, str],
+        open_stream: Callable[[], AbstractContextManager[Iterator[bytes]]],
+        sink: StreamSink,
+    ) -> None:
+        """
+        Stream a raw response into `sink`, from the cache or the network. On a
+        network fetch the body is compressed to the cache as it arrives; when the
+        sink is satisfied early and there is no cache, the connection is dropped.
+        """
+        if self.cache is not None:
+            chunks = self.cache.iter_chunks(params)
+            if chunks is not None:
+                with closing(chunks):
+                    for chunk in chunks:
+                        if sink.feed(chunk):
+                            break
+                sink.finish()
+                return
+        writer = self.cache.writer(params) if self.cache is not None else None
+        try:
+            wanted = True
+            with open_stream() as chunks:
+                for chunk in chunks:
+                    if wanted and sink.feed(chunk):
+                        wanted = False
+                        if writer is None:
+                            break
+                    if writer is not None:
+                        writer.write(chunk)
+            sink.finish()
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+        if writer is not None:
+            writer.commit()
+
+    async def acached_stream(
+        self, params: Dict[str, str],
+        open_stream: Callable[[], AbstractAsyncContextManager[AsyncIterator[bytes]]],
+        sink: StreamSink,
+    ) -> None:
+        if self.cache is not None:
+            chunks = self.cache.iter_chunks(params)
+            if chunks is not None:
+                with closing(chunks):
+                    for chunk in chunks:
+                        if sink.feed(chunk):
+                            break
+                sink.finish()
+                return
+        writer = self.cache.writer(params) if self.cache is not None else None
+        try:
+            wanted = True
+            async with open_stream() as chunks:
+                async for chunk in chunks:
+                    if wanted and sink.feed(chunk):
+                        wanted = False
+                        if writer is None:
+                            break
+                    if writer is not None:
+                        writer.write(chunk)
+            sink.finish()
+        except BaseException:
+            if writer is not None:
+                writer.discard()
+            raise
+        if writer is not None:
+            writer.commit()
+
     @abstractmethod
     def search(self, query: str, limit: int = 5) -> List[InstrumentInfo]:
         """Return a list of instruments matching the query."""
         ...
 
     @abstractmethod
-    def daily_prices(self, symbol: str, start: Optional[date] = None, end: Optional[date] = None) -> List[PriceBar]:
-        """Yield daily price candles for the given symbol."""
-        ...
\ No newline at end of file
+    def daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> List[PriceBar]:
+        """
+        Yield daily price candles for the given symbol.
+        `last_ts` is the latest bar already stored; providers may use it to
+        request only the missing tail instead of the full history.
+        """
+        ...
+
+    async def daily_prices_async(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> List[PriceBar]:
+        """Async variant used by the ingest engine; providers with a native async client should override."""
+        return await asyncio.to_thread(self.daily_prices, symbol, start, end, last_ts)
+
+    def stream_daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> Iterator[PriceBar]:
+        """Bars oldest-first as an iterator, for feeding a bulk writer without building the full list."""
+        return iter(self.daily_prices(symbol, start, end, last_ts))
+
+    async def astream_daily_prices(
+        self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+        last_ts: Optional[datetime] = None,
+    ) -> Iterator[PriceBar]:
+        return iter(await self.daily_prices_async(symbol, start, end, last_ts))
+
+    async def aclose(self) -> None:
+        """Release pooled async connections (no-op by default)."""
+        return None
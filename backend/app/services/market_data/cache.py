@@ -0,0 +1,243 @@
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+log = logging.getLogger("market_data.cache")
+
+CHUNK_SIZE = 64 * 1024
+
+# seconds a raw payload stays fresh, per provider function
+DEFAULT_TTLS: Dict[str, int] = {
+    "TIME_SERIES_DAILY": 6 * 3600,
+    "TIME_SERIES_DAILY_ADJUSTED": 6 * 3600,
+    "SYMBOL_SEARCH": 7 * 24 * 3600,
+}
+
+# daily series gain a bar every session and rewrite today's while the market
+# is open: their entries are keyed by the local date and neither stored nor
+# served during the live hours
+SESSION_FUNCTIONS = frozenset({"TIME_SERIES_DAILY", "TIME_SERIES_DAILY_ADJUSTED"})
+
+class ResponseCache:
+    """
+    On-disk cache of raw provider responses.
+    Entries are addressed by a hash of the request params (API keys excluded),
+    stored gzip-compressed, expire after a per-function TTL and are evicted
+    least-recently-used once the directory exceeds `max_bytes`.
+    `live_hours` is a [start, end) window of local hours in `tz` when daily
+    series aren't cached (see SESSION_FUNCTIONS).
+    """
+    def __init__(
+        self, root: str, max_bytes: int, default_ttl: int, ttls: Optional[Mapping[str, int]] = None,
+        tz: str = "UTC", live_hours: Optional[Tuple[int, int]] = None,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.tz = ZoneInfo(tz)
+        self.live_hours = live_hours
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size, written_at); order = recency, oldest first
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def key(params: Mapping[str, str]) -> str:
+        clean = {k: str(v) for k, v in params.items() if k.lower() != "apikey"}
+        return hashlib.sha256(json.dumps(clean, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _per_session(params: Mapping[str, str]) -> bool:
+        return str(params.get("function", "")) in SESSION_FUNCTIONS
+
+    def _live(self, t: float) -> bool:
+        if self.live_hours is None:
+            return False
+        start, end = self.live_hours
+        h = datetime.fromtimestamp(t, self.tz).hour
+        return start <= h < end if start <= end else (h >= start or h < end)
+
+    def _key(self, params: Mapping[str, str]) -> str:
+        if not self._per_session(params):
+            return self.key(params)
+        session = datetime.fromtimestamp(time.time(), self.tz).date().isoformat()
+        return self.key({**params, "_session": session})
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".gz")
+
+    def _load_index(self) -> None:
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                if not f.endswith(".gz"):
+                    continue
+                st = os.stat(os.path.join(dirpath, f))
+                entries.append((st.st_mtime, f[:-3], st.st_size))
+        for mtime, key, size in sorted(entries):
+            self._index[key] = (size, mtime)
+            self._bytes += size
+
+    def _ttl(self, params: Mapping[str, str]) -> int:
+        return self.ttls.get(str(params.get("function", "")), self.default_ttl)
+
+    def _drop(self, key: str) -> None:
+        size, _ = self._index.pop(key, (0, 0.0))
+        self._bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _lookup(self, params: Mapping[str, str]) -> Optional[str]:
+        key = self._key(params)
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(key)
+            stale = entry is not None and (
+                now - entry[1] > self._ttl(params)
+                or (self._per_session(params) and (self._live(now) or self._live(entry[1])))
+            )
+            if entry is None or stale:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        return key
+
+    def _corrupt(self, key: str) -> None:
+        log.warning("cache_entry_unreadable", extra={"key": key})
+        with self._lock:
+            self._drop(key)
+
+    def get(self, params: Mapping[str, str]) -> Optional[bytes]:
+        key = self._lookup(params)
+        if key is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as fh:
+                return gzip.decompress(fh.read())
+        except (OSError, EOFError):
+            self._corrupt(key)
+            return None
+
+    def iter_chunks(self, params: Mapping[str, str]) -> Optional[Iterator[bytes]]:
+        """Decompress a cached body chunk by chunk; None on a miss."""
+        key = self._lookup(params)
+        if key is None:
+            return None
+        try:
+            fh = open(self._path(key), "rb")
+        except OSError:
+            self._corrupt(key)
+            return None
+
+        def chunks() -> Iterator[bytes]:
+            d = zlib.decompressobj(wbits=31)  # gzip container
+            with fh:
+                while True:
+                    raw = fh.read(CHUNK_SIZE)
+                    if not raw:
+                        break
+                    out = d.decompress(raw)
+                    if out:
+                        yield out
+                tail = d.flush()
+                if tail:
+                    yield tail
+        return chunks()
+
+    def writer(self, params: Mapping[str, str]) -> Optional["CacheWriter"]:
+        """
+        Compress a body to disk as it streams in; nothing is visible until
+        commit(). None when the response isn't to be stored right now.
+        """
+        if self._per_session(params) and self._live(time.time()):
+            return None
+        return CacheWriter(self, self._key(params))
+
+    def put(self, params: Mapping[str, str], body: bytes) -> None:
+        w = self.writer(params)
+        if w is None:
+            return
+        w.write(body)
+        w.commit()
+
+    def _commit(self, key: str, tmp: str, size: int) -> None:
+        if size > self.max_bytes:
+            os.remove(tmp)
+            return
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            old, _ = self._index.pop(key, (0, 0.0))
+            self._bytes += size - old
+            self._index[key] = (size, time.time())
+            while self._bytes > self.max_bytes and self._index:
+                oldest = next(iter(self._index))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+            }
+
+class CacheWriter:
+    def __init__(self, cache: ResponseCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        self._z = zlib.compressobj(6, zlib.DEFLATED, 31)  # gzip container, readable by gzip.decompress
+        d = os.path.dirname(cache._path(key))
+        os.makedirs(d, exist_ok=True)
+        fd, self._tmp = tempfile.mkstemp(dir=d, suffix=".tmp")
+        self._fh = os.fdopen(fd, "wb")
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self._fh.write(data)
+            self.size += len(data)
+
+    def write(self, chunk: bytes) -> None:
+        self._emit(self._z.compress(chunk))
+
+    def commit(self) -> None:
+        try:
+            self._emit(self._z.flush())
+            self._fh.close()
+            self.cache._commit(self.key, self._tmp, self.size)
+        except OSError:
+            log.warning("cache_write_failed", exc_info=True)
+            self.discard()
+
+    def discard(self) -> None:
+        if not self._fh.closed:
+            self._fh.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
@@ -0,0 +1,117 @@
+from __future__ import annotations
+import codecs
+import json
+import re
+from datetime import date, datetime
+from typing import Iterator, List, Optional, Tuple
+
+from services.market_data.base import PriceBar
+
+# one `"YYYY-MM-DD": {...}` entry; the inner object holds only string fields
+_ENTRY = re.compile(r'"(\d{4}-\d{2}-\d{2})"\s*:\s*\{([^{}]*)\}')
+_FIELD = re.compile(r'"(\d+)\. ([a-z ]+)"\s*:\s*"([^"]*)"')
+_SERIES_KEY = '"Time Series (Daily)"'
+
+# cap on text buffered while looking for the series key
+_MAX_HEAD = 64 * 1024
+
+_Bar = Tuple[datetime, float, float, float, float, int]
+
+class DailySeriesScanner:
+    """
+    Incremental parser for Alpha Vantage `Time Series (Daily)` payloads.
+
+    Feed raw bytes as they arrive; entries are matched straight out of the text
+    buffer (no dict-of-dicts), the start/end filter is applied per entry, and
+    only matching bars are kept as compact tuples. AV lists days newest-first, so
+    once a day older than `start` shows up the rest of the payload is skipped.
+    """
+    def __init__(self, start: Optional[date] = None, end: Optional[date] = None, label: str = ""):
+        self.start = start
+        self.end = end
+        self.label = label
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._found = False
+        self._done = False
+        self._descending = True
+        self._prev: Optional[date] = None
+        self._bars: List[_Bar] = []
+
+    def feed(self, chunk: bytes) -> bool:
+        """Consume a chunk; returns True once no later chunk can contribute bars."""
+        if self._done:
+            return True
+        self._buf += self._decoder.decode(chunk)
+        if not self._found:
+            i = self._buf.find(_SERIES_KEY)
+            if i < 0:
+                # keep the head for error reporting; it is tiny for error payloads
+                if len(self._buf) > _MAX_HEAD:
+                    self._buf = self._buf[-len(_SERIES_KEY):]
+                return False
+            self._found = True
+            self._buf = self._buf[i + len(_SERIES_KEY):]
+        self._scan()
+        return self._done
+
+    def _scan(self) -> None:
+        consumed = 0
+        for m in _ENTRY.finditer(self._buf):
+            consumed = m.end()
+            d = date.fromisoformat(m.group(1))
+            if self._prev is not None and d > self._prev:
+                self._descending = False
+            self._prev = d
+            if self.end and d > self.end:
+                continue
+            if self.start and d < self.start:
+                if self._descending:
+                    self._done = True
+                    break
+                continue
+            # DAILY reports volume as field 5, DAILY_ADJUSTED as field 6 (5 = adjusted close)
+            fields, vol = {}, "0"
+            for n, name, v in _FIELD.findall(m.group(2)):
+                if name == "volume":
+                    vol = v
+                else:
+                    fields[int(n)] = v
+            self._bars.append((
+                datetime(d.year, d.month, d.day),
+                float(fields[1]), float(fields[2]), float(fields[3]), float(fields[4]),
+                int(float(vol)),
+            ))
+        self._buf = self._buf[consumed:]
+
+    def finish(self) -> None:
+        """Validate the payload once the stream ends; raises the provider's error message if any."""
+        if not self._done:
+            self._buf += self._decoder.decode(b"", final=True)
+            if self._found:
+                self._scan()
+        if self._found:
+            if not self._descending:
+                self._bars.sort(key=lambda b: b[0], reverse=True)
+            return
+        try:
+            data = json.loads(self._buf)
+        except ValueError:
+            data = {}
+        if isinstance(data, dict):
+            msg = data.get("Error Message") or data.get("Information") or data.get("Note")
+            if msg:
+                # AV returns friendly throttling messages under these keys
+                raise RuntimeError(msg)
+        raise RuntimeError(f"No daily data in response for {self.label}")
+
+    def first_ts(self) -> Optional[datetime]:
+        return self._bars[-1][0] if self._bars else None
+
+    def __len__(self) -> int:
+        return len(self._bars)
+
+    def bars(self) -> Iterator[PriceBar]:
+        """Yield matching bars oldest-first, building each PriceBar dict on demand."""
+        for ts, o, h, l, c, v in reversed(self._bars):
+            yield {"ts": ts, "open": o, "high": h, "low": l, "close": c, "volume": v}
@@ -0,0 +1,170 @@
+# app/services/metrics.py
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+TRADING_DAYS = 252.0
+
+@dataclass
+class Metrics:
+    """
+    Performance statistics for one series (scalars) or many (arrays, one entry
+    per column). `returns` and `drawdown` have the shape of the input values.
+    """
+    returns: np.ndarray
+    drawdown: np.ndarray
+    cagr: np.ndarray
+    ann_return: np.ndarray
+    ann_vol: np.ndarray
+    sharpe: np.ndarray
+    sortino: np.ndarray
+    max_drawdown: np.ndarray
+    max_drawdown_bars: np.ndarray   # longest run of closes below the prior peak
+    max_drawdown_days: np.ndarray   # longest time below a prior peak, in calendar days from that peak
+
+    def summary(self, i: Optional[int] = None) -> Dict[str, float]:
+        """The scalar statistics as plain floats (column `i` for 2-D input)."""
+        pick = (lambda a: a) if i is None else (lambda a: a[i])
+        return {
+            "cagr": float(pick(self.cagr)),
+            "ann_return": float(pick(self.ann_return)),
+            "ann_vol": float(pick(self.ann_vol)),
+            "sharpe": float(pick(self.sharpe)),
+            "sortino": float(pick(self.sortino)),
+            "max_drawdown": float(pick(self.max_drawdown)),
+            "max_drawdown_duration_days": int(pick(self.max_drawdown_days)),
+        }
+
+def _safe_div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    out = np.zeros(np.broadcast(a, b).shape)
+    np.divide(a, b, out=out, where=b != 0)
+    return out
+
+def compute_metrics(values: np.ndarray, days: np.ndarray, rf_annual: float = 0.0) -> Metrics:
+    """
+    Every statistic of services.analytics (pct_returns, annualized_stats,
+    sharpe_sortino, max_drawdown, cagr) with the same conventions, computed
+    column-wise over `values` of shape (T,) or (T, K) in a handful of array
+    passes. `days` are the epoch days of the T rows. Columns may start with NaN
+    (series that begin later); each is measured from its first value.
+    """
+    v = np.asarray(values, dtype=np.float64)
+    one_d = v.ndim == 1
+    if one_d:
+        v = v[:, None]
+    days = np.asarray(days, dtype=np.int64)
+    T, K = v.shape
+    if T == 0:
+        z = np.zeros(K)
+        out = Metrics(v.copy(), v.copy(), z, z, z, z, z, z, z.astype(np.int64), z.astype(np.int64))
+        return _squeeze(out) if one_d else out
+
+    # simple returns; 0 after a zero value, NaN where either side is missing.
+    # Row 0 (and each column's first value) stays NaN: like the list version,
+    # the leading 0.0 return is not part of the statistics.
+    r = np.full((T, K), np.nan)
+    if T > 1:
+        prev, cur = v[:-1], v[1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r[1:] = np.where(prev == 0, np.where(np.isnan(cur), np.nan, 0.0), cur / prev - 1.0)
+    ok = np.isfinite(r)
+    n = ok.sum(axis=0).astype(np.float64)
+    rz = np.where(ok, r, 0.0)
+    mu = _safe_div(rz.sum(axis=0), n)
+    dev = np.where(ok, r - mu, 0.0)
+    sigma = np.sqrt(_safe_div((dev * dev).sum(axis=0), np.maximum(n - 1, 0)) * (n > 1))
+    rf_daily = rf_annual / TRADING_DAYS
+    downs = np.where(ok, np.minimum(r - rf_daily, 0.0), 0.0)
+    dd_sigma = np.sqrt(_safe_div((downs * downs).sum(axis=0), np.maximum(n - 1, 0)) * (n > 1))
+    excess = mu - rf_daily
+    sharpe = _safe_div(excess, sigma) * np.sqrt(TRADING_DAYS)
+    sortino = _safe_div(excess, dd_sigma) * np.sqrt(TRADING_DAYS)
+
+    # drawdown from the running peak
+    peak = np.fmax.accumulate(v, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = np.where((peak != 0) & (v < peak), v / peak - 1.0, 0.0)
+    dd[np.isnan(v)] = np.nan
+    max_dd = np.minimum(np.where(np.isnan(dd), 0.0, dd).min(axis=0), 0.0)
+
+    # drawdown duration: length of the current under-water run at every row
+    under = dd < 0
+    c = np.cumsum(under, axis=0)
+    run = c - np.maximum.accumulate(np.where(under, 0, c), axis=0)
+    bars = run.max(axis=0)
+    rows = np.arange(T)[:, None]
+    dur_days = np.where(under, days[:, None] - days[np.maximum(rows - run, 0)], 0).max(axis=0)
+
+    # CAGR between each column's first and last value
+    finite = np.isfinite(v)
+    has = finite.any(axis=0)
+    first = np.where(has, finite.argmax(axis=0), 0)
+    last = np.where(has, T - 1 - finite[::-1].argmax(axis=0), 0)
+    cols = np.arange(K)
+    v0, v1 = v[first, cols], v[last, cols]
+    span_days = (days[last] - days[first]).astype(np.float64)
+    years = np.where(span_days > 0, span_days, 1.0) / 365.25
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.power(_safe_div(v1, v0), 1.0 / years) - 1.0
+    cagr = np.where((last > first) & (v0 > 0), growth, 0.0)
+
+    out = Metrics(
+        returns=r,
+        drawdown=dd,
+        cagr=cagr,
+        ann_return=mu * TRADING_DAYS,
+        ann_vol=sigma * np.sqrt(TRADING_DAYS),
+        sharpe=sharpe,
+        sortino=sortino,
+        max_drawdown=max_dd,
+        max_drawdown_bars=bars,
+        max_drawdown_days=dur_days,
+    )
+    return _squeeze(out) if one_d else out
+
+def _squeeze(m: Metrics) -> Metrics:
+    return Metrics(
+        returns=m.returns[:, 0], drawdown=m.drawdown[:, 0],
+        **{f: getattr(m, f)[0] for f in (
+            "cagr", "ann_return", "ann_vol", "sharpe", "sortino",
+            "max_drawdown", "max_drawdown_bars", "max_drawdown_days",
+        )},
+    )
+
+def relative_metrics(rp: np.ndarray, rb: np.ndarray, rf_annual: float = 0.0) -> Dict[str, Optional[float]]:
+    """
+    Portfolio returns `rp` against benchmark returns `rb` on the same days:
+    beta, Jensen's alpha (annualised), correlation, tracking error,
+    information ratio and up/down capture (ratio of mean returns on the days
+    the benchmark rose / fell). None where a statistic is undefined.
+    """
+    rp = np.asarray(rp, dtype=np.float64)
+    rb = np.asarray(rb, dtype=np.float64)
+    n = len(rp)
+    out: Dict[str, Optional[float]] = dict.fromkeys(
+        ("beta", "alpha", "correlation", "tracking_error", "information_ratio", "up_capture", "down_capture")
+    )
+    if n < 2:
+        return out
+    rf_daily = rf_annual / TRADING_DAYS
+    cov = np.cov(rp, rb)  # sample (n-1), like the other statistics
+    var_p, var_b, c = cov[0, 0], cov[1, 1], cov[0, 1]
+    if var_b > 0:
+        beta = c / var_b
+        out["beta"] = float(beta)
+        out["alpha"] = float(((rp.mean() - rf_daily) - beta * (rb.mean() - rf_daily)) * TRADING_DAYS)
+        if var_p > 0:
+            out["correlation"] = float(c / np.sqrt(var_p * var_b))
+    active = rp - rb
+    te = active.std(ddof=1) * np.sqrt(TRADING_DAYS)
+    out["tracking_error"] = float(te)
+    if te > 0:
+        out["information_ratio"] = float(active.mean() * TRADING_DAYS / te)
+    up, down = rb > 0, rb < 0
+    if up.any():
+        out["up_capture"] = float(rp[up].mean() / rb[up].mean())
+    if down.any():
+        out["down_capture"] = float(rp[down].mean() / rb[down].mean())
+    return out
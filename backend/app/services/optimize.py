@@ -0,0 +1,199 @@
+# app/services/optimize.py
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Long-only (or box-bounded) mean-variance portfolios:
+#     minimise  w' S w - lam * mu' w   subject to  sum(w) = 1,  lo <= w <= hi
+# solved exactly by a primal active-set method: the weights held at a bound
+# are fixed, the rest come from one (free + 1)-sized KKT solve, and bounds are
+# added or released until the multipliers agree. Conditioning of S only
+# affects the linear solves, not the iteration count. Walking up a grid of
+# lam, each solve starts from the previous weights and active set, so it
+# usually takes a handful of steps. lam = 0 is the minimum-variance
+# portfolio; growing lam walks the efficient frontier up to the
+# highest-return corner.
+
+MAX_STEPS_PER_ASSET = 10    # active-set changes allowed per solve, times the number of assets
+
+@dataclass
+class Frontier:
+    lambdas: np.ndarray     # (K,)
+    weights: np.ndarray     # (K, N)
+    returns: np.ndarray     # (K,) annualised expected return
+    vols: np.ndarray        # (K,) annualised volatility
+
+    def sharpe(self, rf: float) -> np.ndarray:
+        return np.where(self.vols > 0, (self.returns - rf) / np.where(self.vols > 0, self.vols, 1.0), 0.0)
+
+def project_bounded_simplex(v: np.ndarray, lo: np.ndarray, hi: np.ndarray, iters: int = 100) -> np.ndarray:
+    """
+    Euclidean projection of each row of `v` onto {w : sum(w) = 1, lo <= w <= hi}:
+    w = clip(v - tau, lo, hi) with tau found by bisection, all rows at once.
+    """
+    t_lo = (v - hi).min(axis=1) - 1.0   # every weight at its upper bound: sum >= 1
+    t_hi = (v - lo).max(axis=1) + 1.0   # every weight at its lower bound: sum <= 1
+    for _ in range(iters):
+        mid = (t_lo + t_hi) / 2.0
+        over = np.clip(v - mid[:, None], lo, hi).sum(axis=1) > 1.0
+        t_lo = np.where(over, mid, t_lo)
+        t_hi = np.where(over, t_hi, mid)
+    return np.clip(v - ((t_lo + t_hi) / 2.0)[:, None], lo, hi)
+
+def _bounds_of(w: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Active set of a feasible point: -1 at the lower bound, +1 at the upper, 0 free."""
+    eps = 1e-12
+    return np.where(w <= lo + eps, -1, np.where(w >= hi - eps, 1, 0)).astype(np.int8)
+
+def _active_set(P: np.ndarray, q: np.ndarray, lo: np.ndarray, hi: np.ndarray, w: np.ndarray, at: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    minimise 1/2 w'Pw - q'w  s.t. sum(w) = 1, lo <= w <= hi, from the
+    feasible `w` with active set `at` (both updated copies are returned).
+    """
+    n = len(q)
+    w, at = w.copy(), at.copy()
+    tol = 1e-12 * (1.0 + np.abs(q).max() + np.abs(P).max())
+    for _ in range(MAX_STEPS_PER_ASSET * n + 10):
+        F = np.flatnonzero(at == 0)
+        B = np.flatnonzero(at != 0)
+        nu = None
+        if len(F):
+            # KKT of the free weights: P_FF w_F + nu 1 = q_F - P_FB w_B,  sum(w_F) = 1 - sum(w_B)
+            k = len(F)
+            K = np.zeros((k + 1, k + 1))
+            K[:k, :k] = P[np.ix_(F, F)]
+            K[:k, k] = K[k, :k] = 1.0
+            rhs = np.empty(k + 1)
+            rhs[:k] = q[F] - P[np.ix_(F, B)] @ w[B]
+            rhs[k] = 1.0 - w[B].sum()
+            try:
+                sol = np.linalg.solve(K, rhs)
+            except np.linalg.LinAlgError:
+                sol = np.linalg.lstsq(K, rhs, rcond=None)[0]
+            step = sol[:k] - w[F]
+            nu = sol[k]
+            if np.abs(step).max() > 1e-14:
+                # longest step towards the KKT point that stays within the bounds
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    room = np.where(step < 0, (lo[F] - w[F]) / step, np.where(step > 0, (hi[F] - w[F]) / step, np.inf))
+                j = int(np.argmin(room))
+                if room[j] < 1.0:
+                    w[F] += max(room[j], 0.0) * step
+                    i = F[j]
+                    at[i] = -1 if step[j] < 0 else 1
+                    w[i] = lo[i] if at[i] < 0 else hi[i]
+                    continue
+                w[F] = sol[:k]
+        # stationary on this active set: release the bound whose multiplier has the wrong sign
+        g = P @ w - q
+        if nu is None:  # nothing free: any nu between the bounds' limits is stationary
+            lows = at < 0
+            nu = float((-g[lows]).max()) if lows.any() else float((-g).min())
+        m = g + nu      # >= 0 at a lower bound, <= 0 at an upper bound when optimal
+        wrong = np.where(at < 0, -m, np.where(at > 0, m, 0.0))
+        j = int(np.argmax(wrong))
+        if wrong[j] <= tol:
+            break
+        at[j] = 0
+    return w, at
+
+def solve(
+    mu: np.ndarray,
+    cov: np.ndarray,
+    lambdas: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    w0: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Optimal weights for every entry of `lambdas`, shape (K, N). Each solve
+    starts from the previous one's weights and active set (the first from
+    `w0`, or equal weights, projected onto the bounds), so an increasing grid
+    is a cheap walk along the frontier.
+    """
+    if lo.sum() > 1.0 + 1e-12 or hi.sum() < 1.0 - 1e-12:
+        raise ValueError("weight bounds admit no fully invested portfolio")
+    lambdas = np.asarray(lambdas, dtype=np.float64)
+    n = len(mu)
+    start = np.full(n, 1.0 / n) if w0 is None else np.asarray(w0, dtype=np.float64)
+    w = project_bounded_simplex(start[None, :], lo, hi)[0]
+    at = _bounds_of(w, lo, hi)
+    P = 2.0 * cov
+    out = np.empty((len(lambdas), n))
+    for k, lam in enumerate(lambdas):
+        w, at = _active_set(P, lam * mu, lo, hi, w, at)
+        out[k] = w
+    return out
+
+def _frontier(mu: np.ndarray, cov: np.ndarray, lambdas: np.ndarray, w: np.ndarray) -> Frontier:
+    rets = w @ mu
+    vols = np.sqrt(np.maximum(np.einsum("ij,jk,ik->i", w, cov, w), 0.0))
+    return Frontier(lambdas, w, rets, vols)
+
+def lambda_grid(mu: np.ndarray, cov: np.ndarray, points: int) -> np.ndarray:
+    """0 plus log-spaced risk tolerances from negligible to past the return-maximising corner."""
+    spread = float(mu.max() - mu.min())
+    scale = 2.0 * float(np.linalg.eigvalsh(cov)[-1]) / spread if spread > 0 else 1.0
+    return np.concatenate(([0.0], np.geomspace(scale * 1e-3, scale * 1e2, max(points - 1, 1))))
+
+def efficient_frontier(mu: np.ndarray, cov: np.ndarray, points: int, lo: np.ndarray, hi: np.ndarray, w0: Optional[np.ndarray] = None) -> Frontier:
+    lambdas = lambda_grid(mu, cov, points)
+    return _frontier(mu, cov, lambdas, solve(mu, cov, lambdas, lo, hi, w0))
+
+def _point(mu, cov, lam: float, lo, hi, w0: np.ndarray) -> Frontier:
+    return _frontier(mu, cov, np.array([lam]), solve(mu, cov, np.array([lam]), lo, hi, w0))
+
+def max_sharpe(mu: np.ndarray, cov: np.ndarray, f: Frontier, rf: float, lo: np.ndarray, hi: np.ndarray, iters: int = 60) -> Tuple[Frontier, int]:
+    """
+    (frontier, index) of the highest-Sharpe portfolio: golden-section search
+    on lambda between the best grid point's neighbours (Sharpe is unimodal
+    along the efficient frontier).
+    """
+    i = int(np.argmax(f.sharpe(rf)))
+    a, b = f.lambdas[max(i - 1, 0)], f.lambdas[min(i + 1, len(f.lambdas) - 1)]
+    best = Frontier(f.lambdas[i:i + 1], f.weights[i:i + 1], f.returns[i:i + 1], f.vols[i:i + 1])
+    r = (np.sqrt(5.0) - 1.0) / 2.0
+    c, d = b - r * (b - a), a + r * (b - a)
+    fc, fd = _point(mu, cov, c, lo, hi, f.weights[i]), _point(mu, cov, d, lo, hi, f.weights[i])
+    for _ in range(iters):
+        if b - a <= 1e-10 * max(abs(b), 1.0):
+            break
+        if fc.sharpe(rf)[0] >= fd.sharpe(rf)[0]:
+            b, d, fd = d, c, fc
+            c = b - r * (b - a)
+            fc = _point(mu, cov, c, lo, hi, fd.weights[0])
+        else:
+            a, c, fc = c, d, fd
+            d = a + r * (b - a)
+            fd = _point(mu, cov, d, lo, hi, fc.weights[0])
+    for g in (fc, fd):
+        if g.sharpe(rf)[0] > best.sharpe(rf)[0]:
+            best = g
+    return best, 0
+
+def target_return(mu: np.ndarray, cov: np.ndarray, f: Frontier, target: float, lo: np.ndarray, hi: np.ndarray, iters: int = 60) -> Optional[Tuple[Frontier, int]]:
+    """
+    (frontier, index) of the lowest-risk portfolio expected to return at least
+    `target`: bisection on lambda, since return only grows along the
+    frontier; None if out of reach.
+    """
+    ok = np.flatnonzero(f.returns >= target - 1e-12)
+    if not len(ok):
+        return None
+    i = int(ok[0])
+    if i == 0:
+        return f, 0
+    a, b = f.lambdas[i - 1], f.lambdas[i]
+    hit = Frontier(f.lambdas[i:i + 1], f.weights[i:i + 1], f.returns[i:i + 1], f.vols[i:i + 1])
+    for _ in range(iters):
+        if b - a <= 1e-12 * max(abs(b), 1.0) or abs(hit.returns[0] - target) <= 1e-12:
+            break
+        m = (a + b) / 2.0
+        g = _point(mu, cov, m, lo, hi, hit.weights[0])
+        if g.returns[0] >= target - 1e-12:
+            b, hit = m, g
+        else:
+            a = m
+    return hit, 0
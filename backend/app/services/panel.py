@@ -0,0 +1,90 @@
+# app/services/panel.py
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from services.price_store import PriceSeries, price_store
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+@dataclass
+class PricePanel:
+    """
+    Closes of several instruments on a shared calendar: a (dates x instruments)
+    matrix. Every instrument carries its last known close forward, so a row is
+    NaN only for instruments that had no bar yet on that date.
+    """
+    days: np.ndarray            # int64 epoch days, ascending
+    instrument_ids: List[int]
+    close: np.ndarray           # float64, shape (len(days), len(instrument_ids))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def timestamps(self) -> List[datetime]:
+        return [_EPOCH + timedelta(days=d) for d in self.days.tolist()]
+
+    def complete(self) -> "PricePanel":
+        """Rows from the first date every instrument has a price."""
+        if not len(self.days) or not self.instrument_ids:
+            return self
+        ok = np.isfinite(self.close).all(axis=1)
+        first = int(ok.argmax()) if ok.any() else len(self.days)
+        return PricePanel(self.days[first:], self.instrument_ids, self.close[first:])
+
+def from_series(series: Sequence[PriceSeries], start: Optional[datetime] = None, end: Optional[datetime] = None) -> PricePanel:
+    """
+    Panel over the union of the instruments' trading days in [start, end].
+    Bars before `start` seed the forward fill, so an instrument whose last bar
+    is before the window still carries that close through it. Instruments
+    with no bar on or before `end` are left out.
+    """
+    # (series, bars in range, bars before the range)
+    in_range = [(s, s.slice(start, end), len(s.slice(None, end))) for s in series]
+    in_range = [(s, r, k0 - len(r)) for s, r, k0 in in_range if k0]
+    if not in_range:
+        return PricePanel(np.empty(0, dtype=np.int64), [], np.empty((0, 0)))
+    ids = [s.instrument_id for s, _, _ in in_range]
+    trading = [r for _, r, _ in in_range if len(r)]
+    if not trading:
+        return PricePanel(np.empty(0, dtype=np.int64), ids, np.empty((0, len(ids))))
+    # calendar: mark every day that has a bar anywhere (linear, no sort)
+    lo = min(int(r.days[0]) for r in trading)
+    hi = max(int(r.days[-1]) for r in trading)
+    seen = np.zeros(hi - lo + 1, dtype=bool)
+    for r in trading:
+        seen[r.days - lo] = True
+    offs = np.flatnonzero(seen)
+
+    # per instrument: index of the latest bar on or before each calendar day,
+    # by scattering bar positions and taking a running max
+    cols = np.empty((len(in_range), len(offs)), dtype=np.float64)
+    pos = np.empty(len(seen), dtype=np.int64)
+    for j, (s, r, k0) in enumerate(in_range):
+        if len(r) == len(offs):  # trades on every calendar day: nothing to fill
+            cols[j] = r.close
+            continue
+        # r is a view into s starting at k0
+        pos.fill(k0 - 1)  # the last bar before the window, or -1
+        pos[r.days - lo] = np.arange(k0, k0 + len(r))
+        np.maximum.accumulate(pos, out=pos)
+        idx = pos[offs]
+        np.take(s.close, np.maximum(idx, 0), out=cols[j])
+        if k0 == 0:
+            cols[j, idx < 0] = np.nan
+    return PricePanel(offs + lo, ids, cols.T)
+
+def close_panel(db: Session, instrument_ids: Sequence[int], start: Optional[datetime] = None, end: Optional[datetime] = None) -> PricePanel:
+    """Aligned closes for `instrument_ids`, read through the price store (one query for any misses)."""
+    ids = list(dict.fromkeys(instrument_ids))
+    prices = price_store.get_many(db, ids)
+    return from_series([prices[i] for i in ids], start, end)
+
+def portfolio_values(panel: PricePanel, qty: Dict[int, float]) -> np.ndarray:
+    """Market value per panel date for constant quantities: closes @ qty."""
+    q = np.array([qty.get(i, 0.0) for i in panel.instrument_ids], dtype=np.float64)
+    return panel.close @ q
@@ -0,0 +1,220 @@
+# app/services/price_encoding.py
+from __future__ import annotations
+import json
+import logging
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+log = logging.getLogger("price_encoding")
+
+try:
+    import msgpack
+except Exception as e:
+    msgpack = None
+    log.warning("msgpack import failed; msgpack price format disabled: %s", e)
+
+try:
+    import pyarrow as pa
+except Exception as e:
+    pa = None
+    log.warning("pyarrow import failed; arrow price format disabled: %s", e)
+
+# rows fetched per DB round trip / emitted per arrow record batch
+CHUNK_ROWS = 5000
+# encoded columns kept in memory before spilling to disk, per column, and the read size when sending them
+SPOOL_BYTES = 1 << 20
+READ_BYTES = 64 << 10
+
+_COLUMNS = ("ts", "o", "h", "l", "c", "v")
+
+MEDIA_TYPES: Dict[str, str] = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+_ACCEPT = {
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+
+@dataclass
+class OHLCV:
+    """A block of candles as parallel arrays; ts is epoch seconds, missing volume is NaN."""
+    ts: np.ndarray
+    o: np.ndarray
+    h: np.ndarray
+    l: np.ndarray
+    c: np.ndarray
+    v: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple]) -> "OHLCV":
+        """rows: (ts: datetime, open, high, low, close, volume) with floats already cast in SQL."""
+        n = len(rows)
+        ts = np.fromiter((r[0].timestamp() for r in rows), dtype=np.float64, count=n).astype(np.int64)
+        cols = np.array([r[1:] for r in rows], dtype=np.float64).reshape(n, 5)  # None volume -> NaN
+        return cls(ts, cols[:, 0], cols[:, 1], cols[:, 2], cols[:, 3], cols[:, 4])
+
+    @classmethod
+    def concat(cls, blocks: Iterable["OHLCV"]) -> "OHLCV":
+        blocks = list(blocks)
+        if not blocks:
+            e = np.empty(0, dtype=np.float64)
+            return cls(np.empty(0, dtype=np.int64), e, e, e, e, e)
+        if len(blocks) == 1:
+            return blocks[0]
+        return cls(*(np.concatenate([getattr(b, f) for b in blocks]) for f in ("ts", "o", "h", "l", "c", "v")))
+
+def negotiate(fmt: Optional[str], accept: Optional[str]) -> str:
+    """Pick a format from ?format= or the Accept header; ValueError if it can't be served."""
+    if not fmt:
+        fmt = "json"
+        for part in (accept or "").split(","):
+            mt = part.split(";")[0].strip().lower()
+            if mt in _ACCEPT:
+                fmt = _ACCEPT[mt]
+                break
+    fmt = fmt.lower()
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported format '{fmt}'")
+    if fmt == "msgpack" and msgpack is None:
+        raise ValueError("msgpack format requires the 'msgpack' package")
+    if fmt == "arrow" and pa is None:
+        raise ValueError("arrow format requires the 'pyarrow' package")
+    return fmt
+
+def _iso(ts: int) -> str:
+    """What the endpoint always returned: the stored UTC datetime's isoformat()."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(int(ts)))
+
+def _volumes(v: np.ndarray) -> List[Optional[int]]:
+    return [None if x != x else int(x) for x in v.tolist()]
+
+def _json_rows(meta: Dict, blocks: Iterable[OHLCV]) -> Iterator[bytes]:
+    """The classic layout (one object per candle), written block by block."""
+    head = json.dumps(meta)[:-1]
+    yield (head + ', "candles": [').encode()
+    n = 0
+    for b in blocks:
+        if not len(b):
+            continue
+        rows = [
+            {"ts": _iso(t), "o": o, "h": h, "l": l, "c": c, "v": v}
+            for t, o, h, l, c, v in zip(b.ts.tolist(), b.o.tolist(), b.h.tolist(), b.l.tolist(), b.c.tolist(), _volumes(b.v))
+        ]
+        body = json.dumps(rows)[1:-1]
+        yield ((", " if n else "") + body).encode()
+        n += len(b)
+    yield f'], "count": {n}}}'.encode()
+
+def _spool_columns(blocks: Iterable[OHLCV], encode_block) -> tuple:
+    """
+    Encode each block's six columns as it arrives and append them to one
+    spool per column (in memory up to SPOOL_BYTES, then on disk), so the
+    parallel arrays can be written out whole without holding the range.
+    Returns (rows, spools); the caller closes the spools.
+    """
+    spools = [tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) for _ in _COLUMNS]
+    n = 0
+    try:
+        for b in blocks:
+            if not len(b):
+                continue
+            for spool, part in zip(spools, encode_block(b, n)):
+                spool.write(part)
+            n += len(b)
+    except BaseException:
+        for spool in spools:
+            spool.close()
+        raise
+    for spool in spools:
+        spool.seek(0)
+    return n, spools
+
+def _drain(spool) -> Iterator[bytes]:
+    while True:
+        chunk = spool.read(READ_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+def _block_columns(b: OHLCV) -> List[list]:
+    return [b.ts.tolist(), b.o.tolist(), b.h.tolist(), b.l.tolist(), b.c.tolist(), _volumes(b.v)]
+
+def _json_columnar(meta: Dict, blocks: Iterable[OHLCV]) -> Iterator[bytes]:
+    """Parallel arrays: {"ts": [...], "o": [...], ...}; ts in epoch seconds."""
+    def encode_block(b: OHLCV, before: int) -> Iterator[bytes]:
+        sep = ", " if before else ""
+        return ((sep + json.dumps(col)[1:-1]).encode() for col in _block_columns(b))
+
+    n, spools = _spool_columns(blocks, encode_block)
+    try:
+        yield json.dumps({**meta, "count": n})[:-1].encode()
+        for name, spool in zip(_COLUMNS, spools):
+            yield f', "{name}": ['.encode()
+            yield from _drain(spool)
+            yield b"]"
+        yield b"}"
+    finally:
+        for spool in spools:
+            spool.close()
+
+def _msgpack(meta: Dict, blocks: Iterable[OHLCV]) -> Iterator[bytes]:
+    """Same map as packing the whole range at once, written as headers plus each block's packed values."""
+    packer = msgpack.Packer()
+
+    def encode_block(b: OHLCV, before: int) -> Iterator[bytes]:
+        return (b"".join(map(packer.pack, col)) for col in _block_columns(b))
+
+    n, spools = _spool_columns(blocks, encode_block)
+    try:
+        yield packer.pack_map_header(len(meta) + 1 + len(_COLUMNS))
+        for k, v in meta.items():
+            yield packer.pack(k) + packer.pack(v)
+        yield packer.pack("count") + packer.pack(n)
+        for name, spool in zip(_COLUMNS, spools):
+            yield packer.pack(name) + packer.pack_array_header(n)
+            yield from _drain(spool)
+    finally:
+        for spool in spools:
+            spool.close()
+
+def _arrow(meta: Dict, blocks: Iterable[OHLCV]) -> Iterator[bytes]:
+    """Arrow IPC stream; one record batch per block so nothing is buffered."""
+    schema = pa.schema(
+        [("ts", pa.timestamp("s", tz="UTC")), ("o", pa.float64()), ("h", pa.float64()),
+         ("l", pa.float64()), ("c", pa.float64()), ("v", pa.int64())],
+        metadata={k: str(v) for k, v in meta.items()},
+    )
+    # an IPC stream is just encapsulated messages back to back: schema, batches, EOS
+    yield schema.serialize().to_pybytes()
+    for b in blocks:
+        if not len(b):
+            continue
+        batch = pa.record_batch([
+            pa.array(b.ts, type=pa.timestamp("s", tz="UTC")),
+            pa.array(b.o), pa.array(b.h), pa.array(b.l), pa.array(b.c),
+            pa.array(b.v, mask=np.isnan(b.v)).cast(pa.int64()),
+        ], schema=schema)
+        yield batch.serialize().to_pybytes()
+    yield b"\xff\xff\xff\xff\x00\x00\x00\x00"  # end-of-stream marker
+
+ENCODERS = {
+    "json": _json_rows,
+    "columnar": _json_columnar,
+    "msgpack": _msgpack,
+    "arrow": _arrow,
+}
+
+def encode(fmt: str, meta: Dict, blocks: Iterable[OHLCV]) -> Iterator[bytes]:
+    return ENCODERS[fmt](meta, blocks)
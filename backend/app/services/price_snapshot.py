@@ -0,0 +1,284 @@
+# app/services/price_snapshot.py
+from __future__ import annotations
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Float, cast, func, select
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models
+
+log = logging.getLogger("price_snapshot")
+
+# A snapshot is a directory of packed .npy columns, every instrument's bars
+# back to back (oldest first), plus index.npy rows of (instrument_id, offset,
+# length, keep, revision). Readers np.load them with mmap_mode="r", so every
+# worker process shares one copy in the page cache and a series is a slice of
+# the mapping. A delta snapshot names a full one in `BASE` and holds the whole
+# history of every instrument that changed since; the others point at their
+# first `keep` bars in the base, so each series is still one slice of one
+# mapping. `revision` is the instrument's price_revisions counter
+# when its bars were read; once ingest bumps it (bars before the latest one
+# were backfilled or revised) the snapshot's copy is no longer used.
+# `CURRENT` names the live directory and is swapped atomically on export.
+
+DAY = 86400
+COLUMNS = ("days", "open", "high", "low", "close", "volume")
+_DTYPES = {"days": np.int64}
+_CURRENT = "CURRENT"
+_BASE = "BASE"
+_RECHECK_SEC = 30.0
+COMPACT_FRACTION = 0.25  # a delta holding more bars than this share of its base is written in full instead
+
+Columns = Dict[str, np.ndarray]
+
+class PriceSnapshot:
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._cols = {c: np.load(os.path.join(path, c + ".npy"), mmap_mode="r") for c in COLUMNS}
+        index = np.load(os.path.join(path, "index.npy"))
+        if index.shape[1] == 3:  # written before deltas and revisions: nothing to keep, revision unknown
+            index = np.column_stack([index, np.zeros(len(index), dtype=np.int64), np.full(len(index), -1, dtype=np.int64)])
+        self._index: Dict[int, Tuple[int, int, int, int]] = {
+            int(iid): (int(off), int(n), int(keep), int(rev)) for iid, off, n, keep, rev in index.tolist()
+        }
+        base = _read_name(os.path.join(path, _BASE))
+        self.base = PriceSnapshot(os.path.join(os.path.dirname(path), base)) if base else None
+
+    def __contains__(self, instrument_id: int) -> bool:
+        return instrument_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def bars(self) -> int:
+        """Bars stored in this directory (a delta's own, not its base's)."""
+        return len(self._cols["days"])
+
+    def instrument_ids(self) -> List[int]:
+        return list(self._index)
+
+    def revision(self, instrument_id: int) -> Optional[int]:
+        loc = self._index.get(instrument_id)
+        return loc[3] if loc is not None else None
+
+    def base_length(self, instrument_id: int) -> int:
+        """Bars of the instrument that a delta on this snapshot's full base can point at (all or nothing)."""
+        loc = self._index.get(instrument_id)
+        if loc is None:
+            return 0
+        return loc[2] if self.base is not None else loc[1]
+
+    def columns(self, instrument_id: int) -> Optional[Columns]:
+        """One instrument's bars as read-only memmap slices; None if it isn't in the snapshot."""
+        loc = self._index.get(instrument_id)
+        if loc is None:
+            return None
+        off, n, keep, _ = loc
+        if keep:
+            return {c: v[:keep] for c, v in self.base.columns(instrument_id).items()}
+        return {c: col[off:off + n] for c, col in self._cols.items()}
+
+def _read_name(path: str) -> Optional[str]:
+    try:
+        with open(path) as fh:
+            return fh.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def _read_current(root: str) -> Optional[str]:
+    return _read_name(os.path.join(root, _CURRENT))
+
+_lock = threading.Lock()
+_open: Optional[PriceSnapshot] = None
+_checked_at = 0.0
+
+def current_snapshot(root: Optional[str] = None) -> Optional[PriceSnapshot]:
+    """
+    The live snapshot under PRICE_SNAPSHOT_DIR (None if there is none yet).
+    `CURRENT` is re-read at most every few seconds, so a fresh export is
+    picked up without a restart.
+    """
+    global _open, _checked_at
+    root = root or settings.price_snapshot_dir
+    if not root:
+        return None
+    with _lock:
+        now = time.monotonic()
+        if _open is not None and os.path.dirname(_open.path) == root and now - _checked_at < _RECHECK_SEC:
+            return _open
+        _checked_at = now
+        name = _read_current(root)
+        if name is None:
+            _open = None
+        elif _open is None or _open.path != os.path.join(root, name):
+            try:
+                _open = PriceSnapshot(os.path.join(root, name))
+            except (OSError, ValueError):
+                log.warning("price_snapshot_unreadable", exc_info=True, extra={"snapshot": name})
+                _open = None
+        return _open
+
+# ---------- export ----------
+
+def _to_day(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() // DAY)
+
+def load_columns(db: Session, instrument_ids: Sequence[int], since_day: Optional[int] = None) -> Dict[int, Columns]:
+    """Bars of several instruments in one query, split into per-instrument columns."""
+    P = models.Price
+    stmt = (
+        select(P.instrument_id, P.ts, cast(P.open, Float), cast(P.high, Float),
+               cast(P.low, Float), cast(P.close, Float), P.volume)
+        .where(P.instrument_id.in_(list(instrument_ids)))
+        .order_by(P.instrument_id, P.ts)
+    )
+    if since_day is not None:
+        stmt = stmt.where(P.ts >= datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=since_day))
+    rows = db.execute(stmt).all()
+    n = len(rows)
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+    days = np.fromiter((_to_day(r[1]) for r in rows), dtype=np.int64, count=n)
+    vals = np.array([r[2:] for r in rows], dtype=np.float64).reshape(n, 5)  # None volume -> NaN
+    out: Dict[int, Columns] = {}
+    bounds = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1], True]) if n else np.array([0])
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        out[int(ids[lo])] = {"days": days[lo:hi], **{c: vals[lo:hi, i] for i, c in enumerate(COLUMNS[1:])}}
+    empty = {c: np.empty(0, dtype=_DTYPES.get(c, np.float64)) for c in COLUMNS}
+    for iid in instrument_ids:
+        out.setdefault(iid, empty)
+    return out
+
+def revisions(db: Session, instrument_ids: Optional[Sequence[int]] = None) -> Dict[int, int]:
+    """Current price revision per instrument; ones never revised are left out (revision 0)."""
+    R = models.PriceRevision
+    stmt = select(R.instrument_id, R.revision)
+    if instrument_ids is not None:
+        stmt = stmt.where(R.instrument_id.in_(list(instrument_ids)))
+    return {int(iid): int(rev) for iid, rev in db.execute(stmt).all()}
+
+def _write(path: str, ids: List[int], parts: Dict[int, List[Columns]], keeps: Dict[int, int], revs: Dict[int, int]) -> int:
+    lengths = np.array([sum(len(p["days"]) for p in parts[iid]) for iid in ids], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    total = int(lengths.sum())
+    for c in COLUMNS:
+        out = np.lib.format.open_memmap(os.path.join(path, c + ".npy"), mode="w+",
+                                        dtype=_DTYPES.get(c, np.float64), shape=(total,))
+        pos = 0
+        for iid in ids:
+            for p in parts[iid]:
+                out[pos:pos + len(p[c])] = p[c]
+                pos += len(p[c])
+        out.flush()
+        del out
+    index = np.stack([
+        np.array(ids, dtype=np.int64), offsets, lengths,
+        np.array([keeps.get(iid, 0) for iid in ids], dtype=np.int64),
+        np.array([revs.get(iid, 0) for iid in ids], dtype=np.int64),
+    ], axis=1) if ids else np.empty((0, 5), dtype=np.int64)
+    np.save(os.path.join(path, "index.npy"), index)
+    return total
+
+def export_snapshot(db: Session, root: Optional[str] = None) -> Dict[str, int]:
+    """
+    Make a new snapshot of every instrument's bars current. An instrument the
+    previous snapshot has at the same price revision and first day only reads
+    bars from its last snapshot day on; one whose revision, range or bar count
+    no longer lines up is re-read in full. The result is written as a delta on
+    the last full snapshot (only the instruments whose bars changed, each in
+    full), or in full once the delta would outgrow COMPACT_FRACTION of it.
+    """
+    root = root or settings.price_snapshot_dir
+    if not root:
+        raise ValueError("PRICE_SNAPSHOT_DIR is not set")
+    os.makedirs(root, exist_ok=True)
+    prev = current_snapshot(root)
+    base = prev.base if prev is not None and prev.base is not None else prev
+
+    P = models.Price
+    revs = revisions(db)  # before the bars: a revision that races the reads shows up next time
+    spans = db.execute(
+        select(P.instrument_id, func.count(), func.min(P.ts), func.max(P.ts)).group_by(P.instrument_id)
+    ).all()
+
+    reused: Dict[int, Tuple[Columns, int]] = {}
+    full: List[int] = []
+    for iid, n, lo, hi in spans:
+        old = prev.columns(iid) if prev is not None and prev.revision(iid) == revs.get(iid, 0) else None
+        if old is not None and len(old["days"]) and old["days"][0] == _to_day(lo) and _to_day(hi) >= old["days"][-1]:
+            reused[iid] = (old, n)
+        else:
+            full.append(iid)
+
+    # each instrument as (bars pointed at in the full base, bars to write): one or the other
+    kept: Dict[int, int] = {}
+    parts: Dict[int, List[Columns]] = {}
+    if reused:
+        since = min(int(old["days"][-1]) for old, _ in reused.values())
+        tails = load_columns(db, list(reused), since_day=since)
+        for iid, (old, n) in reused.items():
+            tail = tails[iid]
+            keep_from = tail["days"] >= old["days"][-1]  # the last snapshot day may have been rewritten
+            tail = {c: v[keep_from] for c, v in tail.items()}
+            k = int(np.searchsorted(old["days"], tail["days"][0])) if len(tail["days"]) else len(old["days"])
+            if k + len(tail["days"]) != n:
+                full.append(iid)
+                continue
+            same = len(old["days"]) - k == len(tail["days"]) and all(
+                np.array_equal(old[c][k:], tail[c], equal_nan=True) for c in COLUMNS
+            )
+            if same and prev.base_length(iid) == len(old["days"]):
+                kept[iid], parts[iid] = len(old["days"]), []
+            else:
+                kept[iid], parts[iid] = 0, [{c: v[:k] for c, v in old.items()}, tail]
+    if full:
+        for iid, cols in load_columns(db, full).items():
+            kept[iid] = 0
+            parts[iid] = [cols]
+
+    ids = sorted(parts)
+    written = sum(len(p["days"]) for iid in ids for p in parts[iid])
+    delta = base is not None and written <= COMPACT_FRACTION * base.bars
+    if not delta:
+        for iid in ids:
+            if kept[iid]:
+                parts[iid] = [{c: v[:kept[iid]] for c, v in base.columns(iid).items()}]
+                kept[iid] = 0
+
+    name = "v%d-%d" % (time.time() * 1000, os.getpid())
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    try:
+        bars = _write(path, ids, parts, kept, revs)
+        if delta:
+            with open(os.path.join(path, _BASE), "w") as fh:
+                fh.write(base.name)
+        tmp = os.path.join(root, _CURRENT + ".tmp")
+        with open(tmp, "w") as fh:
+            fh.write(name)
+        os.replace(tmp, os.path.join(root, _CURRENT))
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+
+    # open mappings keep their files alive after unlink, so old versions can go now
+    live = {name, base.name} if delta else {name}
+    for entry in os.listdir(root):
+        if entry.startswith("v") and entry not in live:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    stats = {"instruments": len(ids), "bars": bars + sum(kept.values()), "written": bars, "delta": int(delta),
+             "incremental": len(reused) - len(set(full) & set(reused)), "full": len(full)}
+    log.info("price_snapshot_export", extra={"snapshot": name, **stats})
+    return stats
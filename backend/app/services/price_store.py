@@ -0,0 +1,274 @@
+# app/services/price_store.py
+from __future__ import annotations
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from services.market_data.base import PriceBar
+from services.price_encoding import OHLCV
+from services.price_snapshot import Columns, current_snapshot, load_columns, revisions
+
+log = logging.getLogger("price_store")
+
+DAY = 86400
+_EPOCH = date(1970, 1, 1)
+_FIELDS = ("days", "open", "high", "low", "close", "volume")
+
+def _epoch_seconds(t: datetime | date) -> float:
+    if not isinstance(t, datetime):
+        return float((t - _EPOCH).days * DAY)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)  # naive bounds/bars are UTC, as stored
+    return t.timestamp()
+
+def _day(t: datetime | date) -> int:
+    return int(_epoch_seconds(t) // DAY)
+
+def timestamps(days: np.ndarray) -> List[datetime]:
+    """Epoch days as UTC-midnight datetimes, like the stored `ts`."""
+    base = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return [base + timedelta(days=d) for d in np.asarray(days).tolist()]
+
+@dataclass
+class PriceSeries:
+    """
+    Daily bars of one instrument as parallel arrays, oldest first.
+    `days` are int64 days since 1970-01-01 (UTC); prices are float64 and a
+    missing volume is NaN. Slices share memory with the cached arrays, so
+    treat them as read-only.
+    """
+    instrument_id: int
+    days: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @property
+    def nbytes(self) -> int:
+        # snapshot-backed columns live in the shared page cache, not in this process
+        return sum(a.nbytes for a in (getattr(self, f) for f in _FIELDS) if not isinstance(a, np.memmap))
+
+    @classmethod
+    def empty(cls, instrument_id: int) -> "PriceSeries":
+        e = np.empty(0, dtype=np.float64)
+        return cls(instrument_id, np.empty(0, dtype=np.int64), e, e, e, e, e)
+
+    def slice(self, start: datetime | date | None = None, end: datetime | date | None = None) -> "PriceSeries":
+        """Bars with start <= ts <= end, as views (no copy)."""
+        lo, hi = 0, len(self.days)
+        if start is not None:
+            first = -(-_epoch_seconds(start) // DAY)  # first whole day at or after start
+            lo = int(np.searchsorted(self.days, first, side="left"))
+        if end is not None:
+            hi = int(np.searchsorted(self.days, _epoch_seconds(end) // DAY, side="right"))
+        if lo == 0 and hi == len(self.days):
+            return self
+        return PriceSeries(self.instrument_id, *(getattr(self, f)[lo:hi] for f in _FIELDS))
+
+    def timestamps(self) -> List[datetime]:
+        return timestamps(self.days)
+
+    def closes(self) -> List[Tuple[datetime, float]]:
+        """(ts, close) pairs, the input shape of services.indicators."""
+        return list(zip(self.timestamps(), self.close.tolist()))
+
+    def to_ohlcv(self) -> OHLCV:
+        return OHLCV(self.days * DAY, self.open, self.high, self.low, self.close, self.volume)
+
+def _from_rows(instrument_id: int, rows: Sequence[tuple]) -> PriceSeries:
+    """rows: (ts, open, high, low, close, volume) with prices already floats."""
+    if not rows:
+        return PriceSeries.empty(instrument_id)
+    n = len(rows)
+    days = np.fromiter((_day(r[0]) for r in rows), dtype=np.int64, count=n)
+    cols = np.array([r[1:] for r in rows], dtype=np.float64).reshape(n, 5)  # None -> NaN
+    # own contiguous columns so a series' nbytes is what it really keeps alive
+    return PriceSeries(instrument_id, days, *(np.ascontiguousarray(cols[:, i]) for i in range(5)))
+
+def _owned(instrument_id: int, cols: Columns) -> PriceSeries:
+    return PriceSeries(instrument_id, **{c: np.array(v) for c, v in cols.items()})
+
+def _merge(old: PriceSeries, new: PriceSeries) -> PriceSeries:
+    """`new` (sorted by day) laid over `old`; new values win on the same day."""
+    if not len(old) or new.days[0] > old.days[-1]:
+        # the usual case: bars after the old tail
+        return PriceSeries(old.instrument_id, *(np.concatenate([getattr(old, f), getattr(new, f)]) for f in _FIELDS))
+    # revisions/backfill: keep the last duplicate of each new day, drop the old one
+    _, last = np.unique(new.days[::-1], return_index=True)
+    pick = len(new) - 1 - last
+    keep = ~np.isin(old.days, new.days)
+    o = np.argsort(np.concatenate([old.days[keep], new.days[pick]]), kind="stable")
+    return PriceSeries(old.instrument_id, *(
+        np.concatenate([getattr(old, f)[keep], getattr(new, f)[pick]])[o] for f in _FIELDS
+    ))
+
+def _with_tail(base: PriceSeries, tail: PriceSeries) -> PriceSeries:
+    """
+    A snapshot series (at the current price revision, so only its last day
+    can have changed) plus the bars stored since; stays a zero-copy view when
+    nothing changed.
+    """
+    recent = tail.days >= base.days[-1]
+    tail = PriceSeries(tail.instrument_id, *(getattr(tail, f)[recent] for f in _FIELDS))
+    if len(tail) == 1 and tail.days[0] == base.days[-1] and all(
+        np.array_equal(getattr(tail, f), getattr(base, f)[-1:], equal_nan=True) for f in _FIELDS[1:]
+    ):
+        tail = PriceSeries.empty(tail.instrument_id)
+    return _merge(base, tail) if len(tail) else base
+
+class PriceStore:
+    """
+    Process-wide cache of daily bars per instrument, bounded by `max_bytes`
+    and evicted least-recently-used. Misses are served from the memory-mapped
+    snapshot (services.price_snapshot) plus the few bars stored after it, or
+    from the database when the snapshot doesn't have the instrument at its current
+    price revision.
+    Entries are dropped or extended by the
+    ingest writer when new bars are committed; `ttl` bounds how stale an entry
+    can get from writes made by other processes.
+    """
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # instrument_id -> (series, loaded_at); order = recency, oldest first
+        self._entries: "OrderedDict[int, Tuple[PriceSeries, float]]" = OrderedDict()
+        self._bytes = 0
+        # bumped on every write notification; a load that raced one isn't cached
+        self._versions: Dict[int, int] = {}
+
+    def _pop(self, instrument_id: int) -> None:
+        entry = self._entries.pop(instrument_id, None)
+        if entry is not None:
+            self._bytes -= entry[0].nbytes
+
+    def _put(self, series: PriceSeries, loaded_at: float) -> None:
+        self._pop(series.instrument_id)
+        if series.nbytes > self.max_bytes:
+            return
+        self._entries[series.instrument_id] = (series, loaded_at)
+        self._bytes += series.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _cached(self, instrument_id: int, now: float) -> Optional[PriceSeries]:
+        entry = self._entries.get(instrument_id)
+        if entry is None:
+            return None
+        if now - entry[1] > self.ttl:
+            self._pop(instrument_id)
+            return None
+        self._entries.move_to_end(instrument_id)
+        return entry[0]
+
+    def __contains__(self, instrument_id: int) -> bool:
+        with self._lock:
+            return instrument_id in self._entries
+
+    def get(self, db: Session, instrument_id: int) -> PriceSeries:
+        return self.get_many(db, [instrument_id])[instrument_id]
+
+    def get_many(self, db: Session, instrument_ids: Iterable[int]) -> Dict[int, PriceSeries]:
+        """Series for every id (empty when there are no bars); misses load in one query."""
+        ids = list(dict.fromkeys(instrument_ids))
+        now = time.monotonic()
+        out: Dict[int, PriceSeries] = {}
+        with self._lock:
+            for iid in ids:
+                s = self._cached(iid, now)
+                if s is not None:
+                    out[iid] = s
+            self.hits += len(out)
+            self.misses += len(ids) - len(out)
+            missing = [iid for iid in ids if iid not in out]
+            seen = {iid: self._versions.get(iid, 0) for iid in missing}
+        if not missing:
+            return out
+
+        loaded = self._load(db, missing)
+        with self._lock:
+            for iid in missing:
+                out[iid] = loaded[iid]
+                if self._versions.get(iid, 0) == seen[iid]:
+                    self._put(loaded[iid], now)
+        return out
+
+    def _load(self, db: Session, instrument_ids: List[int]) -> Dict[int, PriceSeries]:
+        snap = current_snapshot()
+        base: Dict[int, PriceSeries] = {}
+        listed = [iid for iid in instrument_ids if snap is not None and iid in snap]
+        if listed:
+            revs = revisions(db, listed)
+            for iid in listed:
+                if snap.revision(iid) != revs.get(iid, 0):
+                    continue  # older bars backfilled or revised since the export
+                cols = snap.columns(iid)
+                if len(cols["days"]):
+                    base[iid] = PriceSeries(iid, **cols)
+        out: Dict[int, PriceSeries] = {}
+        if base:
+            since = min(int(s.days[-1]) for s in base.values())
+            for iid, cols in load_columns(db, list(base), since_day=since).items():
+                out[iid] = _with_tail(base[iid], _owned(iid, cols))
+        rest = [iid for iid in instrument_ids if iid not in base]
+        if rest:
+            for iid, cols in load_columns(db, rest).items():
+                out[iid] = _owned(iid, cols)
+        return out
+
+    def _bump(self, instrument_id: int) -> None:
+        self._versions[instrument_id] = self._versions.get(instrument_id, 0) + 1
+
+    def invalidate(self, instrument_id: int) -> None:
+        with self._lock:
+            self._bump(instrument_id)
+            self._pop(instrument_id)
+
+    def append(self, instrument_id: int, bars: Sequence[PriceBar]) -> None:
+        """
+        Merge freshly committed bars into a cached series (new values win on the
+        same day). Does nothing when the instrument isn't cached; the next read
+        loads it from the database anyway.
+        """
+        if not bars:
+            return
+        new = _from_rows(instrument_id, [
+            (b["ts"], b["open"], b["high"], b["low"], b["close"], b.get("volume")) for b in bars
+        ])
+        order = np.argsort(new.days, kind="stable")
+        new = PriceSeries(instrument_id, *(getattr(new, f)[order] for f in _FIELDS))
+        with self._lock:
+            self._bump(instrument_id)
+            entry = self._entries.get(instrument_id)
+            if entry is None:
+                return
+            self._put(_merge(entry[0], new), entry[1])
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+price_store = PriceStore(settings.price_cache_mb * 1024 * 1024, settings.price_cache_ttl_sec)
@@ -0,0 +1,87 @@
+# app/services/resample.py
+from __future__ import annotations
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+import numpy as np
+
+from services.downsample import reduce_ohlcv
+from services.price_encoding import OHLCV
+
+DAY = 86400
+
+_N_DAYS = re.compile(r"^(\d+)d$")
+
+@dataclass(frozen=True)
+class Interval:
+    unit: str   # "d" | "w" | "mo" | "q"
+    n: int = 1
+
+    @property
+    def is_daily(self) -> bool:
+        return self.unit == "d" and self.n == 1
+
+def parse_interval(s: str) -> Interval:
+    """1d, Nd (calendar-day buckets), 1w (ISO weeks), 1mo, 1q."""
+    s = (s or "").strip().lower()
+    if s == "1w":
+        return Interval("w")
+    if s == "1mo":
+        return Interval("mo")
+    if s == "1q":
+        return Interval("q")
+    m = _N_DAYS.match(s)
+    if m and 1 <= int(m.group(1)) <= 3660:
+        return Interval("d", int(m.group(1)))
+    raise ValueError(f"Unsupported interval '{s}' (use 1d, Nd, 1w, 1mo or 1q)")
+
+def _bucket_keys(ts: np.ndarray, iv: Interval) -> tuple[np.ndarray, np.ndarray]:
+    """Per-bar bucket key plus the epoch-second start of each key's period."""
+    days = ts // DAY
+    if iv.unit == "d":
+        key = days // iv.n
+        return key, key * iv.n * DAY
+    if iv.unit == "w":
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday
+        key = (days + 3) // 7
+        return key, (key * 7 - 3) * DAY
+    months = ts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+    key = months if iv.unit == "mo" else months // 3
+    first_month = key if iv.unit == "mo" else key * 3
+    return key, first_month.astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+
+def resample_ohlcv(b: OHLCV, iv: Interval) -> OHLCV:
+    """Aggregate sorted daily candles into calendar buckets, stamped with the period start."""
+    if iv.is_daily or not len(b):
+        return b
+    key, period_start = _bucket_keys(b.ts, iv)
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    out = reduce_ohlcv(b, starts)
+    out.ts = period_start[starts]
+    return out
+
+class _LRU:
+    """Small process-local LRU for aggregated bars; keys embed a data version, so no invalidation is needed."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._d: "OrderedDict[Hashable, OHLCV]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[OHLCV]:
+        with self._lock:
+            v = self._d.get(key)
+            if v is not None:
+                self._d.move_to_end(key)
+            return v
+
+    def put(self, key: Hashable, value: OHLCV) -> None:
+        with self._lock:
+            self._d[key] = value
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+aggregated_cache = _LRU(256)
@@ -0,0 +1,157 @@
+# app/services/result_cache.py
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Sequence, Tuple, TypeVar
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select, union
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models
+
+log = logging.getLogger("result_cache")
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+T = TypeVar("T")
+
+# Analytics payloads are memoised under a key that embeds a data version
+# (see portfolio_version), so a change to holdings, transactions or prices
+# simply produces a new key; the TTL only bounds what the version can't see,
+# such as a same-day revision of the latest bar.
+
+_REDIS_RETRY_SEC = 30.0
+
+class ResultCache:
+    """
+    Two-tier memo: a process-local LRU in front of an optional Redis shared by
+    every worker. Redis holds JSON (the encoded response), the LRU the object
+    itself. Redis errors are logged and the tier is skipped for a while.
+    """
+    def __init__(self, maxsize: int, ttl: int, redis_url: Optional[str] = None, prefix: str = "analytics:"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._d: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._redis_url = redis_url
+        self._redis = None
+        self._redis_down_until = 0.0
+        if redis_url and redis is None:
+            log.warning("redis import failed; REDIS_URL ignored, result cache is in-process only")
+
+    @staticmethod
+    def make_key(namespace: str, parts: Sequence[Hashable]) -> str:
+        raw = json.dumps([str(p) for p in parts])
+        return namespace + ":" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _client(self):
+        if not self._redis_url or redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            self._redis = redis.Redis.from_url(self._redis_url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        return self._redis
+
+    def _redis_failed(self) -> None:
+        log.warning("result_cache_redis_unavailable", exc_info=True)
+        self._redis_down_until = time.monotonic() + _REDIS_RETRY_SEC
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._d.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._d.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._d[key]
+        client = self._client()
+        if client is not None:
+            try:
+                raw = client.get(self.prefix + key)
+            except Exception:
+                self._redis_failed()
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._d[key] = (time.monotonic(), value)
+            self._d.move_to_end(key)
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def put(self, key: str, value: Any) -> None:
+        self._remember(key, value)
+        client = self._client()
+        if client is not None:
+            try:
+                client.set(self.prefix + key, json.dumps(jsonable_encoder(value)), ex=self.ttl)
+            except Exception:
+                self._redis_failed()
+
+    def get_or_compute(self, namespace: str, parts: Sequence[Hashable], compute: Callable[[], T]) -> T:
+        key = self.make_key(namespace, parts)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._d)}
+
+result_cache = ResultCache(
+    maxsize=settings.analytics_cache_size,
+    ttl=settings.analytics_cache_ttl_sec,
+    redis_url=settings.redis_url,
+)
+
+def portfolio_version(db: Session, portfolio_id, benchmark: Optional[str] = None) -> tuple:
+    """
+    Change stamps of everything a portfolio's analytics read, in one statement:
+    holdings (count, latest last_updated), transactions (count, latest
+    executed_at, a checksum of amounts), the latest bar of every instrument
+    they reference and, if given, of the benchmark.
+    """
+    H, Tx, P = models.Holding, models.Transaction, models.Price
+    instruments = union(
+        select(H.instrument_id).where(H.portfolio_id == portfolio_id),
+        select(Tx.instrument_id).where(Tx.portfolio_id == portfolio_id),
+    ).subquery()
+    cols = [
+        select(func.count(H.id)).where(H.portfolio_id == portfolio_id).scalar_subquery(),
+        select(func.max(H.last_updated)).where(H.portfolio_id == portfolio_id).scalar_subquery(),
+        select(func.count(Tx.id)).where(Tx.portfolio_id == portfolio_id).scalar_subquery(),
+        select(func.max(Tx.executed_at)).where(Tx.portfolio_id == portfolio_id).scalar_subquery(),
+        select(func.sum(Tx.qty * Tx.price + Tx.fees)).where(Tx.portfolio_id == portfolio_id).scalar_subquery(),
+        select(func.max(P.ts)).where(P.instrument_id.in_(select(instruments.c[0]))).scalar_subquery(),
+    ]
+    if benchmark:
+        B, BP = models.Benchmark, models.BenchmarkPrice
+        cols.append(
+            select(func.max(BP.ts)).join(B, B.id == BP.benchmark_id)
+            .where(B.symbol == benchmark.strip().upper()).scalar_subquery()
+        )
+    return tuple(db.execute(select(*cols)).one())
@@ -0,0 +1,151 @@
+# app/services/risk.py
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from services.metrics import TRADING_DAYS
+from services.panel import from_series
+from services.price_store import price_store
+
+# Covariance of daily close-to-close returns of a set of instruments, on the
+# dates they all trade (forward-filled union calendar, from the first date
+# every instrument has a price). Matrices are annualised (x 252).
+
+_MAX_MODELS = 64
+
+@dataclass
+class CovarianceModel:
+    instrument_ids: List[int]
+    days: np.ndarray            # epoch days of the return rows
+    sample: np.ndarray          # (N x N) sample covariance, n-1 denominator
+    shrunk: np.ndarray          # (N x N) Ledoit-Wolf covariance
+    shrinkage: float            # weight of the scaled-identity target in `shrunk`
+
+    def covariance(self, estimator: str = "ledoit_wolf") -> np.ndarray:
+        return self.shrunk if estimator == "ledoit_wolf" else self.sample
+
+    def correlation(self, estimator: str = "ledoit_wolf") -> np.ndarray:
+        return correlation(self.covariance(estimator))
+
+def returns_matrix(db: Session, instrument_ids: Sequence[int], start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[np.ndarray, List[int], np.ndarray]:
+    """(days, instrument_ids, R) with R[t, j] the return of instrument j into day t."""
+    ids = list(dict.fromkeys(instrument_ids))
+    series = price_store.get_many(db, ids)
+    panel = from_series([series[i] for i in ids], start, end).complete()
+    c = panel.close
+    if len(panel) < 2:
+        return np.empty(0, dtype=np.int64), panel.instrument_ids, np.empty((0, len(panel.instrument_ids)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.where(c[:-1] > 0, c[1:] / c[:-1] - 1.0, 0.0)
+    return panel.days[1:], panel.instrument_ids, r
+
+def sample_covariance(r: np.ndarray) -> np.ndarray:
+    x = r - r.mean(axis=0)
+    return (x.T @ x) / max(len(r) - 1, 1)
+
+def ledoit_wolf(r: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Ledoit & Wolf (2004) shrinkage of the covariance towards mu * I, with mu
+    the average variance and the optimal weight in closed form.
+    """
+    n, p = r.shape
+    x = r - r.mean(axis=0)
+    s = (x.T @ x) / n
+    mu = np.trace(s) / p
+    target = mu * np.eye(p)
+    d2 = np.sum((s - target) ** 2)
+    if n == 0 or d2 == 0:
+        return s, 0.0
+    # sum_k ||x_k x_k' - S||^2 = sum_k ||x_k||^4 - n ||S||^2
+    row_sq = np.einsum("ij,ij->i", x, x)
+    b2 = (np.dot(row_sq, row_sq) - n * np.sum(s * s)) / (n * n)
+    delta = float(min(max(b2, 0.0), d2) / d2)
+    return delta * target + (1.0 - delta) * s, delta
+
+def correlation(cov: np.ndarray) -> np.ndarray:
+    sd = np.sqrt(np.diag(cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.outer(sd, sd)
+    corr[~np.isfinite(corr)] = 0.0
+    np.fill_diagonal(corr, np.where(sd > 0, 1.0, 0.0))
+    return corr
+
+def position_values(db: Session, qty: Dict[int, float], instrument_ids: Sequence[int], end: Optional[datetime] = None) -> np.ndarray:
+    """Market value of each position at its last close on or before `end`."""
+    prices = price_store.get_many(db, instrument_ids)
+    out = np.zeros(len(instrument_ids))
+    for j, iid in enumerate(instrument_ids):
+        s = prices[iid].slice(None, end)
+        if len(s):
+            out[j] = qty.get(iid, 0.0) * float(s.close[-1])
+    return out
+
+def risk_contributions(cov: np.ndarray, weights: np.ndarray) -> Dict[str, np.ndarray | float]:
+    """
+    Volatility of the weighted portfolio and each position's share of it:
+    marginal = d vol / d w = (cov w) / vol, component = w * marginal (these sum
+    to vol), pct = component / vol.
+    """
+    w = np.asarray(weights, dtype=np.float64)
+    cw = cov @ w
+    vol = float(np.sqrt(max(w @ cw, 0.0)))
+    if vol == 0:
+        zero = np.zeros(len(w))
+        return {"vol": 0.0, "marginal": zero, "component": zero, "pct": zero}
+    marginal = cw / vol
+    component = w * marginal
+    return {"vol": vol, "marginal": marginal, "component": component, "pct": component / vol}
+
+_lock = threading.Lock()
+_models: "OrderedDict[tuple, CovarianceModel]" = OrderedDict()
+
+def _data_version(db: Session, ids: Sequence[int]) -> tuple:
+    # bar count and last bar of each instrument, from the price store
+    series = price_store.get_many(db, ids)
+    return tuple(
+        (i, len(s), int(s.days[-1]) if len(s) else None, float(s.close[-1]) if len(s) else None)
+        for i, s in sorted(series.items())
+    )
+
+def covariance_model(
+    db: Session,
+    instrument_ids: Sequence[int],
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    window: Optional[int] = None,
+) -> CovarianceModel:
+    """
+    Sample and shrunk covariance of the instruments' returns over the last
+    `window` return rows of [start, end]. Cached by instrument set, range and
+    the price data version, so positions changing size don't rebuild it.
+    """
+    ids = sorted(set(instrument_ids))
+    key = (tuple(ids), start, end, window, _data_version(db, ids))
+    with _lock:
+        hit = _models.get(key)
+        if hit is not None:
+            _models.move_to_end(key)
+            return hit
+
+    days, ids, r = returns_matrix(db, ids, start, end)
+    if window:
+        days, r = days[-window:], r[-window:]
+    if len(r) < 2:
+        z = np.zeros((len(ids), len(ids)))
+        model = CovarianceModel(ids, days, z, z, 0.0)
+    else:
+        shrunk, delta = ledoit_wolf(r)
+        # the sample estimate uses n-1; rescale the shrunk one to match
+        model = CovarianceModel(ids, days, sample_covariance(r) * TRADING_DAYS, shrunk * (len(r) / (len(r) - 1)) * TRADING_DAYS, delta)
+    with _lock:
+        _models[key] = model
+        _models.move_to_end(key)
+        while len(_models) > _MAX_MODELS:
+            _models.popitem(last=False)
+    return model
@@ -0,0 +1,140 @@
+# app/services/rolling.py
+from __future__ import annotations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.metrics import TRADING_DAYS
+
+# Rolling statistics over the last `w` daily returns at every row, in O(n)
+# whatever the window:
+#   - moments (vol, Sharpe, Sortino, beta) are differences of two prefix sums
+#     per row; returns are centred on their overall mean first so the sums
+#     don't lose the variance to cancellation on long series;
+#   - max drawdown is a sliding-window aggregate kept in a two-stack queue,
+#     each value pushed and popped once.
+# The window ending at row i spans returns i-w+1..i, i.e. values i-w..i, so
+# row w is the first with a full window; earlier rows are NaN.
+
+def simple_returns(values: np.ndarray) -> np.ndarray:
+    """Close-to-close returns; NaN on row 0 and next to missing values, 0 after a zero value."""
+    v = np.asarray(values, dtype=np.float64)
+    r = np.full(len(v), np.nan)
+    if len(v) > 1:
+        prev, cur = v[:-1], v[1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r[1:] = np.where(prev == 0, np.where(np.isnan(cur), np.nan, 0.0), cur / prev - 1.0)
+    return r
+
+def align_to(days: np.ndarray, src_days: np.ndarray, src_values: np.ndarray) -> np.ndarray:
+    """`src_values` on `days`, forward-filled; NaN before the first source day."""
+    idx = np.searchsorted(src_days, days, side="right") - 1
+    return np.where(idx >= 0, np.asarray(src_values, dtype=np.float64)[np.maximum(idx, 0)], np.nan)
+
+def _wsum(x: np.ndarray, w: int) -> np.ndarray:
+    """Sum of x over the w rows ending at each row (NaN until w rows exist)."""
+    out = np.full(len(x), np.nan)
+    if len(x) >= w:
+        cs = np.concatenate(([0.0], np.cumsum(x)))
+        out[w - 1:] = cs[w:] - cs[:-w]
+    return out
+
+def _centred(x: np.ndarray, ok: np.ndarray) -> Tuple[np.ndarray, float]:
+    c = x[ok].mean() if ok.any() else 0.0
+    return np.where(ok, x - c, 0.0), c
+
+# ---------- drawdown ----------
+
+Agg = Tuple[float, float, float]   # (peak, trough, worst drawdown) of a run of values
+
+def _join(a: Agg, b: Agg) -> Agg:
+    """Aggregate of run `a` followed by run `b`."""
+    cross = b[1] / a[0] - 1.0 if a[0] > 0 else 0.0
+    return (max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2], cross))
+
+def rolling_max_drawdown(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Worst peak-to-trough decline within values i-window..i at each row
+    (negative, like services.metrics). `values` must be finite.
+    """
+    v = np.asarray(values, dtype=np.float64).tolist()
+    out = np.full(len(v), np.nan)
+    front: List[Agg] = []          # front[-1]: aggregate of the whole front, oldest value first
+    back: List[float] = []
+    back_agg: Optional[Agg] = None
+    for i, x in enumerate(v):
+        back.append(x)
+        back_agg = (x, x, 0.0) if back_agg is None else _join(back_agg, (x, x, 0.0))
+        if i > window:
+            if not front:
+                agg: Optional[Agg] = None
+                for y in reversed(back):
+                    agg = (y, y, 0.0) if agg is None else _join((y, y, 0.0), agg)
+                    front.append(agg)
+                back, back_agg = [], None
+            front.pop()
+        if i >= window:
+            if front and back_agg is not None:
+                out[i] = _join(front[-1], back_agg)[2]
+            else:
+                out[i] = (front[-1] if front else back_agg)[2]
+    return out
+
+# ---------- moments ----------
+
+def rolling_metrics(
+    values: np.ndarray,
+    windows: Sequence[int],
+    rf_annual: float = 0.0,
+    benchmark: Optional[np.ndarray] = None,
+) -> Dict[int, Dict[str, np.ndarray]]:
+    """
+    Annualised vol, Sharpe, Sortino, max drawdown and, with benchmark values
+    on the same rows, beta, for each window (in returns). Conventions follow
+    services.metrics; a row is NaN unless its window holds `w` valid returns.
+    """
+    v = np.asarray(values, dtype=np.float64)
+    r = simple_returns(v)
+    ok = np.isfinite(r)
+    rc, c = _centred(r, ok)
+    rf_daily = rf_annual / TRADING_DAYS
+    down = np.where(ok, np.minimum(r - rf_daily, 0.0), 0.0)
+    ann = np.sqrt(TRADING_DAYS)
+
+    if benchmark is not None:
+        rb = simple_returns(benchmark)
+        both = ok & np.isfinite(rb)
+        x, _ = _centred(r, both)
+        y, _ = _centred(rb, both)
+
+    out: Dict[int, Dict[str, np.ndarray]] = {}
+    for w in windows:
+        n = _wsum(ok.astype(np.float64), w)
+        full = n >= w
+        with np.errstate(divide="ignore", invalid="ignore"):
+            s1 = _wsum(rc, w)
+            mu = s1 / n + c
+            sigma = np.sqrt(np.maximum((_wsum(rc * rc, w) - s1 * s1 / n) / (n - 1), 0.0))
+            dd_sigma = np.sqrt(_wsum(down * down, w) / (n - 1))
+            excess = mu - rf_daily
+            sharpe = np.where(sigma > 0, excess / sigma, 0.0) * ann
+            sortino = np.where(dd_sigma > 0, excess / dd_sigma, 0.0) * ann
+        stats = {
+            "vol": sigma * ann,
+            "sharpe": sharpe,
+            "sortino": sortino,
+            "max_drawdown": rolling_max_drawdown(v, w) if np.isfinite(v).all() else np.full(len(v), np.nan),
+        }
+        for k in stats:
+            stats[k] = np.where(full, stats[k], np.nan)
+
+        if benchmark is not None:
+            m = _wsum(both.astype(np.float64), w)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                sx, sy = _wsum(x, w), _wsum(y, w)
+                cov = _wsum(x * y, w) - sx * sy / m
+                var_b = _wsum(y * y, w) - sy * sy / m
+                beta = np.where(var_b > 0, cov / var_b, np.nan)
+            stats["beta"] = np.where(m >= w, beta, np.nan)
+        out[w] = stats
+    return out
@@ -0,0 +1,308 @@
+# app/services/screener.py
+from __future__ import annotations
+import ast
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db import models
+from services import indicators as ind
+from services.metrics import TRADING_DAYS
+from services.price_store import PriceSeries, price_store
+
+log = logging.getLogger("screener")
+
+# A feature table holds one row per instrument (its latest bar) and one
+# float64 column per feature, built nightly from the price store and saved
+# as a single .npz under SCREENER_DIR. Screens are small Python-syntax
+# expressions, e.g.
+#     rsi(14) < 30 and close > sma(200) and avg_volume(20) > 2 * avg_volume(50)
+# parsed with `ast` and evaluated as whole-column numpy operations; nothing is
+# ever passed to eval. `name(n)` is shorthand for the column `name_n`.
+
+SMA_WINDOWS = (10, 20, 50, 100, 200)
+EMA_WINDOWS = (12, 26, 50, 200)
+RETURN_WINDOWS = (1, 5, 21, 63, 126, 252)
+TEXT_COLUMNS = ("symbol", "exchange", "sector", "industry")
+MAX_QUERY_LEN = 500
+MAX_QUERY_NODES = 200
+
+_FILE = "features.npz"
+_RECHECK_SEC = 30.0
+_LOAD_BATCH = 500   # instruments per price store read while building
+
+@dataclass
+class FeatureTable:
+    built_at: datetime
+    instrument_ids: np.ndarray          # (N,) int64, ordered by symbol
+    days: np.ndarray                    # (N,) epoch day of each instrument's latest bar
+    text: Dict[str, np.ndarray]         # TEXT_COLUMNS, unicode ('' when unknown)
+    columns: Dict[str, np.ndarray]      # feature -> (N,) float64, NaN when not defined
+
+    def __len__(self) -> int:
+        return len(self.instrument_ids)
+
+    def column(self, name: str) -> np.ndarray:
+        if name in self.columns:
+            return self.columns[name]
+        if name in self.text:
+            return self.text[name]
+        raise ValueError(f"unknown field '{name}'")
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fh:
+            np.savez(
+                fh,
+                _built_at=np.array(self.built_at.timestamp()),
+                _instrument_id=self.instrument_ids,
+                _day=self.days,
+                **{"t_" + k: v for k, v in self.text.items()},
+                **{"f_" + k: v for k, v in self.columns.items()},
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FeatureTable":
+        with np.load(path, allow_pickle=False) as z:
+            return cls(
+                datetime.fromtimestamp(float(z["_built_at"]), tz=timezone.utc),
+                z["_instrument_id"],
+                z["_day"],
+                {k[2:]: z[k] for k in z.files if k.startswith("t_")},
+                {k[2:]: z[k] for k in z.files if k.startswith("f_")},
+            )
+
+# ---------- build ----------
+
+def _last(x: np.ndarray) -> float:
+    return float(x[-1]) if len(x) else float("nan")
+
+def instrument_features(s: PriceSeries) -> Dict[str, float]:
+    """Features of one instrument at its latest bar, measured over its whole history."""
+    c = s.close
+    out: Dict[str, float] = {
+        "close": _last(c), "open": _last(s.open), "high": _last(s.high), "low": _last(s.low),
+        "volume": _last(s.volume), "bars": float(len(c)),
+    }
+    for w, v in ind.sma_many(c, SMA_WINDOWS).items():
+        out[f"sma_{w}"] = _last(v)
+    for w, v in ind.ema_many(c, EMA_WINDOWS).items():
+        out[f"ema_{w}"] = _last(v)
+    out["rsi_14"] = _last(ind.rsi_array(c, 14))
+    for name, v in ind.macd(c).items():
+        out["macd" if name == "macd" else f"macd_{name}"] = _last(v)
+    for name, v in ind.bollinger(c).items():
+        out[f"bb_{name}"] = _last(v)
+    out["atr_14"] = _last(ind.atr(s.high, s.low, c, 14))
+    for w in RETURN_WINDOWS:
+        out[f"ret_{w}"] = float(c[-1] / c[-1 - w] - 1.0) if len(c) > w and c[-1 - w] > 0 else float("nan")
+    for w in (20, 50):
+        vol = s.volume[-w:]
+        out[f"avg_volume_{w}"] = float(np.nanmean(vol)) if len(vol) == w and np.isfinite(vol).any() else float("nan")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.diff(np.log(c)) if len(c) > 1 else np.empty(0)
+    for w in (20, 63):
+        out[f"volatility_{w}"] = float(r[-w:].std(ddof=1) * np.sqrt(TRADING_DAYS)) if len(r) >= w else float("nan")
+    out["high_252"] = float(np.nanmax(s.high[-252:])) if len(c) >= 252 else float("nan")
+    out["low_252"] = float(np.nanmin(s.low[-252:])) if len(c) >= 252 else float("nan")
+    return out
+
+def build_features(db: Session) -> FeatureTable:
+    """Features of every instrument that has bars, read through the price store in batches."""
+    I = models.Instrument
+    meta = db.query(I.id, I.symbol, I.exchange, I.sector, I.industry).order_by(I.symbol, I.id).all()
+    ids: List[int] = []
+    days: List[int] = []
+    rows: List[Dict[str, float]] = []
+    text: Dict[str, List[str]] = {k: [] for k in TEXT_COLUMNS}
+    for lo in range(0, len(meta), _LOAD_BATCH):
+        batch = meta[lo:lo + _LOAD_BATCH]
+        series = price_store.get_many(db, [m[0] for m in batch])
+        for iid, symbol, exchange, sector, industry in batch:
+            s = series[iid]
+            if not len(s):
+                continue
+            ids.append(iid)
+            days.append(int(s.days[-1]))
+            rows.append(instrument_features(s))
+            for k, v in zip(TEXT_COLUMNS, (symbol, exchange, sector, industry)):
+                text[k].append(v or "")
+    names = sorted({k for r in rows for k in r})
+    return FeatureTable(
+        datetime.now(timezone.utc),
+        np.array(ids, dtype=np.int64),
+        np.array(days, dtype=np.int64),
+        {k: np.array(v, dtype=str) for k, v in text.items()},
+        {n: np.array([r.get(n, np.nan) for r in rows], dtype=np.float64) for n in names},
+    )
+
+_lock = threading.Lock()
+_table: Optional[FeatureTable] = None
+_table_mtime: Optional[float] = None
+_checked_at = 0.0
+
+def export_features(db: Session, root: Optional[str] = None) -> Dict[str, int]:
+    """Rebuild the feature table, save it under SCREENER_DIR (when set) and serve it from now on."""
+    global _table, _table_mtime, _checked_at
+    table = build_features(db)
+    root = root if root is not None else settings.screener_dir
+    mtime = None
+    if root:
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, _FILE)
+        table.save(path)
+        mtime = os.path.getmtime(path)
+    with _lock:
+        _table, _table_mtime, _checked_at = table, mtime, time.monotonic()
+    stats = {"instruments": len(table), "features": len(table.columns)}
+    log.info("screener_features_export", extra=stats)
+    return stats
+
+def current_features() -> Optional[FeatureTable]:
+    """
+    The latest feature table: SCREENER_DIR's file (re-checked every few
+    seconds, so another worker's export is picked up) or the last one built in
+    this process; None until the first export. Tables are only built by the
+    jobs, never inside a request.
+    """
+    global _table, _table_mtime, _checked_at
+    root = settings.screener_dir
+    with _lock:
+        now = time.monotonic()
+        if _table is not None and now - _checked_at < _RECHECK_SEC:
+            return _table
+        _checked_at = now
+        path = os.path.join(root, _FILE) if root else None
+        try:
+            mtime = os.path.getmtime(path) if path else None
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != _table_mtime:
+            try:
+                _table, _table_mtime = FeatureTable.load(path), mtime
+            except (OSError, ValueError, KeyError):
+                log.warning("screener_features_unreadable", exc_info=True, extra={"path": path})
+        return _table
+
+# ---------- queries ----------
+
+_CMP = {
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+    ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+_ARITH = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+@dataclass
+class Evaluator:
+    table: FeatureTable
+    fields: Set[str] = field(default_factory=set)   # columns the expression read
+
+    def __call__(self, expr: str) -> np.ndarray:
+        if len(expr) > MAX_QUERY_LEN:
+            raise ValueError(f"expression longer than {MAX_QUERY_LEN} characters")
+        try:
+            tree = ast.parse(expr.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"invalid expression: {e.msg}") from None
+        if sum(1 for _ in ast.walk(tree)) > MAX_QUERY_NODES:
+            raise ValueError("expression too long")
+        try:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out = self._eval(tree.body)
+        except TypeError:
+            raise ValueError("operands of incompatible types (text fields only support ==, != and in)") from None
+        return np.broadcast_to(out, (len(self.table),))
+
+    def _column(self, name: str) -> np.ndarray:
+        col = self.table.column(name)
+        self.fields.add(name)
+        return col
+
+    def _eval(self, node: ast.AST):
+        if isinstance(node, ast.BoolOp):
+            parts = [self._bool(v) for v in node.values]
+            op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return op.reduce(parts)
+        if isinstance(node, ast.UnaryOp):
+            if isinstance(node.op, ast.Not):
+                return np.logical_not(self._bool(node.operand))
+            if isinstance(node.op, ast.USub):
+                return np.negative(self._eval(node.operand))
+        if isinstance(node, ast.Compare):
+            left = self._eval(node.left)
+            out = None
+            for op, right_node in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)):
+                    hit = np.isin(left, self._literal_list(right_node))
+                    res = hit if isinstance(op, ast.In) else ~hit
+                    right = None
+                elif type(op) in _CMP:
+                    right = self._eval(right_node)
+                    res = _CMP[type(op)](left, right)
+                else:
+                    raise ValueError(f"unsupported comparison: {type(op).__name__}")
+                out = res if out is None else np.logical_and(out, res)
+                left = right
+            return out
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITH:
+            return _ARITH[type(node.op)](self._eval(node.left), self._eval(node.right))
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)) and not isinstance(node.value, bool):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self._column(node.id.lower())
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and len(node.args) == 1 and not node.keywords
+                and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, int)):
+            return self._column(f"{node.func.id.lower()}_{node.args[0].value}")
+        raise ValueError(f"unsupported syntax: {ast.unparse(node)}")
+
+    def _bool(self, node: ast.AST) -> np.ndarray:
+        v = np.asarray(self._eval(node))
+        if v.dtype != bool:
+            raise ValueError(f"not a condition: {ast.unparse(node)}")
+        return v
+
+    def _literal_list(self, node: ast.AST) -> list:
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)) and all(isinstance(e, ast.Constant) for e in node.elts):
+            return [e.value for e in node.elts]
+        raise ValueError("`in` needs a literal list, e.g. sector in ('Energy', 'Utilities')")
+
+@dataclass
+class ScreenResult:
+    table: FeatureTable
+    rows: np.ndarray        # table rows of this page, in order
+    total: int              # rows matching the query
+    fields: List[str]       # columns read by the query and sort
+
+def screen(table: FeatureTable, query: Optional[str], sort: Optional[str], limit: int, offset: int) -> ScreenResult:
+    """
+    Rows matching `query` (all when empty), ordered by the `sort` expression
+    (a leading '-' for descending; missing values last), paged.
+    """
+    ev = Evaluator(table)
+    mask = ev(query) if query and query.strip() else np.ones(len(table), dtype=bool)
+    if mask.dtype != bool:
+        raise ValueError("query must be a condition, e.g. rsi(14) < 30")
+    rows = np.flatnonzero(mask)
+    if sort and sort.strip():
+        expr = sort.strip()
+        desc = expr.startswith("-")
+        key = np.asarray(ev(expr.lstrip("-")))[rows]
+        if key.dtype.kind not in "fiu":
+            order = np.argsort(key, kind="stable")
+            order = order[::-1] if desc else order
+        else:
+            key = key.astype(np.float64)
+            missing = np.isnan(key)
+            order = np.lexsort(((-key if desc else key), missing))
+        rows = rows[order]
+    text = set(TEXT_COLUMNS)
+    return ScreenResult(table, rows[offset:offset + limit], int(mask.sum()), sorted(ev.fields - text))
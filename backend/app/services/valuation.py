@@ -0,0 +1,320 @@
+# app/services/valuation.py
+from __future__ import annotations
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db import models
+from services.panel import from_series
+from services.price_store import PriceSeries, price_store
+
+log = logging.getLogger("valuation")
+
+# Transaction-aware valuation. The log is replayed into per-instrument share
+# counts on the trading calendar, valued at each close, with the external cash
+# flow of every day alongside:
+#   BUY       qty += q           flow += q * price + fees   (money put in)
+#   SELL      qty -= q           flow -= q * price - fees   (money taken out)
+#   DIVIDEND  qty unchanged      flow -= q * price - fees   (q shares x cash per share, paid out)
+#   SPLIT     qty *= q           no flow                    (q = new shares per old share)
+# A transaction counts from the close of its day (the next trading day's
+# close if it falls on a non-trading day).
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MAX_STATES = 256
+
+@dataclass(frozen=True)
+class _Tx:
+    id: object
+    instrument_id: int
+    kind: str
+    qty: float
+    price: float
+    fees: float
+    day: int        # epoch day (UTC) of executed_at
+
+    @property
+    def flow(self) -> float:
+        if self.kind == "BUY":
+            return self.qty * self.price + self.fees
+        if self.kind == "SELL":
+            return -(self.qty * self.price - self.fees)
+        if self.kind == "DIVIDEND":
+            return -(self.qty * self.price - self.fees)
+        return 0.0
+
+@dataclass
+class Replay:
+    """Positions, value and flows on every trading day from the first transaction on."""
+    days: np.ndarray            # int64 epoch days
+    instrument_ids: List[int]
+    qty: np.ndarray             # (days x instruments) shares held at the close
+    value: np.ndarray           # market value at the close
+    flow: np.ndarray            # net external flow on the day (see module notes)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def timestamps(self) -> List[datetime]:
+        return [_EPOCH + timedelta(days=d) for d in self.days.tolist()]
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> "Replay":
+        lo, hi = 0, len(self.days)
+        if start is not None:
+            lo = int(np.searchsorted(self.days, _day_ceil(start), side="left"))
+        if end is not None:
+            hi = int(np.searchsorted(self.days, _day(end), side="right"))
+        return Replay(self.days[lo:hi], self.instrument_ids, self.qty[lo:hi], self.value[lo:hi], self.flow[lo:hi])
+
+def _day(t: datetime) -> int:
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(t.timestamp() // 86400)
+
+def _day_ceil(t: datetime) -> int:
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return int(-(-t.timestamp() // 86400))
+
+# ---------- returns ----------
+
+def daily_twr(value: np.ndarray, flow: np.ndarray) -> np.ndarray:
+    """
+    Flow-neutral daily returns, (V_t - F_t) / V_{t-1} - 1, with flows at the
+    close. The first day (and any day after a zero value) is 0.
+    """
+    r = np.zeros(len(value))
+    if len(value) < 2:
+        return r
+    prev = value[:-1]
+    ok = prev > 0
+    r[1:][ok] = (value[1:][ok] - flow[1:][ok]) / prev[ok] - 1.0
+    return r
+
+def twr_index(value: np.ndarray, flow: np.ndarray) -> np.ndarray:
+    """Growth of 1 under the time-weighted return, for drawdowns and CAGR."""
+    return np.cumprod(1.0 + daily_twr(value, flow))
+
+def irr(amounts: np.ndarray, years: np.ndarray, guess: float = 0.1, tol: float = 1e-10, max_iter: int = 100) -> Optional[float]:
+    """
+    Annual rate r with sum(amounts * (1 + r) ** -years) == 0. Newton steps on
+    the whole cash-flow vector, with bisection as a fallback; None if there is
+    no sign change to solve for.
+    """
+    if len(amounts) < 2 or not ((amounts > 0).any() and (amounts < 0).any()):
+        return None
+
+    def npv(r: float) -> float:
+        return float(np.dot(amounts, np.power(1.0 + r, -years)))
+
+    r = guess
+    for _ in range(max_iter):
+        disc = np.power(1.0 + r, -years)
+        f = float(np.dot(amounts, disc))
+        df = float(np.dot(-years * amounts, disc / (1.0 + r)))
+        if df == 0 or not np.isfinite(f):
+            break
+        step = f / df
+        r_next = r - step
+        if r_next <= -1.0:
+            r_next = (r - 1.0) / 2.0  # stay in the domain
+        if abs(r_next - r) < tol:
+            return r_next
+        r = r_next
+
+    lo, hi = -0.9999, 1.0
+    while npv(hi) * npv(lo) > 0 and hi < 1e6:
+        hi *= 10.0
+    f_lo = npv(lo)
+    if f_lo * npv(hi) > 0:
+        return None
+    for _ in range(200):
+        mid = (lo + hi) / 2.0
+        f_mid = npv(mid)
+        if abs(f_mid) < tol or hi - lo < tol:
+            return mid
+        if f_lo * f_mid < 0:
+            hi = mid
+        else:
+            lo, f_lo = mid, f_mid
+    return (lo + hi) / 2.0
+
+def money_weighted_return(rp: Replay) -> Optional[float]:
+    """
+    Annualised IRR of the window: what was held at its first close counts as
+    money put in, later flows as they happened, and the last value as money out.
+    """
+    return money_weighted(rp.days, rp.value, rp.flow)
+
+def money_weighted(days: np.ndarray, value: np.ndarray, flow: np.ndarray) -> Optional[float]:
+    """money_weighted_return on plain (days, value, flow) arrays."""
+    if len(days) < 2:
+        return None
+    amounts = -flow.copy()
+    amounts[0] = -value[0]
+    amounts[-1] += value[-1]
+    years = (days - days[0]) / 365.25
+    return irr(amounts, years)
+
+# ---------- replay ----------
+
+def _load_transactions(db: Session, portfolio_id) -> List[_Tx]:
+    T = models.Transaction
+    rows = (
+        db.query(T.id, T.instrument_id, T.type, T.qty, T.price, T.fees, T.executed_at)
+          .filter(T.portfolio_id == portfolio_id)
+          .order_by(T.executed_at.asc(), T.id.asc())
+          .all()
+    )
+    out: List[_Tx] = []
+    for tid, iid, kind, qty, price, fees, at in rows:
+        kind = (kind or "").strip().upper()
+        if kind not in ("BUY", "SELL", "DIVIDEND", "SPLIT") or (kind == "SPLIT" and not (qty and qty > 0)):
+            log.warning("transaction_skipped", extra={"transaction_id": str(tid), "type": kind})
+            continue
+        out.append(_Tx(tid, iid, kind, float(qty or 0), float(price or 0), float(fees or 0), _day(at)))
+    return out
+
+def _positions(txs: Sequence[_Tx], rows: np.ndarray, n_rows: int, q0: float) -> np.ndarray:
+    """
+    Shares held at each row's close for one instrument. `rows[k]` is the row of
+    txs[k]; the recurrence q_k = q_{k-1} * m_k + a_k (m = split ratio, a =
+    shares bought/sold) is solved in closed form with cumprod/cumsum.
+    """
+    m = np.array([t.qty if t.kind == "SPLIT" else 1.0 for t in txs])
+    a = np.array([t.qty if t.kind == "BUY" else -t.qty if t.kind == "SELL" else 0.0 for t in txs])
+    M = np.cumprod(m)
+    q = M * (q0 + np.cumsum(a / M))
+    idx = np.searchsorted(rows, np.arange(n_rows), side="right") - 1
+    out = np.where(idx >= 0, q[np.maximum(idx, 0)], q0)
+    return out
+
+def _replay(
+    series: Dict[int, PriceSeries],
+    instrument_ids: List[int],
+    txs: Sequence[_Tx],
+    first_day: int,
+    q0: np.ndarray,
+) -> Replay:
+    """Replay `txs` onto positions `q0` held before `first_day`, for every trading day from it on."""
+    start = _EPOCH + timedelta(days=first_day)
+    panel = from_series([series[i] for i in instrument_ids], start=start)
+    days = panel.days
+    close = np.full((len(days), len(instrument_ids)), np.nan)
+    col = {iid: j for j, iid in enumerate(panel.instrument_ids)}
+    for iid, j in col.items():
+        close[:, instrument_ids.index(iid)] = panel.close[:, j]
+
+    qty = np.empty((len(days), len(instrument_ids)))
+    tx_rows = np.searchsorted(days, np.array([t.day for t in txs], dtype=np.int64), side="left")
+    for j, iid in enumerate(instrument_ids):
+        mine = [k for k, t in enumerate(txs) if t.instrument_id == iid]
+        if mine:
+            qty[:, j] = _positions([txs[k] for k in mine], tx_rows[mine], len(days), q0[j])
+        else:
+            qty[:, j] = q0[j]
+        # no bar yet: hold the position at the price it was first traded at
+        missing = np.isnan(close[:, j])
+        if missing.any():
+            first_px = next((txs[k].price for k in mine if txs[k].price > 0), 0.0)
+            close[missing, j] = first_px
+
+    flows = np.array([t.flow for t in txs])
+    pending = tx_rows < len(days)  # after the last bar: picked up once bars arrive
+    flow = np.bincount(tx_rows[pending], weights=flows[pending], minlength=len(days)) if len(days) else np.empty(0)
+    value = np.einsum("ij,ij->i", qty, close) if len(days) else np.empty(0)
+    return Replay(days, list(instrument_ids), qty, value, flow)
+
+def replay_since(db: Session, portfolio_id, first_day: int) -> Optional[Replay]:
+    """
+    The replay from `first_day` on, starting from the positions the
+    transactions before it leave. None when that can't match a full replay:
+    an instrument without a bar before `first_day` is valued at its first
+    trade price there, or there are no transactions.
+    """
+    txs = _load_transactions(db, portfolio_id)
+    if not txs:
+        return None
+    instrument_ids = list(dict.fromkeys(t.instrument_id for t in txs))
+    series = price_store.get_many(db, instrument_ids)
+    if not all(len(series[iid]) and series[iid].days[0] < first_day for iid in instrument_ids):
+        return None
+    q0 = np.zeros(len(instrument_ids))
+    for j, iid in enumerate(instrument_ids):
+        mine = [t for t in txs if t.instrument_id == iid and t.day < first_day]
+        if mine:
+            q0[j] = _positions(mine, np.zeros(len(mine), dtype=np.int64), 1, 0.0)[0]
+    return _replay(series, instrument_ids, [t for t in txs if t.day >= first_day], first_day, q0)
+
+@dataclass
+class _State:
+    replay: Replay
+    fingerprint: Dict[object, tuple]
+    bars_upto: Dict[int, int]   # bars on or before the last replayed day, per instrument
+
+def _bars_upto(series: Dict[int, PriceSeries], day: int) -> Dict[int, int]:
+    return {iid: int(np.searchsorted(s.days, day, side="right")) for iid, s in series.items()}
+
+_lock = threading.Lock()
+_states: "OrderedDict[object, _State]" = OrderedDict()
+
+def _remember(portfolio_id, state: _State) -> None:
+    with _lock:
+        _states[portfolio_id] = state
+        _states.move_to_end(portfolio_id)
+        while len(_states) > _MAX_STATES:
+            _states.popitem(last=False)
+
+def forget(portfolio_id) -> None:
+    """Drop the remembered replay, e.g. after bars before its last day were revised."""
+    with _lock:
+        _states.pop(portfolio_id, None)
+
+def replay_portfolio(db: Session, portfolio_id) -> Replay:
+    """
+    Replay a portfolio's transactions against stored closes.
+    The previous result is reused when the log only gained transactions
+    dated on or after its last day, no bars were added before that day and
+    every instrument already had a bar before it: only the last day onward is
+    recomputed, from the positions and closes before it.
+    Anything else (edits, deletions, backdated trades) replays from scratch.
+    """
+    txs = _load_transactions(db, portfolio_id)
+    if not txs:
+        return Replay(np.empty(0, dtype=np.int64), [], np.empty((0, 0)), np.empty(0), np.empty(0))
+    fingerprint = {t.id: (t.instrument_id, t.kind, t.qty, t.price, t.fees, t.day) for t in txs}
+    instrument_ids = list(dict.fromkeys(t.instrument_id for t in txs))
+    series = price_store.get_many(db, instrument_ids)
+
+    with _lock:
+        prev = _states.get(portfolio_id)
+    rp = None
+    if prev is not None and len(prev.replay) >= 2 and prev.replay.instrument_ids == instrument_ids:
+        old = prev.replay
+        new_days = [t.day for t in txs if t.id not in prev.fingerprint]
+        unchanged = all(fingerprint.get(k) == v for k, v in prev.fingerprint.items())
+        k = len(old) - 1
+        # the tail panel carries each instrument's last close forward from before it starts;
+        # one with no bar by then is valued at its first trade price, which only a full replay knows
+        seeded = all(len(series[iid]) and series[iid].days[0] <= old.days[k - 1] for iid in instrument_ids)
+        if unchanged and seeded and all(d >= old.days[-1] for d in new_days) and prev.bars_upto == _bars_upto(series, int(old.days[-1])):
+            # rewind to the last replayed day: its bar or its transactions may have changed
+            tail = _replay(series, instrument_ids, [t for t in txs if t.day > old.days[k - 1]], int(old.days[k - 1]) + 1, old.qty[k - 1])
+            rp = Replay(
+                np.concatenate([old.days[:k], tail.days]),
+                instrument_ids,
+                np.concatenate([old.qty[:k], tail.qty]),
+                np.concatenate([old.value[:k], tail.value]),
+                np.concatenate([old.flow[:k], tail.flow]),
+            )
+    if rp is None:
+        rp = _replay(series, instrument_ids, txs, txs[0].day, np.zeros(len(instrument_ids)))
+    if len(rp):
+        _remember(portfolio_id, _State(rp, fingerprint, _bars_upto(series, int(rp.days[-1]))))
+    return rp
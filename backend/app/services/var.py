@@ -0,0 +1,164 @@
+# app/services/var.py
+from __future__ import annotations
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger("var")
+
+# Value at risk and expected shortfall (CVaR) of a portfolio as positive
+# fractions of its value, per horizon (trading days) and confidence level.
+# Kept free of database imports: Monte Carlo chunks run in spawned worker
+# processes that import only this module.
+
+Table = Dict[int, Dict[float, Dict[str, float]]]   # horizon -> level -> {"var", "cvar"}
+
+MC_CHUNK = 20_000   # paths per task; also the unit of seeding, so results don't depend on the worker count
+
+def _tail(returns: np.ndarray, level: float) -> Dict[str, float]:
+    q = float(np.quantile(returns, 1.0 - level))
+    return {"var": -q, "cvar": -float(returns[returns <= q].mean())}
+
+def historical(rp: np.ndarray, levels: Sequence[float], horizons: Sequence[int]) -> Table:
+    """From the portfolio's own daily returns; h-day returns are compounded over overlapping windows."""
+    out: Table = {}
+    cum = np.concatenate(([0.0], np.cumsum(np.log1p(rp))))
+    for h in horizons:
+        if len(rp) < h:
+            continue
+        rh = np.expm1(cum[h:] - cum[:-h])
+        out[h] = {a: _tail(rh, a) for a in levels}
+    return out
+
+def parametric(mu: float, sigma: float, levels: Sequence[float], horizons: Sequence[int]) -> Table:
+    """Normal daily returns with mean `mu` and volatility `sigma`, scaled by h and sqrt(h)."""
+    nd = NormalDist()
+    out: Table = {}
+    for h in horizons:
+        m, s = mu * h, sigma * np.sqrt(h)
+        out[h] = {}
+        for a in levels:
+            z = nd.inv_cdf(a)
+            out[h][a] = {"var": float(z * s - m), "cvar": float(s * nd.pdf(z) / (1.0 - a) - m)}
+    return out
+
+def cholesky(cov: np.ndarray) -> np.ndarray:
+    """Lower factor of `cov`; falls back to the eigen square root when it isn't positive definite."""
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        vals, vecs = np.linalg.eigh(cov)
+        return vecs * np.sqrt(np.clip(vals, 0.0, None))
+
+def simulate_chunk(mu: np.ndarray, chol: np.ndarray, w: np.ndarray, horizons: Sequence[int], n: int, seed: np.random.SeedSequence) -> np.ndarray:
+    """
+    Portfolio returns of `n` simulated paths at each horizon, shape (n, len(horizons)).
+    Daily asset returns are mu + chol @ z; positions compound separately and
+    are summed with weights `w` (fractions of the starting value).
+    """
+    rng = np.random.default_rng(seed)
+    growth = np.ones((n, len(mu)))
+    out = np.empty((n, len(horizons)))
+    col = {h: j for j, h in enumerate(horizons)}
+    for t in range(1, max(horizons) + 1):
+        growth *= 1.0 + mu + rng.standard_normal((n, len(mu))) @ chol.T
+        if t in col:
+            out[:, col[t]] = growth @ w - w.sum()
+    return out
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the API process runs threads (scheduler, thread pool), which fork doesn't mix with
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        return _pool
+
+def _ready() -> None:
+    pass
+
+def warm_pool(workers: int) -> None:
+    """
+    Start the worker processes now: spawning them and importing numpy takes
+    longer than a request's budget, so a cold pool would drop every chunk of
+    the first requests. Returns without waiting for them.
+    """
+    if workers > 0:
+        pool = _get_pool(workers)
+        for _ in range(workers):
+            pool.submit(_ready)
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def monte_carlo(
+    mu: np.ndarray,
+    cov: np.ndarray,
+    w: np.ndarray,
+    levels: Sequence[float],
+    horizons: Sequence[int],
+    paths: int,
+    seed: int,
+    workers: int = 0,
+    budget_sec: Optional[float] = None,
+) -> Tuple[Table, int]:
+    """
+    VaR/CVaR from correlated normal paths, and the number of paths used.
+    Paths are simulated in chunks of MC_CHUNK, chunk k always seeded with
+    SeedSequence(seed).spawn(...)[k]. With `workers`, chunks after the first go
+    to a process pool while this process runs the first; chunks not finished
+    within `budget_sec` are dropped, so the result is always available in time.
+    """
+    chol = cholesky(cov)
+    horizons = sorted(set(horizons))
+    n_chunks = max(1, -(-paths // MC_CHUNK))
+    sizes = [min(MC_CHUNK, paths - k * MC_CHUNK) for k in range(n_chunks)]
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    deadline = None if budget_sec is None else time.monotonic() + budget_sec
+
+    futures: List[Future] = []
+    if workers > 0 and n_chunks > 1:
+        pool = _get_pool(workers)
+        futures = [pool.submit(simulate_chunk, mu, chol, w, horizons, sizes[k], seeds[k]) for k in range(1, n_chunks)]
+        results = [simulate_chunk(mu, chol, w, horizons, sizes[0], seeds[0])]
+    else:
+        results = []
+        for k in range(n_chunks):
+            if k and deadline is not None and time.monotonic() > deadline:
+                break
+            results.append(simulate_chunk(mu, chol, w, horizons, sizes[k], seeds[k]))
+
+    pending = set(futures)
+    while pending:
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+    if pending:
+        log.warning("monte_carlo_over_budget", extra={"chunks_dropped": len(pending), "chunks": n_chunks})
+        for f in pending:
+            f.cancel()
+    for f in futures:  # in chunk order, so the same chunks give the same numbers
+        if not f.done() or f.cancelled():
+            continue
+        if f.exception() is not None:
+            log.warning("monte_carlo_chunk_failed", exc_info=f.exception())
+            continue
+        results.append(f.result())
+
+    sims = np.concatenate(results)
+    out: Table = {h: {a: _tail(sims[:, j], a) for a in levels} for j, h in enumerate(horizons)}
+    return out, len(sims)
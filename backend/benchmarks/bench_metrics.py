@@ -0,0 +1,69 @@
+# benchmarks/bench_metrics.py  (no database needed)
+# Compares services.metrics.compute_metrics with the list-based functions in
+# services.analytics on synthetic equity curves: same numbers, less time.
+#
+#   python backend/benchmarks/bench_metrics.py [--days 5000] [--series 200]
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# the app's modules import each other from the app directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from services.analytics import SeriesPoint, annualized_stats, cagr, max_drawdown, pct_returns, sharpe_sortino
+from services.metrics import compute_metrics
+
+RF = 0.03
+
+def _legacy(curve):
+    rets = pct_returns(curve)
+    stats = annualized_stats(rets)
+    sharpe, sortino = sharpe_sortino(rets, RF)
+    return {
+        "cagr": cagr(curve), "ann_return": stats["mu"], "ann_vol": stats["sigma"],
+        "sharpe": sharpe, "sortino": sortino, "max_drawdown": max_drawdown(curve),
+    }
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=5000)
+    ap.add_argument("--series", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(42)
+    values = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.012, (args.days, args.series)), axis=0))
+    start = datetime(2000, 1, 3, tzinfo=timezone.utc)
+    days = np.arange(args.days, dtype=np.int64) + (start - datetime(1970, 1, 1, tzinfo=timezone.utc)).days
+    ts = [start + timedelta(days=i) for i in range(args.days)]
+    curves = [[SeriesPoint(t, v) for t, v in zip(ts, values[:, k].tolist())] for k in range(args.series)]
+
+    legacy = [_legacy(c) for c in curves]
+    m = compute_metrics(values, days, RF)
+    worst = max(
+        abs(legacy[k][f] - m.summary(k)[f])
+        for k in range(args.series) for f in legacy[k]
+    )
+    print(f"{args.series} series x {args.days} days; max abs difference {worst:.2e}")
+
+    t_legacy = _best(lambda: [_legacy(c) for c in curves], args.repeat)
+    t_one = _best(lambda: [compute_metrics(values[:, k], days, RF) for k in range(args.series)], args.repeat)
+    t_batch = _best(lambda: compute_metrics(values, days, RF), args.repeat)
+    print(f"list functions       {t_legacy * 1000:9.1f} ms")
+    print(f"kernel, per series   {t_one * 1000:9.1f} ms  ({t_legacy / t_one:5.1f}x)")
+    print(f"kernel, one 2-D call {t_batch * 1000:9.1f} ms  ({t_legacy / t_batch:5.1f}x)")
+
+if __name__ == "__main__":
+    main()